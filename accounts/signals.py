@@ -0,0 +1,11 @@
+# accounts/signals.py
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import CustomUser
+from products.utils import touch_change_version, USERS_VERSION
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def touch_users(sender, **kwargs):
+    # ✅ user list ETag (SSUserListView) changes
+    touch_change_version(USERS_VERSION)
@@ -1,3 +1,31 @@
-from django.test import TestCase
+from django.test import TransactionTestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from accounts.models import CustomUser
+
+
+class SSUserListConditionalTests(TransactionTestCase):  # real commits -> "users" version bumps
+    url = "/api/accounts/users/ss/"
+
+    def setUp(self):
+        self.crm = CustomUser.objects.create_user(mobile="9100000001", role="CRM", password="p", name="crm")
+        CustomUser.objects.create_user(mobile="9200000001", role="SS", password="p", name="ss", crm=self.crm)
+        self.client = APIClient()
+        self.client.force_authenticate(self.crm)
+
+    def test_304_until_a_user_changes(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        etag = first["ETag"]
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"]).status_code, 304)
+
+        CustomUser.objects.create_user(mobile="9200000002", role="SS", password="p", name="ss2", crm=self.crm)
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], etag)
+        self.assertEqual(len(second.data), 2)
+
+        self.crm.name = "crm renamed"
+        self.crm.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=second["ETag"]).status_code, 200)
@@ -8,6 +8,7 @@ from rest_framework.permissions import IsAuthenticated
 from .serializers import  SSUserSerializer, UserSerializer, SSUserSerializerDealer
 from .models import CustomUser
 from accounts.permissions import IsCRMOrAdmin
+from products.utils import conditional_on_versions, USERS_VERSION
 
 
 class IsCRM(permissions.BasePermission):
@@ -139,6 +140,10 @@ class SSUserViewSet(viewsets.ModelViewSet):
 class SSUserListView(ListAPIView):
     serializer_class = SSUserSerializerDealer
 
+    @conditional_on_versions(USERS_VERSION)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
         return (
             CustomUser.objects
@@ -3,6 +3,12 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve this (not wsgi.py) for the live event stream at /api/events/stream/
+(browsers: POST /api/events/stream-token/ first, then open the stream with
+?stream_token=...), e.g. ``gunicorn backend.asgi:application -k uvicorn.workers.UvicornWorker``.
+Events are fanned out in-process (orders.events.LocalBroker), so each
+worker process pushes what happens inside it.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -2,6 +2,7 @@ import dj_database_url
 from datetime import timedelta
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -88,6 +89,13 @@ DATABASES = {
 database_url = os.environ.get("DATABASE_URL")
 DATABASES["default"] = dj_database_url.parse(database_url)
 
+# ✅ SQLite tests on a file DB (in-memory shared cache has no busy wait -> threaded tests fail),
+# kept in the system temp dir, not the repo
+if DATABASES["default"]["ENGINE"].endswith("sqlite3"):
+    DATABASES["default"].setdefault("TEST", {}).setdefault(
+        "NAME", os.path.join(tempfile.gettempdir(), "makpower_test_db.sqlite3")
+    )
+
 
 # External DB
 
@@ -0,0 +1,80 @@
+# distributer/placement.py
+# DS cart -> one DSOrder. Shared by DSOrderCreateView and the intake queue worker.
+from .models import DSOrder, DSOrderItem, Product
+from products.pricing import price_lines
+
+
+def reward_product_id(reward):
+    return (
+        reward.get("product_id")
+        or reward.get("product", {}).get("id")
+        if isinstance(reward.get("product"), dict)
+        else reward.get("product")
+    )
+
+
+def ds_cart_product_ids(data):
+    """product_ids of the items + scheme items of one payload (for one in_bulk)."""
+    product_ids = {int(item["id"]) for item in data.get("items", [])}
+    product_ids.update(int(pid) for pid in map(reward_product_id, data.get("eligibleSchemes", [])) if pid)
+    return product_ids
+
+
+def place_ds_order(data, ds_user, products, prices):
+    """
+    Create the DSOrder of one DSOrderCreateView payload.
+    - products: {product_id: Product} fetched up front
+    - prices: DS price book (products.pricing); UnpricedProducts if a product has no price
+    """
+    items = data.get("items", [])
+    scheme_items = data.get("eligibleSchemes", [])
+
+    # ✅ Calculate total amount (ONLY paid items) from the DS price book, not the client's prices
+    unit_prices, total_amount = price_lines(items, prices)
+
+    # ✅ Create SINGLE Order
+    order = DSOrder.objects.create(
+        ds_user=ds_user,
+        total_amount=total_amount,
+        note="Order Created"
+    )
+
+    # ✅ Normal order items
+    rows = []
+    for item in items:
+        product = products.get(int(item["id"]))
+        if product is None:
+            raise Product.DoesNotExist(f"Product {item['id']} not found")
+        rows.append(DSOrderItem(
+            order=order,
+            product=product,
+            quantity=item.get("quantity", 0),
+            price=unit_prices[int(item["id"])],
+            is_scheme_item=False,
+            ds_virtual_stock=item.get(
+                "ds_virtual_stock",
+                getattr(product, "stock_quantity", 0)
+            )
+        ))
+
+    # ✅ Scheme items (price = 0, missing product -> skip)
+    for reward in scheme_items:
+        product_id = reward_product_id(reward)
+        product = products.get(int(product_id)) if product_id else None
+        if product is None:
+            continue
+        rows.append(DSOrderItem(
+            order=order,
+            product=product,
+            quantity=reward.get("quantity", 0),
+            price=0,
+            is_scheme_item=True,
+            ds_virtual_stock=getattr(
+                product,
+                "virtual_stock",
+                getattr(product, "stock_quantity", 0)
+            )
+        ))
+
+    DSOrderItem.objects.bulk_create(rows)
+    return order
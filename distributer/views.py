@@ -10,6 +10,11 @@ from django.shortcuts import get_object_or_404
 from django.db import transaction
 
 from .models import DSOrder, DSOrderItem, Product
+from orders.idempotency import idempotent
+from orders.intake import enqueue_order, wants_queue
+from orders.search import ds_order_id_q, party_q
+from products.pricing import price_book
+from .placement import ds_cart_product_ids, place_ds_order
 from .serializers import DSOrderSerializer, DSOrderSerializerTrack 
 
 import logging
@@ -21,16 +26,20 @@ User = get_user_model()
 class DSOrderCreateView(APIView):
    
 
+    @idempotent
     @transaction.atomic
     def post(self, request):
         try:
             data = request.data
 
+            # ✅ peak load: validate + queue, 202 with a ticket (orders.intake)
+            if wants_queue(request):
+                return enqueue_order(request, "DS", data)
+
             # ✅ Validate user
             ds_user = get_object_or_404(User, id=data.get("user_id"))
 
             items = data.get("items", [])
-            scheme_items = data.get("eligibleSchemes", [])
 
             if not items:
                 return Response(
@@ -38,64 +47,9 @@ class DSOrderCreateView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # ✅ Calculate total amount (ONLY paid items)
-            total_amount = sum(
-                (item.get("price", 0) or 0) * item.get("quantity", 0)
-                for item in items
-            )
-
-            # ✅ Create SINGLE Order
-            order = DSOrder.objects.create(
-                ds_user=ds_user,
-                total_amount=total_amount,
-                note="Order Created"
-            )
-
-            # ✅ Insert normal order items
-            for item in items:
-                product = get_object_or_404(Product, product_id=item["id"])
-
-                DSOrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=item.get("quantity", 0),
-                    price=item.get("price", 0) or 0,
-                    is_scheme_item=False,
-                    ds_virtual_stock=item.get(
-                        "ds_virtual_stock",
-                        getattr(product, "stock_quantity", 0)
-                    )
-                )
-
-            # ✅ Insert scheme items (price = 0)
-            for reward in scheme_items:
-                product_id = (
-                    reward.get("product_id")
-                    or reward.get("product", {}).get("id")
-                    if isinstance(reward.get("product"), dict)
-                    else reward.get("product")
-                )
-
-                if not product_id:
-                    continue
-
-                try:
-                    product = Product.objects.get(product_id=product_id)
-                except Product.DoesNotExist:
-                    continue
-
-                DSOrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=reward.get("quantity", 0),
-                    price=0,
-                    is_scheme_item=True,
-                    ds_virtual_stock=getattr(
-                        product,
-                        "virtual_stock",
-                        getattr(product, "stock_quantity", 0)
-                    )
-                )
+            # ✅ Products of the whole cart in one query, prices from the DS price book
+            products = Product.objects.in_bulk(ds_cart_product_ids(data))
+            order = place_ds_order(data, ds_user, products, price_book("DS"))
 
             # ✅ Response
             return Response(
@@ -166,10 +120,10 @@ def DS_orders_by_role(request):
 
     # 🟦 Filters
     if order_id:
-        orders = orders.filter(order_id__icontains=order_id)
+        orders = orders.filter(ds_order_id_q(order_id))
 
     if party_name:
-        orders = orders.filter(ss_user__party_name__icontains=party_name)
+        orders = orders.filter(party_q(party_name, "ds_user"))
 
     if from_date:
         orders = orders.filter(created_at__date__gte=from_date)
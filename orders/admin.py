@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import SSOrder, SSOrderItem, CRMVerifiedOrder, CRMVerifiedOrderItem, DispatchOrder,PendingOrderItemSnapshot
+from .models import SSOrder, SSOrderItem, CRMVerifiedOrder, CRMVerifiedOrderItem, DispatchOrder,PendingOrderItemSnapshot, IdempotencyKey, NotificationOutbox, NotificationRoute, NotificationDigestEntry, OrderSplitRule, OrderIntakeTicket
 
 admin.site.register(SSOrder)
 admin.site.register(SSOrderItem)
@@ -7,3 +7,32 @@ admin.site.register(CRMVerifiedOrder)
 admin.site.register(CRMVerifiedOrderItem)
 admin.site.register(DispatchOrder)
 admin.site.register(PendingOrderItemSnapshot)
+admin.site.register(IdempotencyKey)
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ("id", "to_number", "template_name", "order_ref", "status", "attempts", "next_attempt_at", "sent_at")
+    list_filter = ("status", "template_name")
+    search_fields = ("to_number", "order_ref")
+
+
+@admin.register(NotificationRoute)
+class NotificationRouteAdmin(admin.ModelAdmin):
+    list_display = ("id", "event", "crm", "role", "to_number", "template_name", "digest", "digest_minutes", "is_active")
+    list_filter = ("event", "role", "digest", "is_active")
+
+
+admin.site.register(NotificationDigestEntry)
+
+
+@admin.register(OrderSplitRule)
+class OrderSplitRuleAdmin(admin.ModelAdmin):
+    list_display = ("id", "priority", "bucket", "sub_category_contains", "product_type", "warehouse", "scheme_items", "is_active")
+    list_filter = ("bucket", "warehouse", "is_active")
+
+
+@admin.register(OrderIntakeTicket)
+class OrderIntakeTicketAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "requested_by", "status", "attempts", "created_at", "processed_at")
+    list_filter = ("kind", "status")
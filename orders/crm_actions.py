@@ -0,0 +1,325 @@
+# orders/crm_actions.py
+# CRM bulk verify / hold / reject over many orders in one transaction:
+# set-based reads and writes across all orders, reserved stock of the union
+# of products recalculated once. Also batched line edits of a verified order.
+from collections import defaultdict
+
+from django.db import transaction
+
+from orders.events import publish_order_status
+from orders.models import SSOrder, SSOrderItem, CRMVerifiedOrder, CRMVerifiedOrderItem, PendingOrderItemSnapshot
+from orders.placement import is_strict
+from orders.versioning import VersionConflict, current_state, parse_version, versioned_update
+from products.models import Product
+from products.utils import (
+    coalesce_stock_updates, lock_products, normalize_location, reservation_shortages, upsert_pending_snapshots,
+)
+
+ACTION_STATUS = {"hold": "HOLD", "reject": "REJECTED"}   # verify -> per order (APPROVED default)
+VERIFY_STATUSES = {"APPROVED", "REJECTED", "HOLD"}
+MAX_BULK_ORDERS = 200
+MAX_ITEM_EDITS = 500
+
+
+class BulkActionError(ValueError):
+    """Request-level problem (unknown action, no orders, too many)."""
+
+
+class ItemEditError(ValueError):
+    """Bad line edit; status_code 404 for an unknown order / item / product, else 400."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _entries(data):
+    """{"orders": [{"id", ...overrides}]} or {"order_ids": [...]} -> [dict] with top-level defaults filled in."""
+    defaults = {key: data[key] for key in ("status", "dispatch_location", "notes", "strict") if key in data}
+    raw = data.get("orders")
+    if raw is None:
+        raw = [{"id": order_id} for order_id in data.get("order_ids") or []]
+    if not isinstance(raw, list) or not raw:
+        raise BulkActionError("No orders selected")
+    if len(raw) > MAX_BULK_ORDERS:
+        raise BulkActionError(f"At most {MAX_BULK_ORDERS} orders per request")
+    return [{**defaults, **entry} if isinstance(entry, dict) else entry for entry in raw]
+
+
+def _approved_items(entry, ss_lines):
+    """Payload items (override) or, without items, every SS line as ordered -> [(product_id, qty)]."""
+    if "items" in entry:
+        approved = []
+        for item in entry["items"] or []:
+            try:
+                qty = int(item.get("quantity", 0))
+            except (TypeError, ValueError):
+                qty = 0
+            approved.append((int(item["product"]), qty))
+        return approved
+    totals = defaultdict(int)
+    for line in ss_lines:
+        totals[line["product_id"]] += line["quantity"]
+    return list(totals.items())
+
+
+def apply_bulk_action(crm_user, data):
+    """
+    data: {"action": "verify" | "hold" | "reject", "orders": [{"id", "version"?, "items"?, "status"?,
+    "dispatch_location"?, "notes"?}] | "order_ids": [...], defaults at top level}.
+    An entry with "version" fails (with the current state) if the order changed since.
+    Returns per-order results [{"id", "result": ok / rejected / failed, ...}] in request order.
+    """
+    action = data.get("action")
+    if action not in ("verify", "hold", "reject"):
+        raise BulkActionError("action must be verify, hold or reject")
+    entries = _entries(data)
+
+    results = {}
+    valid = []
+    seen = set()
+    for index, entry in enumerate(entries):
+        try:
+            order_id = int(entry["id"])
+        except (KeyError, TypeError, ValueError):
+            results[index] = {"id": entry.get("id") if isinstance(entry, dict) else entry,
+                              "result": "failed", "error": "Invalid order id"}
+            continue
+        if order_id in seen:
+            results[index] = {"id": order_id, "result": "failed", "error": "Duplicate order"}
+            continue
+        seen.add(order_id)
+        valid.append((index, order_id, entry))
+
+    with transaction.atomic():
+        # ✅ only this CRM's orders; locked so a parallel single verify / hold can't interleave
+        orders = SSOrder.objects.select_for_update().filter(id__in=seen, assigned_crm=crm_user).in_bulk()
+
+        acted = []  # (index, order, entry, new_status)
+        for index, order_id, entry in valid:
+            order = orders.get(order_id)
+            if order is None:
+                results[index] = {"id": order_id, "result": "failed", "error": "Order not found"}
+                continue
+            if "version" in entry and parse_version(entry["version"]) != order.version:
+                results[index] = {"id": order_id, "result": "failed", "error": str(VersionConflict(order)),
+                                  "current": current_state(order)}
+                continue
+            new_status = ACTION_STATUS.get(action) or str(entry.get("status") or "APPROVED").upper()
+            if new_status not in VERIFY_STATUSES:
+                results[index] = {"id": order_id, "result": "failed", "error": f"Invalid status {new_status}"}
+                continue
+            acted.append((index, order, entry, new_status))
+
+        verified_items = []
+        crm_orders = []
+        if action == "verify":
+            acted, crm_orders, verified_items = _verify(crm_user, acted, results)
+
+        acted_ids = [order.id for _, order, _, _ in acted]
+        with coalesce_stock_updates():
+            # ✅ CRM records + items: one insert each for all orders
+            CRMVerifiedOrder.objects.bulk_create(crm_orders)
+            CRMVerifiedOrderItem.objects.bulk_create(verified_items)
+
+            # ✅ none of the new statuses reserves stock -> one delete of all their snapshots,
+            # reserved stock of the union of products recalculated once
+            PendingOrderItemSnapshot.objects.filter(order_id__in=acted_ids).delete()
+
+        # ✅ statuses (+ notes for hold / reject) in one UPDATE; SSE events as the save signal would send
+        # (rows locked above -> version bumped without a condition; stale single edits get 409)
+        for index, order, entry, new_status in acted:
+            order.status = new_status
+            order.version += 1
+            if action != "verify":
+                order.notes = entry.get("notes", order.notes)
+        SSOrder.objects.bulk_update([order for _, order, _, _ in acted], ["status", "notes", "version"])
+        publish_order_status([order for _, order, _, _ in acted])
+
+    crm_order_ids = {crm_order.original_order_id: crm_order.id for crm_order in crm_orders}
+    for index, order, entry, new_status in acted:
+        result = results.setdefault(index, {"id": order.id})
+        result.update({"result": "ok", "status": new_status})
+        if order.id in crm_order_ids:
+            result["crm_order_id"] = crm_order_ids[order.id]
+    return [results[index] for index in sorted(results)]
+
+
+def _verify(crm_user, acted, results):
+    """
+    CRMOrderVerifyView for many orders: SS lines, payload products, held stock
+    and already-verified flags read once for all; shortages per order.
+    Returns (orders still acted on, CRMVerifiedOrder rows, CRMVerifiedOrderItem rows).
+    """
+    order_ids = [order.id for _, order, _, _ in acted]
+    already = set(
+        CRMVerifiedOrder.objects.filter(original_order_id__in=order_ids).values_list("original_order_id", flat=True)
+    )
+    ss_lines = defaultdict(list)
+    for line in (
+        SSOrderItem.objects.filter(order_id__in=order_ids).order_by("id")
+        .values("order_id", "product_id", "quantity", "ss_virtual_stock")
+    ):
+        ss_lines[line["order_id"]].append(line)
+
+    plans = []
+    for index, order, entry, new_status in acted:
+        if order.id in already:
+            results[index] = {"id": order.id, "result": "failed", "error": "Order already verified"}
+            continue
+        try:
+            approved = [] if new_status == "REJECTED" else _approved_items(entry, ss_lines[order.id])
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            results[index] = {"id": order.id, "result": "failed", "error": f"Invalid items: {e}"}
+            continue
+        plans.append((index, order, entry, new_status, approved))
+
+    products = Product.objects.only("product_id", "virtual_stock").in_bulk(
+        {pid for *_, approved in plans for pid, _ in approved}
+    )
+    held = defaultdict(dict)
+    for order_id, product_id, location, quantity in (
+        PendingOrderItemSnapshot.objects.filter(order_id__in=[plan[1].id for plan in plans])
+        .values_list("order_id", "product_id", "location", "quantity")
+    ):
+        held[(order_id, location)][product_id] = quantity
+    locked = lock_products(products)
+
+    kept, crm_orders, verified_items = [], [], []
+    for index, order, entry, new_status, approved in plans:
+        if any(pid not in products for pid, _ in approved):
+            results[index] = {"id": order.id, "result": "failed", "error": "Product not found"}
+            continue
+
+        lines = defaultdict(int)
+        for pid, qty in approved:
+            lines[pid] += qty
+        location = normalize_location(entry.get("dispatch_location"))
+        shortages = reservation_shortages(locked, lines, location, held[(order.id, location)])
+        if shortages and is_strict(entry):
+            results[index] = {"id": order.id, "result": "rejected", "error": "Insufficient stock", "shortages": shortages}
+            continue
+
+        crm_order = CRMVerifiedOrder(
+            original_order=order,
+            crm_user=crm_user,
+            status=new_status,
+            dispatch_location=entry.get("dispatch_location") or "Delhi",  # model default
+        )
+        crm_orders.append(crm_order)
+
+        first_line, ss_map = {}, {}
+        for line in ss_lines[order.id]:
+            first_line.setdefault(line["product_id"], line)
+            ss_map[line["product_id"]] = line
+        approved_pids = set()
+        for pid, qty in approved:
+            approved_pids.add(pid)
+            line = first_line.get(pid)
+            verified_items.append(CRMVerifiedOrderItem(
+                crm_order=crm_order,
+                product_id=pid,
+                quantity=qty,
+                ss_virtual_stock=line["ss_virtual_stock"] if line else (products[pid].virtual_stock or 0),
+                is_rejected=False,
+            ))
+        # SS lines the CRM removed (all of them for REJECTED) -> rejected items
+        verified_items.extend(
+            CRMVerifiedOrderItem(
+                crm_order=crm_order,
+                product_id=pid,
+                quantity=line["quantity"],
+                ss_virtual_stock=line["ss_virtual_stock"],
+                is_rejected=True,
+            )
+            for pid, line in ss_map.items() if pid not in approved_pids
+        )
+        results[index] = {"id": order.id, "shortages": shortages}
+        kept.append((index, order, entry, new_status))
+    return kept, crm_orders, verified_items
+
+
+def _edit_quantity(value, minimum):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        raise ItemEditError("Invalid quantity.")
+    if quantity < minimum:
+        raise ItemEditError("Invalid quantity.")
+    return quantity
+
+
+def edit_verified_items(crm_order_id, edits, expected=None):
+    """
+    Add / update / delete lines of one verified order in one transaction.
+    edits: [{"product", "quantity"} (add) | {"item", "quantity"?, "is_rejected"?} (update)
+    | {"item", "delete": true}].
+    Stock is not touched: verifying moves the SS order out of PENDING, which
+    already released its reservation (signals.remove_snapshot_on_status_change),
+    so verified lines hold none to adjust.
+    expected: version the CRM saw (None -> not checked); every edit bumps it.
+    Returns (added items, new version); ItemEditError / VersionConflict -> nothing written.
+    """
+    if not isinstance(edits, list) or not edits:
+        raise ItemEditError("No edits provided")
+    if len(edits) > MAX_ITEM_EDITS:
+        raise ItemEditError(f"At most {MAX_ITEM_EDITS} edits per request")
+
+    with transaction.atomic():
+        # ✅ one editor per order at a time (item checks below read a stable set)
+        crm_order = (
+            CRMVerifiedOrder.objects.select_for_update().filter(pk=crm_order_id).first()
+        )
+        if crm_order is None:
+            raise ItemEditError("Order not found", status_code=404)
+        versioned_update(crm_order, [], expected)
+        items = {item.id: item for item in CRMVerifiedOrderItem.objects.filter(crm_order=crm_order)}
+
+        updated, deleted, adds = {}, set(), []
+        for edit in edits:
+            if not isinstance(edit, dict):
+                raise ItemEditError("Invalid edit")
+            if "item" in edit:
+                try:
+                    item = items[int(edit["item"])]
+                except (KeyError, TypeError, ValueError):
+                    raise ItemEditError("Item not found", status_code=404)
+                if edit.get("delete"):
+                    deleted.add(item.id)
+                    updated.pop(item.id, None)
+                    continue
+                if "quantity" in edit:
+                    item.quantity = _edit_quantity(edit["quantity"], 0)
+                if "is_rejected" in edit:
+                    item.is_rejected = bool(edit["is_rejected"])
+                updated[item.id] = item
+            else:
+                try:
+                    product_id = int(edit["product"])
+                except (KeyError, TypeError, ValueError):
+                    raise ItemEditError("Product ID and quantity are required.")
+                adds.append((product_id, _edit_quantity(edit.get("quantity"), 1)))
+
+        products = Product.objects.only("product_id", "virtual_stock").in_bulk({pid for pid, _ in adds})
+        present = {item.product_id for item in items.values() if item.id not in deleted}
+        added = []
+        for product_id, quantity in adds:
+            if product_id not in products:
+                raise ItemEditError("Product not found", status_code=404)
+            if product_id in present:
+                raise ItemEditError("This product is already added in this order.")
+            present.add(product_id)
+            added.append(CRMVerifiedOrderItem(
+                crm_order=crm_order,
+                product=products[product_id],
+                quantity=quantity,
+                ss_virtual_stock=products[product_id].virtual_stock or 0,
+            ))
+
+        if deleted:
+            CRMVerifiedOrderItem.objects.filter(id__in=deleted).delete()
+        if updated:
+            CRMVerifiedOrderItem.objects.bulk_update(list(updated.values()), ["quantity", "is_rejected"])
+        CRMVerifiedOrderItem.objects.bulk_create(added)
+
+    return added, crm_order.version
@@ -0,0 +1,114 @@
+# orders/events.py
+"""
+In-process pub/sub for the server-sent event stream.
+
+LocalBroker is a stand-in for an external broker (Redis pub/sub etc.):
+it only reaches subscribers connected to the same process. Publishers
+are normal sync code (views, signals, on_commit hooks); subscribers are
+async SSE connections, so events are handed over with
+call_soon_threadsafe onto the subscriber's event loop.
+"""
+import asyncio
+import threading
+
+from django.db import transaction
+
+
+STOCK_CHANGED = "stock.changed"
+ORDER_CREATED = "order.created"
+ORDER_STATUS = "order.status"
+ORDER_TICKET = "order.ticket"   # queued order placed / rejected -> the user who sent it
+
+
+class Subscription:
+    def __init__(self, loop, accepts, maxsize=500):
+        self.loop = loop
+        self.accepts = accepts
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def offer(self, event):
+        # runs on the subscriber's loop; a slow client loses old events, not the server
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class LocalBroker:
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, accepts):
+        subscription = Subscription(asyncio.get_running_loop(), accepts)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def publish(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.accepts(event):
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.offer, event)
+                except RuntimeError:
+                    # loop already closed -> connection is gone
+                    self.unsubscribe(subscription)
+
+
+broker = LocalBroker()
+
+
+def publish_on_commit(event_type, data, crm_id=None, ss_id=None, user_id=None):
+    """Publish after the current transaction commits (immediately in autocommit)."""
+    if not broker.has_subscribers():
+        return
+    event = {"type": event_type, "data": data, "crm_id": crm_id, "ss_id": ss_id, "user_id": user_id}
+    transaction.on_commit(lambda: broker.publish(event), robust=True)
+
+
+def publish_order_status(orders):
+    """orders: SSOrder instances (or dicts with id/order_id/status/assigned_crm_id/ss_user_id)."""
+    for order in orders:
+        if not isinstance(order, dict):
+            order = {
+                "id": order.id,
+                "order_id": order.order_id,
+                "status": order.status,
+                "assigned_crm_id": order.assigned_crm_id,
+                "ss_user_id": order.ss_user_id,
+            }
+        publish_on_commit(
+            ORDER_STATUS,
+            {"id": order["id"], "order_id": order["order_id"], "status": order["status"]},
+            crm_id=order["assigned_crm_id"],
+            ss_id=order["ss_user_id"],
+        )
+
+
+def audience_for(user):
+    """Role-scoped filter: which events a connected user may see."""
+    role_filter = _role_audience(user)
+    return lambda event: event.get("user_id") == user.id or role_filter(event)
+
+
+def _role_audience(user):
+    if user.is_staff or user.is_superuser or user.role == "ADMIN":
+        return lambda event: True
+    if user.role == "CRM":
+        return lambda event: event["type"] == STOCK_CHANGED or event["crm_id"] == user.id
+    if user.role == "SS":
+        return lambda event: event["type"] == STOCK_CHANGED or (
+            event["type"] == ORDER_STATUS and event["ss_id"] == user.id
+        )
+    return lambda event: event["type"] == STOCK_CHANGED
@@ -0,0 +1,133 @@
+# orders/idempotency.py
+# Idempotency-Key header for order writes: a retried request (flaky 2G/3G)
+# gets the first response back instead of creating the order twice.
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from orders.models import IdempotencyKey
+
+IDEMPOTENCY_TTL = getattr(settings, "IDEMPOTENCY_KEY_TTL", timedelta(hours=24))
+# a key still "running" after this long belongs to a request that died -> retry may take it over
+# (safe: the response is stored in the view's own transaction, so no response = nothing committed)
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(minutes=2)
+
+
+class KeyTakenOver(Exception):
+    """The claim was taken over by a retry while the view ran; its writes are rolled back."""
+
+
+def _fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _running(record):
+    return IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True)
+
+
+def _claim(key, scope, fingerprint):
+    """(record, claimed): claimed=True -> this request runs the view."""
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(key=key, scope=scope).first()
+    if record and record.expires_at <= now:
+        record.delete()
+        record = None
+    elif record and record.status_code is None and record.created_at <= now - IDEMPOTENCY_LOCK_TIMEOUT:
+        # abandoned; unless its response got stored meanwhile -> replay that
+        if _running(record).delete()[0]:
+            record = None
+        else:
+            record = IdempotencyKey.objects.filter(key=key, scope=scope).first()
+    if record:
+        return record, False
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                key=key, scope=scope, fingerprint=fingerprint, expires_at=now + IDEMPOTENCY_TTL,
+            )
+    except IntegrityError:
+        # same key claimed by a parallel retry a moment ago
+        return IdempotencyKey.objects.get(key=key, scope=scope), False
+    return record, True
+
+
+def _store(record, response):
+    """In the view's transaction: 2xx -> response stored, else key released. Raises KeyTakenOver."""
+    if 200 <= response.status_code < 300:
+        stored = _running(record).update(status_code=response.status_code, response_body=response.data)
+    else:
+        stored = _running(record).delete()[0]
+    if not stored:
+        raise KeyTakenOver
+
+
+def _in_progress():
+    return Response(
+        {"error": "A request with this Idempotency-Key is still in progress"},
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
+def idempotent(view):
+    """
+    APIView method decorator. With an Idempotency-Key header:
+    - first request runs the view; a 2xx response is stored until the TTL,
+      in the same transaction as the view's writes
+    - retry with the same key + payload -> stored response replayed, view not run
+      (no DB writes, no WhatsApp)
+    - same key, different payload -> 422; first request still running -> 409
+    Non-2xx responses are not stored, so the client may simply retry.
+    """
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return view(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({"error": "Idempotency-Key too long"}, status=status.HTTP_400_BAD_REQUEST)
+
+        user_id = request.user.pk if request.user and request.user.is_authenticated else ""
+        scope = f"{request.path}|{user_id}"[:255]
+        fingerprint = _fingerprint(request)
+        record, claimed = _claim(key, scope, fingerprint)  # committed on its own -> retries see it running
+
+        if not claimed:
+            if record.fingerprint != fingerprint:
+                return Response(
+                    {"error": "Idempotency-Key already used with a different request"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if record.status_code is None:
+                return _in_progress()
+            response = Response(record.response_body, status=record.status_code)
+            response["Idempotent-Replayed"] = "true"
+            return response
+
+        try:
+            with transaction.atomic():
+                # savepoint: a DB error the view swallows rolls back to here, the key row stays usable
+                with transaction.atomic():
+                    response = view(self, request, *args, **kwargs)
+                _store(record, response)
+        except KeyTakenOver:
+            return _in_progress()
+        except Exception:
+            _running(record).delete()
+            raise
+        return response
+    return wrapper
+
+
+def purge_expired_idempotency_keys():
+    """TTL eviction (scheduler job)."""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,219 @@
+# orders/intake.py
+# Accept-and-queue order placement for peak hours (scheme launch, month-end):
+# the create views validate the payload, park it as an OrderIntakeTicket and
+# answer 202; the scheduler worker places queued orders in chunks through the
+# batch path (shared lookups, one lock pass, merged stock stamps).
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from distributer.placement import ds_cart_product_ids, place_ds_order
+from orders.events import ORDER_TICKET, publish_on_commit
+from orders.models import OrderIntakeTicket
+from orders.placement import cart_product_ids, order_summary, place_ss_batch
+from products.models import Product
+from products.pricing import UnpricedProducts, price_book, price_lines
+
+# True -> every create request is queued (switch on for a launch day), else per request
+ORDER_INTAKE_QUEUE = getattr(settings, "ORDER_INTAKE_QUEUE", False)
+INTAKE_BATCH_SIZE = 200           # tickets claimed per worker pass
+INTAKE_CHUNK_SIZE = 25            # orders (+ their ticket outcomes) per transaction, as the batch upload
+INTAKE_PROCESSING_TIMEOUT = timedelta(minutes=5)  # PROCESSING longer -> worker died, claim again
+INTAKE_MAX_ATTEMPTS = 3
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+
+def wants_queue(request):
+    """Queue mode: ORDER_INTAKE_QUEUE setting, `Prefer: respond-async` header or ?mode=queue."""
+    if ORDER_INTAKE_QUEUE:
+        return True
+    prefer = request.headers.get("Prefer", "")
+    return "respond-async" in prefer.lower() or request.query_params.get("mode") == "queue"
+
+
+def _validate(kind, data):
+    """Cheap up-front checks so a queued ticket only fails on stock / races (users + price book version)."""
+    if not isinstance(data, dict):
+        raise ValueError("Order must be an object")
+    items = data.get("items") or []
+    if not items:
+        raise ValueError("No items provided")
+    try:
+        for item in items:
+            if int(item.get("quantity") or 0) <= 0:
+                raise ValueError(f"Invalid quantity for product {item.get('id')}")
+        user_ids = {int(data["user_id"]), int(data["crm_id"])} if kind == "SS" else {int(data["user_id"])}
+        if kind == "SS":
+            cart_product_ids([data])
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid order: {e}")
+
+    if User.objects.filter(id__in=user_ids).count() != len(user_ids):
+        raise ValueError("Invalid SS or CRM" if kind == "SS" else "Invalid user")
+    # unknown / unpriced products -> UnpricedProducts (the price book holds every priced product)
+    price_lines(items, price_book(kind))
+
+
+def enqueue_order(request, kind, data):
+    """Validate + park the payload -> 202 with the ticket (Location: poll URL)."""
+    if not request.user.is_authenticated:
+        # ticket is read back / pushed to its sender
+        return Response({"error": "Login required for queued orders"}, status=status.HTTP_401_UNAUTHORIZED)
+    try:
+        _validate(kind, data)
+    except (ValueError, UnpricedProducts) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        ticket = OrderIntakeTicket.objects.create(kind=kind, requested_by=request.user, payload=data)
+        transaction.on_commit(wake_intake_worker, robust=True)
+
+    poll_url = reverse("order-ticket", args=[ticket.id])
+    response = Response({
+        "message": "Order accepted, it will be placed shortly.",
+        "ticket": str(ticket.id),
+        "status": ticket.status,
+        "poll": poll_url,
+    }, status=status.HTTP_202_ACCEPTED)
+    response["Location"] = poll_url
+    return response
+
+
+def wake_intake_worker():
+    """Run the intake job now instead of at its next interval (no-op without the scheduler)."""
+    from orders import scheduler
+    job = scheduler.scheduler.get_job(scheduler.INTAKE_JOB_ID) if scheduler.scheduler else None
+    if job:
+        job.modify(next_run_time=timezone.now())
+
+
+def ticket_data(ticket):
+    return {
+        "ticket": str(ticket.id),
+        "kind": ticket.kind,
+        "status": ticket.status,
+        "result": ticket.result,
+        "error": ticket.error,
+        "created_at": ticket.created_at,
+        "processed_at": ticket.processed_at,
+    }
+
+
+def _claim(batch_size):
+    """
+    QUEUED / stale PROCESSING tickets -> PROCESSING, stamped with this pass's
+    locked_at. The UPDATE re-checks the claimable condition and only rows it
+    changed are returned (SQLite has no skip_locked: two workers may pick the
+    same candidates, one UPDATE wins each row).
+    """
+    now = timezone.now()
+    claimable = Q(status="QUEUED") | Q(status="PROCESSING", locked_at__lte=now - INTAKE_PROCESSING_TIMEOUT)
+    with transaction.atomic():
+        candidates = OrderIntakeTicket.objects.filter(claimable).order_by("created_at")
+        if transaction.get_connection().features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list("id", flat=True)[:batch_size])
+        OrderIntakeTicket.objects.filter(claimable, id__in=ids).update(
+            status="PROCESSING", locked_at=now, attempts=F("attempts") + 1,
+        )
+        tickets = (
+            OrderIntakeTicket.objects.filter(id__in=ids, status="PROCESSING", locked_at=now)
+            .select_related("requested_by").order_by("created_at")
+        )
+        return list(tickets), now
+
+
+def _still_claimed(tickets, claimed_at):
+    """Tickets of this pass no other worker has re-claimed since (row locks held till commit)."""
+    owned = set(
+        OrderIntakeTicket.objects.select_for_update()
+        .filter(id__in=[t.id for t in tickets], status="PROCESSING", locked_at=claimed_at)
+        .values_list("id", flat=True)
+    )
+    return [ticket for ticket in tickets if ticket.id in owned]
+
+
+def _place_ds(tickets):
+    """DS tickets -> {ticket_id: (status, result, error)}; users / products / prices looked up once."""
+    outcomes = {}
+    if not tickets:
+        return outcomes
+    users = User.objects.in_bulk({int(t.payload["user_id"]) for t in tickets})
+    product_ids = set().union(*(ds_cart_product_ids(t.payload) for t in tickets))
+    products = Product.objects.in_bulk(product_ids)
+    prices = price_book("DS")
+    for ticket in tickets:
+        try:
+            ds_user = users.get(int(ticket.payload["user_id"]))
+            if ds_user is None:
+                raise User.DoesNotExist("Invalid user")
+            with transaction.atomic():
+                order = place_ds_order(ticket.payload, ds_user, products, prices)
+            outcomes[ticket.id] = ("DONE", {"order": order_summary(order)}, None)
+        except Exception as e:
+            outcomes[ticket.id] = ("FAILED", None, str(e))
+    return outcomes
+
+
+def _place_ss(tickets):
+    outcomes = {}
+    for ticket, result in zip(tickets, place_ss_batch([(ticket.id, ticket.payload) for ticket in tickets])):
+        result.pop("index", None)
+        state = {"created": "DONE", "rejected": "REJECTED"}.get(result["status"], "FAILED")
+        outcomes[ticket.id] = (state, result, result.get("error"))
+    return outcomes
+
+
+def _finish(tickets, outcomes, stats):
+    """Store outcomes in the caller's transaction and push each to its requester once committed."""
+    now = timezone.now()
+    for ticket in tickets:
+        ticket.status, ticket.result, ticket.error = outcomes[ticket.id]
+        ticket.locked_at, ticket.processed_at = None, now
+        stats[ticket.status.lower()] += 1
+        publish_on_commit(ORDER_TICKET, ticket_data(ticket), user_id=ticket.requested_by_id)
+    OrderIntakeTicket.objects.bulk_update(tickets, ["status", "result", "error", "locked_at", "processed_at"])
+
+
+def process_intake_tickets(batch_size=INTAKE_BATCH_SIZE):
+    """
+    Worker pass (scheduler job): claim queued tickets, place them in chunks,
+    store each outcome and push it to the requester (SSE order.ticket).
+    A chunk's orders and its tickets' outcomes commit together, so a crash
+    mid-way leaves only unplaced tickets PROCESSING; they are claimed again
+    after INTAKE_PROCESSING_TIMEOUT, up to INTAKE_MAX_ATTEMPTS.
+    Returns {"claimed", "done", "rejected", "failed"}.
+    """
+    stats = {"claimed": 0, "done": 0, "rejected": 0, "failed": 0}
+    tickets, claimed_at = _claim(batch_size)
+    if not tickets:
+        return stats
+    stats["claimed"] = len(tickets)
+
+    gave_up = [ticket for ticket in tickets if ticket.attempts > INTAKE_MAX_ATTEMPTS]
+    pending = [ticket for ticket in tickets if ticket.attempts <= INTAKE_MAX_ATTEMPTS]
+    if gave_up:
+        with transaction.atomic():
+            gave_up = _still_claimed(gave_up, claimed_at)
+            _finish(gave_up, {t.id: ("FAILED", None, "Gave up after repeated worker failures") for t in gave_up}, stats)
+
+    for kind, place in (("SS", _place_ss), ("DS", _place_ds)):
+        of_kind = [ticket for ticket in pending if ticket.kind == kind]
+        for start in range(0, len(of_kind), INTAKE_CHUNK_SIZE):
+            with transaction.atomic():
+                chunk = _still_claimed(of_kind[start:start + INTAKE_CHUNK_SIZE], claimed_at)
+                if chunk:
+                    _finish(chunk, place(chunk), stats)
+
+    logger.info("Order intake: %s", stats)
+    return stats
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:09
+
+from django.db import migrations, models
+
+
+def backfill_snapshot_location(apps, schema_editor):
+    PendingOrderItemSnapshot = apps.get_model('orders', 'PendingOrderItemSnapshot')
+    PendingOrderItemSnapshot.objects.filter(
+        order__ss_user__stock_location='MUMBAI'
+    ).update(location='MUMBAI')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0025_remove_crmverifiedorderitem_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingorderitemsnapshot',
+            name='location',
+            field=models.CharField(choices=[('DELHI', 'Delhi Stock'), ('MUMBAI', 'Mumbai Stock')], db_index=True, default='DELHI', max_length=10),
+        ),
+        migrations.RunPython(backfill_snapshot_location, migrations.RunPython.noop),
+    ]
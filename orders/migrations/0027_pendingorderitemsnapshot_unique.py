@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:19
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_snapshots(apps, schema_editor):
+    # one row per (order, product): duplicates are folded into the oldest row.
+    # Their quantities were all reserved, so the summed row keeps reserved_qty as is
+    # (cross-warehouse duplicates, if any -> `manage.py audit_reservations --fix`).
+    PendingOrderItemSnapshot = apps.get_model('orders', 'PendingOrderItemSnapshot')
+    duplicates = (
+        PendingOrderItemSnapshot.objects.values('order_id', 'product_id')
+        .annotate(rows=Count('id')).filter(rows__gt=1).order_by()
+    )
+    for group in duplicates:
+        rows = list(PendingOrderItemSnapshot.objects.filter(
+            order_id=group['order_id'], product_id=group['product_id']
+        ).order_by('id'))
+        keeper, extra = rows[0], rows[1:]
+        keeper.quantity = sum(row.quantity for row in rows)
+        keeper.save(update_fields=['quantity'])
+        PendingOrderItemSnapshot.objects.filter(id__in=[row.id for row in extra]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0026_pendingorderitemsnapshot_location'),
+        ('products', '0023_changeversion_product_stock_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_snapshots, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='pendingorderitemsnapshot',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='unique_snapshot_order_product'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0029_notificationoutbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationDigestEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('to_number', models.CharField(max_length=20)),
+                ('template_name', models.CharField(max_length=100)),
+                ('template_language', models.CharField(max_length=20)),
+                ('digest_minutes', models.PositiveIntegerField(default=30)),
+                ('party_name', models.CharField(blank=True, max_length=255)),
+                ('order_ref', models.CharField(blank=True, max_length=20, null=True)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NotificationRoute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('order.created', 'New SS order')], db_index=True, default='order.created', max_length=30)),
+                ('role', models.CharField(blank=True, choices=[('ADMIN', 'Admin'), ('CRM', 'CRM'), ('ASM', 'ASM'), ('SS', 'Super Stockist'), ('DS', 'Distributor')], max_length=10, null=True)),
+                ('to_number', models.CharField(blank=True, help_text="Blank -> the CRM's own mobile", max_length=20)),
+                ('template_name', models.CharField(default='order_updation', max_length=100)),
+                ('template_language', models.CharField(default='EN', max_length=20)),
+                ('digest', models.BooleanField(default=False)),
+                ('digest_minutes', models.PositiveIntegerField(default=30)),
+                ('is_active', models.BooleanField(default=True)),
+                ('crm', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notification_routes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
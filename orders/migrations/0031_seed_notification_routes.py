@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+# crm_numbers dict that used to live in SSOrderCreateView
+LEGACY_CRM_NUMBERS = {
+    2: "7678491163",
+    4: "9312093178",
+    7: "8595957195",
+    8: "9266877089",
+    9: "9266767418",
+    133: "9306443566",
+}
+
+
+def seed_routes(apps, schema_editor):
+    NotificationRoute = apps.get_model('orders', 'NotificationRoute')
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    existing = set(CustomUser.objects.filter(id__in=LEGACY_CRM_NUMBERS).values_list('id', flat=True))
+    NotificationRoute.objects.bulk_create([
+        NotificationRoute(event='order.created', crm_id=crm_id, to_number=number,
+                          template_name='order_updation', template_language='EN')
+        for crm_id, number in LEGACY_CRM_NUMBERS.items() if crm_id in existing
+    ])
+
+
+def remove_routes(apps, schema_editor):
+    NotificationRoute = apps.get_model('orders', 'NotificationRoute')
+    NotificationRoute.objects.filter(
+        crm_id__in=LEGACY_CRM_NUMBERS, to_number__in=LEGACY_CRM_NUMBERS.values()
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0030_notificationroute'),
+        ('accounts', '0009_customuser_stock_location'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_routes, remove_routes),
+    ]
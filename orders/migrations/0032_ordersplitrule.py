@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0031_seed_notification_routes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSplitRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.CharField(max_length=50)),
+                ('priority', models.PositiveIntegerField(db_index=True, default=100)),
+                ('sub_category_contains', models.CharField(blank=True, max_length=50)),
+                ('product_type', models.CharField(blank=True, max_length=50)),
+                ('warehouse', models.CharField(blank=True, choices=[('DELHI', 'Delhi Stock'), ('MUMBAI', 'Mumbai Stock')], max_length=10)),
+                ('scheme_items', models.BooleanField(blank=True, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+            options={
+                'ordering': ['priority', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def seed_rules(apps, schema_editor):
+    # the hard-coded split: "tempered" in sub_category -> Tempered order (paid lines;
+    # scheme lines always went to the Accessories order)
+    OrderSplitRule = apps.get_model('orders', 'OrderSplitRule')
+    OrderSplitRule.objects.create(bucket='Tempered', priority=10, sub_category_contains='tempered', scheme_items=False)
+
+
+def remove_rules(apps, schema_editor):
+    OrderSplitRule = apps.get_model('orders', 'OrderSplitRule')
+    OrderSplitRule.objects.filter(bucket='Tempered', sub_category_contains='tempered').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0032_ordersplitrule'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_rules, remove_rules),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0034_orderintaketicket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crmverifiedorder',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='ssorder',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
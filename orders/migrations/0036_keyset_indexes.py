@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0035_order_versions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='crmverifiedorder',
+            name='orders_crmv_crm_use_d82c81_idx',
+        ),
+        migrations.AddIndex(
+            model_name='crmverifiedorder',
+            index=models.Index(fields=['crm_user', 'verified_at', 'id'], name='crmverified_crm_verified_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='crmverifiedorder',
+            index=models.Index(fields=['verified_at', 'id'], name='crmverified_verified_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dispatchorder',
+            index=models.Index(fields=['order_packed_time', 'id'], name='dispatch_packed_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ssorder',
+            index=models.Index(fields=['created_at', 'id'], name='ssorder_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ssorder',
+            index=models.Index(fields=['assigned_crm', 'status', 'created_at', 'id'], name='ssorder_crm_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ssorder',
+            index=models.Index(fields=['ss_user', 'created_at', 'id'], name='ssorder_ss_created_idx'),
+        ),
+    ]
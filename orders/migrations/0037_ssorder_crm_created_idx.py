@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0036_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ssorder',
+            index=models.Index(fields=['assigned_crm', 'created_at', 'id'], name='ssorder_crm_created_idx'),
+        ),
+    ]
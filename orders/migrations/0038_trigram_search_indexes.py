@@ -0,0 +1,41 @@
+# pg_trgm GIN indexes for the icontains searches (orders.search); other databases
+# use the in-process n-gram index instead, so this is a no-op there.
+from django.db import migrations
+
+# (index name, app label, model, column) — UPPER(col::text) is what icontains compiles to on Postgres
+TRIGRAM_INDEXES = [
+    ("ssorder_order_id_trgm", "orders", "SSOrder", "order_id"),
+    ("dsorder_order_id_trgm", "distributer", "DSOrder", "order_id"),
+    ("customuser_party_name_trgm", "accounts", "CustomUser", "party_name"),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, app_label, model_name, column in TRIGRAM_INDEXES:
+        table = apps.get_model(app_label, model_name)._meta.db_table
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, *_ in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_customuser_stock_location'),
+        ('distributer', '0002_rename_ss_virtual_stock_dsorderitem_ds_virtual_stock'),
+        ('orders', '0037_ssorder_crm_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
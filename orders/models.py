@@ -1,19 +1,39 @@
 from django.db import models
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from products.models import Product
+from accounts.models import STOCK_LOCATIONS, USER_ROLES
 
 import uuid
 
 class SSOrder(models.Model):
-    ss_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ss_orders', db_index=True)
-    assigned_crm = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='assigned_orders', db_index=True)
+    ss_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ss_orders', db_index=False)  # ssorder_ss_created_idx leads with it
+    assigned_crm = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='assigned_orders', db_index=False)  # ssorder_crm_created_idx leads with it
     order_id = models.CharField(max_length=20, unique=True, editable=False , null=True, blank=True)  # 🔑 unique order id
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)  # ssorder_created_id_idx
     notes = models.TextField(blank=True, null=True)
     status = models.CharField(max_length=20, default='PENDING', db_index=True)
 
     note = models.CharField(max_length=100, blank=True, null=True)
+    version = models.PositiveIntegerField(default=1)  # optimistic concurrency (orders.versioning)
+
+    class Meta:
+        # ✅ keyset pages (orders.pagination): (created_at, id) after the list's filters
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="ssorder_created_id_idx"),
+            models.Index(fields=["assigned_crm", "status", "created_at", "id"], name="ssorder_crm_status_created_idx"),
+            models.Index(fields=["assigned_crm", "created_at", "id"], name="ssorder_crm_created_idx"),
+            models.Index(fields=["ss_user", "created_at", "id"], name="ssorder_ss_created_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # status as stored in DB -> signals publish only real status changes
+        instance._loaded_status = instance.__dict__.get("status")
+        return instance
 
     def save(self, *args, **kwargs):
         if not self.order_id:
@@ -49,10 +69,12 @@ class CRMVerifiedOrder(models.Model):
    
     punched = models.BooleanField(default=False, db_index=True)
     dispatch_location = models.CharField(max_length=50, default="Delhi", db_index=True)  # 🆕 Added
+    version = models.PositiveIntegerField(default=1)  # optimistic concurrency (orders.versioning)
 
     class Meta:
         indexes = [
-            models.Index(fields=["crm_user", "verified_at"]),
+            models.Index(fields=["crm_user", "verified_at", "id"], name="crmverified_crm_verified_idx"),
+            models.Index(fields=["verified_at", "id"], name="crmverified_verified_id_idx"),
             models.Index(fields=["original_order", "verified_at"]),
             models.Index(fields=["status"]),
         ]
@@ -86,17 +108,197 @@ class DispatchOrder(models.Model):
 
     class Meta:
         ordering = ["-order_packed_time"]
+        indexes = [
+            models.Index(fields=["order_packed_time", "id"], name="dispatch_packed_id_idx"),  # keyset pages
+        ]
 
 
 class PendingOrderItemSnapshot(models.Model):
     order = models.ForeignKey(SSOrder, on_delete=models.CASCADE, related_name='pending_snapshots', db_index=True)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
+    location = models.CharField(max_length=10, choices=STOCK_LOCATIONS, default='DELHI', db_index=True)  # warehouse reserved from
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # one reservation per order line -> snapshot writes can upsert
+            models.UniqueConstraint(fields=["order", "product"], name="unique_snapshot_order_product"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # quantity/location as stored in DB -> signals apply (new - old) to Product reserved columns
+        instance._loaded_quantity = instance.__dict__.get("quantity")
+        instance._loaded_location = instance.__dict__.get("location")
+        return instance
+
     def __str__(self):
         return f"{self.order.order_id} - {self.product}- {self.product.product_name} - {self.quantity}"
 
 
 
 
+
+
+# ✅ Idempotency-Key -> stored response, replayed on client retries
+class IdempotencyKey(models.Model):
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=255)  # endpoint path + user
+    fingerprint = models.CharField(max_length=64)  # sha256 of the request payload
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # None -> request still running
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["key", "scope"], name="unique_idempotency_key_scope"),
+        ]
+
+    def __str__(self):
+        return f"{self.key} - {self.scope} - {self.status_code}"
+
+
+# ✅ Outbox: WhatsApp messages written with the order, sent by the background dispatcher
+class NotificationOutbox(models.Model):
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('SENDING', 'Sending'),
+        ('SENT', 'Sent'),
+        ('FAILED', 'Failed'),
+    ]
+
+    channel = models.CharField(max_length=20, default='WHATSAPP')
+    to_number = models.CharField(max_length=20)
+    template_name = models.CharField(max_length=100)
+    template_language = models.CharField(max_length=20)
+    parameters = models.JSONField(default=list, blank=True)
+    order_ref = models.CharField(max_length=20, blank=True, null=True, db_index=True)  # SSOrder.order_id
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING', db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    locked_at = models.DateTimeField(null=True, blank=True)  # SENDING since
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.template_name} -> {self.to_number} : {self.status} ({self.attempts})"
+
+
+# ✅ Who gets WhatsApp for which event (cached in process -> orders.notifications)
+class NotificationRoute(models.Model):
+    EVENT_CHOICES = [
+        ('order.created', 'New SS order'),
+    ]
+
+    event = models.CharField(max_length=30, choices=EVENT_CHOICES, default='order.created', db_index=True)
+    # match: crm set -> only that CRM's orders; else role set -> CRMs with that role; else every order
+    crm = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='notification_routes'
+    )
+    role = models.CharField(max_length=10, choices=USER_ROLES, null=True, blank=True)
+    to_number = models.CharField(max_length=20, blank=True, help_text="Blank -> the CRM's own mobile")
+    template_name = models.CharField(max_length=100, default='order_updation')
+    template_language = models.CharField(max_length=20, default='EN')
+    digest = models.BooleanField(default=False)  # batch events into one message per interval
+    digest_minutes = models.PositiveIntegerField(default=30)
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        target = self.crm_id and f"CRM {self.crm_id}" or self.role or "all"
+        return f"{self.event} [{target}] -> {self.to_number or 'CRM mobile'}{' (digest)' if self.digest else ''}"
+
+
+# ✅ Digest mode: events parked here, folded into one outbox message per number + template
+# (route copied, not linked -> deleting a route never breaks a running order insert)
+class NotificationDigestEntry(models.Model):
+    to_number = models.CharField(max_length=20)
+    template_name = models.CharField(max_length=100)
+    template_language = models.CharField(max_length=20)
+    digest_minutes = models.PositiveIntegerField(default=30)
+    party_name = models.CharField(max_length=255, blank=True)
+    order_ref = models.CharField(max_length=20, blank=True, null=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.template_name} -> {self.to_number} : {self.order_ref}"
+
+
+# ✅ Cart split rules: which order ("<bucket> Order") a line goes to (compiled -> orders.splitting)
+class OrderSplitRule(models.Model):
+    bucket = models.CharField(max_length=50)  # e.g. "Tempered"; unmatched lines -> "Accessories"
+    priority = models.PositiveIntegerField(default=100, db_index=True)  # lower first, first match wins
+    # all set conditions must match (blank / None -> any)
+    sub_category_contains = models.CharField(max_length=50, blank=True)  # case-insensitive
+    product_type = models.CharField(max_length=50, blank=True)  # case-insensitive exact
+    warehouse = models.CharField(max_length=10, choices=STOCK_LOCATIONS, blank=True)  # SS stock_location
+    scheme_items = models.BooleanField(null=True, blank=True)  # True: scheme lines only (own stream), False: paid lines only
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ["priority", "id"]
+
+    def __str__(self):
+        return f"{self.priority}: {self.bucket}"
+
+    def clean(self):
+        # ✅ each bucket needs its own "<slug>_order" key in the create response, else one order hides another
+        from orders.placement import response_key
+        from orders.splitting import DEFAULT_BUCKET
+
+        key = response_key(self.bucket)
+        if key == "_order":
+            raise ValidationError({"bucket": "Bucket name needs letters or digits."})
+        if self.bucket == DEFAULT_BUCKET:
+            return
+        if key == response_key(DEFAULT_BUCKET):
+            raise ValidationError({"bucket": f"Reserved for unmatched lines ({DEFAULT_BUCKET} -> {key})."})
+        others = set(OrderSplitRule.objects.exclude(pk=self.pk).exclude(bucket=self.bucket).values_list("bucket", flat=True))
+        clash = next((bucket for bucket in sorted(others) if response_key(bucket) == key), None)
+        if clash:
+            raise ValidationError({"bucket": f"Same response key ({key}) as bucket \"{clash}\"; use that exact name or another one."})
+
+
+# ✅ Accept-and-queue order placement: payload parked here, worker creates the orders (orders.intake)
+class OrderIntakeTicket(models.Model):
+    KIND_CHOICES = [
+        ("SS", "SS order"),
+        ("DS", "DS order"),
+    ]
+    STATUS_CHOICES = [
+        ("QUEUED", "Queued"),
+        ("PROCESSING", "Processing"),
+        ("DONE", "Done"),
+        ("REJECTED", "Rejected"),   # strict order, stock short
+        ("FAILED", "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=2, choices=KIND_CHOICES)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="order_tickets")
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="QUEUED")
+    result = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="intake_status_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.id} - {self.status}"
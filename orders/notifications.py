@@ -0,0 +1,261 @@
+# orders/notifications.py
+# WhatsApp outbox: rows are written in the order's transaction, a background
+# dispatcher sends them (pooled session, bounded threads, retry with backoff).
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from orders.events import ORDER_CREATED
+from orders.models import NotificationOutbox, NotificationRoute, NotificationDigestEntry
+from orders.utils import post_whatsapp_template, WhatsAppConfigError, WHATSAPP_TIMEOUT
+
+MAX_WORKERS = 4            # parallel Meta calls per dispatcher run
+BATCH_SIZE = 50            # rows claimed per run
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 30          # seconds, doubled per attempt (+/- 20% jitter)
+BACKOFF_MAX = 60 * 60
+SENDING_TIMEOUT = timedelta(minutes=5)  # SENDING longer than this -> dispatcher died, claim again
+ROUTE_CACHE_TTL = 60       # seconds; route edits in other worker processes show up within this
+TEMPLATE_PARAM_MAX = 900   # Meta limits a template parameter to ~1024 chars
+
+logger = logging.getLogger(__name__)
+
+_session = None
+
+
+def get_session():
+    """One keep-alive session for all sends; pool sized to the worker count."""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _session = session
+    return _session
+
+
+def queue_whatsapp_template(to_number, template_name, template_language, parameters=(), order_ref=None):
+    """Outbox row in the caller's transaction; dispatcher woken once it commits."""
+    row = NotificationOutbox.objects.create(
+        to_number=to_number,
+        template_name=template_name,
+        template_language=template_language,
+        parameters=[str(p) for p in parameters],
+        order_ref=order_ref,
+        next_attempt_at=timezone.now(),
+    )
+    transaction.on_commit(wake_dispatcher, robust=True)
+    return row
+
+
+def wake_dispatcher():
+    """Run the outbox job now instead of at its next interval (no-op without the scheduler)."""
+    from orders import scheduler
+    job = scheduler.scheduler.get_job(scheduler.OUTBOX_JOB_ID) if scheduler.scheduler else None
+    if job:
+        job.modify(next_run_time=timezone.now())
+
+
+def _claim_due(batch_size):
+    now = timezone.now()
+    due = Q(status="PENDING", next_attempt_at__lte=now) | Q(status="SENDING", locked_at__lte=now - SENDING_TIMEOUT)
+    with transaction.atomic():
+        rows = NotificationOutbox.objects.filter(due).order_by("next_attempt_at", "id")
+        if transaction.get_connection().features.has_select_for_update_skip_locked:
+            rows = rows.select_for_update(skip_locked=True)
+        rows = list(rows[:batch_size])
+        NotificationOutbox.objects.filter(id__in=[row.id for row in rows]).update(status="SENDING", locked_at=now)
+    return rows
+
+
+def _send(row, timeout):
+    """Worker thread: HTTP only, no DB. Returns (sent, retryable, error)."""
+    try:
+        response = post_whatsapp_template(
+            row.to_number, row.template_name, row.template_language, row.parameters,
+            session=get_session(), timeout=timeout,
+        )
+    except WhatsAppConfigError as e:
+        return False, True, str(e)
+    except requests.RequestException as e:
+        return False, True, f"{type(e).__name__}: {e}"
+
+    if response.status_code in (200, 201):
+        return True, False, None
+    # 429 / 5xx -> Meta side, try again later; other 4xx won't get better
+    retryable = response.status_code == 429 or response.status_code >= 500
+    return False, retryable, f"HTTP {response.status_code}: {response.text[:500]}"
+
+
+def _backoff(attempts):
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def dispatch_outbox(batch_size=BATCH_SIZE, max_workers=MAX_WORKERS, timeout=WHATSAPP_TIMEOUT):
+    """
+    Send due outbox rows. Returns {"claimed", "sent", "retry", "failed"}.
+    HTTP calls run on at most max_workers threads; status updates stay on this thread.
+    """
+    stats = {"claimed": 0, "sent": 0, "retry": 0, "failed": 0}
+    rows = _claim_due(batch_size)
+    if not rows:
+        return stats
+    stats["claimed"] = len(rows)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(rows))) as pool:
+        outcomes = list(pool.map(lambda row: _send(row, timeout), rows))
+
+    now = timezone.now()
+    for row, (sent, retryable, error) in zip(rows, outcomes):
+        row.attempts += 1
+        row.locked_at = None
+        row.last_error = error
+        if sent:
+            row.status, row.sent_at = "SENT", now
+        elif retryable and row.attempts < MAX_ATTEMPTS:
+            row.status, row.next_attempt_at = "PENDING", now + _backoff(row.attempts)
+        else:
+            row.status = "FAILED"
+        stats[{"SENT": "sent", "PENDING": "retry", "FAILED": "failed"}[row.status]] += 1
+
+    NotificationOutbox.objects.bulk_update(
+        rows, ["status", "attempts", "locked_at", "last_error", "sent_at", "next_attempt_at"]
+    )
+    if stats["failed"] or stats["retry"]:
+        logger.warning("WhatsApp outbox: %s", stats)
+    return stats
+
+
+# ---------------------------
+# 🔥 Routing: NotificationRoute rows cached per process
+# ---------------------------
+
+_route_cache = {"routes": None, "loaded_at": 0.0}
+_route_cache_lock = threading.Lock()
+
+
+def invalidate_route_cache():
+    _route_cache["routes"] = None
+
+
+def _load_routes():
+    routes = defaultdict(list)
+    for route in NotificationRoute.objects.filter(is_active=True).order_by("id"):
+        if route.crm_id:
+            key = (route.event, "crm", route.crm_id)
+        elif route.role:
+            key = (route.event, "role", route.role)
+        else:
+            key = (route.event, None, None)
+        routes[key].append(route)
+    return dict(routes)
+
+
+def routes_for(event, crm_user):
+    """Active routes for an event on crm_user's orders (CRM-specific, role-wide, catch-all)."""
+    if _route_cache["routes"] is None or time.monotonic() - _route_cache["loaded_at"] > ROUTE_CACHE_TTL:
+        with _route_cache_lock:
+            if _route_cache["routes"] is None or time.monotonic() - _route_cache["loaded_at"] > ROUTE_CACHE_TTL:
+                _route_cache["routes"] = _load_routes()
+                _route_cache["loaded_at"] = time.monotonic()
+    routes = _route_cache["routes"]
+    return (
+        routes.get((event, "crm", crm_user.id), [])
+        + routes.get((event, "role", crm_user.role), [])
+        + routes.get((event, None, None), [])
+    )
+
+
+def notify_orders_created(ss_user, crm_user, orders):
+    """
+    New SS orders -> one outbox message per order and recipient, or a parked
+    digest entry for digest routes. Rows go in the caller's transaction.
+    """
+    orders = [order for order in orders if order]
+    if not orders:
+        return
+    routes = routes_for(ORDER_CREATED, crm_user)
+    if not routes:
+        logger.warning("No WhatsApp route for CRM %s (%s) -> orders %s not notified",
+                       crm_user.id, crm_user.name, [order.order_id for order in orders])
+        return
+
+    party = ss_user.party_name or ss_user.name
+    seen = set()
+    digest_entries = []
+    for route in routes:
+        to_number = route.to_number or crm_user.mobile
+        key = (to_number, route.template_name, route.template_language)
+        if not to_number or key in seen:
+            continue
+        seen.add(key)
+        for order in orders:
+            if route.digest:
+                digest_entries.append(NotificationDigestEntry(
+                    to_number=to_number,
+                    template_name=route.template_name,
+                    template_language=route.template_language,
+                    digest_minutes=route.digest_minutes,
+                    party_name=party,
+                    order_ref=order.order_id,
+                    amount=order.total_amount,
+                ))
+            else:
+                queue_whatsapp_template(
+                    to_number, route.template_name, route.template_language,
+                    [party, str(order.order_id), str(order.total_amount)],
+                    order_ref=order.order_id,
+                )
+    if digest_entries:
+        NotificationDigestEntry.objects.bulk_create(digest_entries)
+
+
+def flush_digests():
+    """
+    Fold parked digest entries into one message per (number, template) once the
+    oldest entry is digest_minutes old. Same 3 parameters as a single order:
+    parties, order ids, total amount.
+    """
+    now = timezone.now()
+    stats = {"messages": 0, "events": 0}
+    with transaction.atomic():
+        entries = NotificationDigestEntry.objects.order_by("id")
+        if transaction.get_connection().features.has_select_for_update_skip_locked:
+            entries = entries.select_for_update(skip_locked=True)
+
+        groups = defaultdict(list)
+        for entry in entries:
+            groups[(entry.to_number, entry.template_name, entry.template_language)].append(entry)
+
+        flushed = []
+        for (to_number, template_name, template_language), group in groups.items():
+            if group[0].created_at > now - timedelta(minutes=group[0].digest_minutes):
+                continue
+            parties = sorted({entry.party_name for entry in group})
+            party = parties[0] if len(parties) == 1 else f"{parties[0]} +{len(parties) - 1}"
+            refs = ", ".join(entry.order_ref for entry in group if entry.order_ref)
+            summary = f"{len(group)} orders: {refs}"
+            if len(summary) > TEMPLATE_PARAM_MAX:
+                summary = summary[:TEMPLATE_PARAM_MAX - 3] + "..."
+            queue_whatsapp_template(
+                to_number, template_name, template_language,
+                [party, summary, str(sum(entry.amount for entry in group))],
+            )
+            flushed.extend(entry.id for entry in group)
+            stats["messages"] += 1
+
+        NotificationDigestEntry.objects.filter(id__in=flushed).delete()
+        stats["events"] = len(flushed)
+    return stats
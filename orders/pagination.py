@@ -0,0 +1,122 @@
+# orders/pagination.py
+# Keyset (cursor) pagination for order history / tracking lists, newest first.
+# A page is WHERE (time, id) < cursor ORDER BY time DESC, id DESC LIMIT n+1:
+# no OFFSET and no COUNT(*), so page 500 costs the same as page 1 on the
+# matching (time, id) index.
+import base64
+from collections import OrderedDict
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    time_field = "created_at"
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self._page_size(request)
+        self.nullable = queryset.model._meta.get_field(self.time_field).null
+        cursor = self._decode(request.query_params.get(self.cursor_query_param))
+        self.backwards = cursor is not None and cursor[2] == "p"
+
+        if cursor is not None:
+            queryset = queryset.filter(self._after(cursor[0], cursor[1], reverse=self.backwards))
+        rows = list(queryset.order_by(*self._ordering(reverse=self.backwards))[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.backwards:
+            rows.reverse()
+
+        # next: older rows exist after the last one; previous: newer rows before the first one
+        self.has_next = has_more if not self.backwards else True
+        self.has_previous = cursor is not None and (has_more if self.backwards else True)
+        self.first = self._key(rows[0]) if rows else None
+        self.last = self._key(rows[-1]) if rows else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_next_link(self):
+        if not (self.has_next and self.last):
+            return None
+        return self._link(*self.last, "n")
+
+    def get_previous_link(self):
+        if not (self.has_previous and self.first):
+            return None
+        return self._link(*self.first, "p")
+
+    # ---- keyset helpers ----
+
+    def _page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def _ordering(self, reverse=False):
+        field = F(self.time_field)
+        if reverse:  # walked back towards the top
+            time_order = field.asc(nulls_last=True) if self.nullable else field.asc()
+            return [time_order, "id"]
+        # NULL times on top, as Postgres orders "-field" (and its (time, id) index scans)
+        time_order = field.desc(nulls_first=True) if self.nullable else field.desc()
+        return [time_order, "-id"]
+
+    def _after(self, value, pk, reverse=False):
+        """Rows past (value, pk) in list order (reverse: before it); NULL times come first."""
+        t = self.time_field
+        if not reverse:
+            if value is None:
+                return Q(**{f"{t}__isnull": True, "id__lt": pk}) | Q(**{f"{t}__isnull": False})
+            return Q(**{f"{t}__lt": value}) | Q(**{t: value, "id__lt": pk})
+        if value is None:
+            return Q(**{f"{t}__isnull": True, "id__gt": pk})
+        condition = Q(**{f"{t}__gt": value}) | Q(**{t: value, "id__gt": pk})
+        return (condition | Q(**{f"{t}__isnull": True})) if self.nullable else condition
+
+    def _key(self, row):
+        return getattr(row, self.time_field), row.pk
+
+    def _link(self, value, pk, direction):
+        raw = f"{value.isoformat() if value is not None else ''}|{pk}|{direction}"
+        token = base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def _decode(self, token):
+        if not token:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+            value, pk, direction = raw.split("|")
+            value = (parse_datetime(value) or "") if value else None
+            if value == "" or direction not in ("n", "p") or (value is None and not self.nullable):
+                raise ValueError
+            return value, int(pk), direction
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class VerifiedKeysetPagination(KeysetPagination):
+    time_field = "verified_at"
+
+
+class DispatchKeysetPagination(KeysetPagination):
+    time_field = "order_packed_time"
@@ -0,0 +1,214 @@
+# orders/placement.py
+# SS cart -> one order per split bucket (Tempered / Accessories / ...). Shared by the single create view
+# and the batch upload, so both take the same bulk + locked reservation path.
+import logging
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils.text import slugify
+
+from orders.models import SSOrder, SSOrderItem
+from orders.notifications import notify_orders_created
+from orders.splitting import DEFAULT_BUCKET, split_cart
+from products.pricing import price_book, price_lines
+from products.models import Product
+from products.utils import lock_products, locked_reservation, merged_stock_stamps, upsert_pending_snapshots
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+
+class StockShortage(Exception):
+    """strict order that can't be reserved in full -> nothing written."""
+
+    def __init__(self, shortages):
+        super().__init__("Insufficient stock")
+        self.shortages = shortages
+
+
+def is_strict(data):
+    """strict=true -> reject the whole request (409) instead of reserving past available stock."""
+    return str(data.get("strict", "")).lower() in ("1", "true", "yes")
+
+
+def scheme_product_id(reward):
+    return (
+        reward.get('product_id') or
+        (reward.get('product', {}).get('id') if isinstance(reward.get('product'), dict) else reward.get('product'))
+    )
+
+
+def cart_product_ids(payloads):
+    """product_ids of every item + scheme item in the payloads (for one shared in_bulk)."""
+    product_ids = set()
+    for data in payloads:
+        product_ids.update(int(item['id']) for item in data.get('items', []))
+        product_ids.update(int(pid) for pid in map(scheme_product_id, data.get('eligibleSchemes', [])) if pid)
+    return product_ids
+
+
+def response_key(bucket):
+    """Bucket -> key in the create response ("Tempered" -> tempered_order, default -> normal_order)."""
+    if bucket == DEFAULT_BUCKET:
+        return "normal_order"
+    return slugify(bucket).replace("-", "_") + "_order"
+
+
+def order_summary(order):
+    if not order:
+        return None
+    return {"id": order.id, "order_id": order.order_id, "total_amount": str(order.total_amount)}
+
+
+def keyed_orders(orders, render):
+    """{bucket: order} -> response "orders"; tempered_order / normal_order always present (old clients)."""
+    keyed = {"tempered_order": None, "normal_order": None}
+    keyed.update({response_key(bucket): render(order) for bucket, order in orders.items()})
+    return keyed
+
+
+def place_ss_order(data, ss_user, crm_user, products, prices=None):
+    """
+    Create the orders of one SSOrderCreateView payload, one per split bucket
+    (OrderSplitRule, see orders.splitting).
+    - products: {product_id: Product} fetched up front (shared across a batch)
+    - prices: SS price book (products.pricing); line prices / totals come from it,
+      not from the client. UnpricedProducts if a product has no price
+    - items bulk inserted, snapshots upserted, stock of all lines applied once
+      under locked_reservation()
+    Returns ({bucket: order}, shortages); StockShortage in strict mode.
+    """
+    items = data['items']
+    rewards = [(reward, scheme_product_id(reward)) for reward in data.get('eligibleSchemes', [])]
+
+    # ✅ Items -> buckets (Tempered / Accessories / ...), in memory
+    groups = split_cart(items, rewards, products, ss_user.stock_location)
+    unit_prices, _ = price_lines(items, price_book("SS") if prices is None else prices)
+
+    # ✅ Helper function: order create + items insert (bulk)
+    def create_order(order_items, label, order_rewards=()):
+        _, total_amt = price_lines(order_items, unit_prices)
+
+        order = SSOrder.objects.create(
+            ss_user=ss_user,
+            assigned_crm=crm_user,
+            total_amount=total_amt,
+            note=f"{label} Order"  # optional tag for clarity
+        )
+
+        rows = []
+        for item in order_items:
+            product = products[int(item['id'])]
+            rows.append(SSOrderItem(
+                order=order,
+                product=product,
+                quantity=item['quantity'],
+                price=unit_prices[int(item['id'])],
+                is_scheme_item=False,
+                ss_virtual_stock=item.get('ss_virtual_stock', getattr(product, 'stock_quantity', 0))
+            ))
+
+        # ✅ Scheme items
+        for reward, product in order_rewards:
+            rows.append(SSOrderItem(
+                order=order,
+                product=product,
+                quantity=reward.get('quantity', 0),
+                price=0,
+                is_scheme_item=True,
+                ss_virtual_stock=getattr(product, 'virtual_stock', getattr(product, 'stock_quantity', 0))
+            ))
+
+        SSOrderItem.objects.bulk_create(rows)
+
+        # ✅ bulk_create fires no signal -> snapshots in one upsert
+        quantities = defaultdict(int)
+        for row in rows:
+            quantities[row.product_id] += row.quantity
+        upsert_pending_snapshots(order, quantities, ss_user.stock_location)
+        return order
+
+    # ✅ Qty per product (items + scheme items that made it into an order) -> locked reservation
+    lines = defaultdict(int)
+    for _, group_items, group_rewards in groups:
+        for item in group_items:
+            lines[int(item['id'])] += int(item['quantity'] or 0)
+        for reward, product in group_rewards:
+            lines[product.product_id] += int(reward.get('quantity', 0) or 0)
+
+    # ✅ Only these Product rows locked; stock deltas of all lines applied once
+    with locked_reservation(lines, ss_user.stock_location) as shortages:
+        if shortages and is_strict(data):
+            raise StockShortage(shortages)
+
+        orders = {
+            bucket: create_order(group_items, bucket, group_rewards)
+            for bucket, group_items, group_rewards in groups
+        }
+        # ✅ WhatsApp (हर order के लिए) -> outbox / digest, same transaction as the orders
+        notify_orders_created(ss_user, crm_user, list(orders.values()))
+
+    return orders, shortages
+
+
+def place_ss_batch(chunk):
+    """
+    [(index, payload)] -> [result] in the same order; used by the batch upload
+    and the intake queue worker.
+    - users, products and SS prices fetched once for the chunk, all products
+      locked up front in one transaction, stock stamps merged
+    - savepoint per order: result status created / rejected (strict shortage) / failed
+    """
+    results = {}
+    orders = []
+    for index, data in chunk:
+        if isinstance(data, Exception) or not isinstance(data, dict):
+            error = str(data) if isinstance(data, Exception) else "Order must be an object"
+            results[index] = {"index": index, "status": "failed", "error": error}
+            continue
+        try:
+            product_ids = cart_product_ids([data])
+            user_ids = (int(data['user_id']), int(data['crm_id']))
+        except (KeyError, TypeError, ValueError) as e:
+            results[index] = {"index": index, "status": "failed", "error": f"Invalid order: {e}"}
+            continue
+        orders.append((index, data, user_ids, product_ids))
+
+    # ✅ shared lookups for the whole chunk
+    all_product_ids = set().union(*(entry[3] for entry in orders))
+    users = User.objects.in_bulk({uid for entry in orders for uid in entry[2]})
+    products = Product.objects.in_bulk(all_product_ids)
+    prices = price_book("SS")
+
+    try:
+        with transaction.atomic(), merged_stock_stamps():
+            # ✅ lock every product of the chunk up front, in product_id order -> batches can't deadlock
+            lock_products(all_product_ids)
+
+            for index, data, (ss_id, crm_id), _ in orders:
+                result = {"index": index}
+                if "client_ref" in data:
+                    result["client_ref"] = data["client_ref"]
+                try:
+                    ss_user, crm_user = users.get(ss_id), users.get(crm_id)
+                    if not (ss_user and crm_user):
+                        raise User.DoesNotExist("Invalid SS or CRM")
+                    with transaction.atomic():
+                        placed, shortages = place_ss_order(data, ss_user, crm_user, products, prices)
+                    result.update({
+                        "status": "created",
+                        "orders": keyed_orders(placed, order_summary),
+                        "shortages": shortages,
+                    })
+                except StockShortage as e:
+                    result.update({"status": "rejected", "error": str(e), "shortages": e.shortages})
+                except Exception as e:
+                    result.update({"status": "failed", "error": str(e)})
+                results[index] = result
+    except Exception as e:
+        logger.exception("Batch order chunk failed")
+        for index, data, _, _ in orders:
+            results[index] = {"index": index, "status": "failed", "error": str(e)}
+
+    return [results[index] for index, _ in chunk]
@@ -1,11 +1,17 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from orders.tasks import auto_hold_old_orders
+from orders.idempotency import purge_expired_idempotency_keys
+from orders.notifications import dispatch_outbox, flush_digests
+from orders.intake import process_intake_tickets
 
 scheduler_started = False
+scheduler = None
+OUTBOX_JOB_ID = "notification_outbox"
+INTAKE_JOB_ID = "order_intake"
 
 
 def start():
-    global scheduler_started
+    global scheduler_started, scheduler
 
     # ✅ duplicate scheduler stop
     if scheduler_started:
@@ -16,6 +22,24 @@ def start():
     # ✅ हर 1 घंटे बाद check
     scheduler.add_job(auto_hold_old_orders, trigger='interval', hours=10)
 
+    # ✅ expired Idempotency-Key responses हटाओ
+    scheduler.add_job(purge_expired_idempotency_keys, trigger='interval', hours=1)
+
+    # ✅ WhatsApp outbox — new orders wake it right away, interval picks up retries
+    scheduler.add_job(
+        dispatch_outbox, trigger='interval', seconds=30, id=OUTBOX_JOB_ID,
+        max_instances=1, coalesce=True,
+    )
+
+    # ✅ digest routes: parked new-order events -> one message per CRM number
+    scheduler.add_job(flush_digests, trigger='interval', minutes=1, max_instances=1, coalesce=True)
+
+    # ✅ queued (202) orders — new tickets wake it right away
+    scheduler.add_job(
+        process_intake_tickets, trigger='interval', seconds=5, id=INTAKE_JOB_ID,
+        max_instances=1, coalesce=True,
+    )
+
     scheduler.start()
 
     scheduler_started = True
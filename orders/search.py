@@ -0,0 +1,171 @@
+# orders/search.py
+# Substring search over order ids and party names (CRM search-as-you-type).
+# - Postgres: pg_trgm GIN indexes on UPPER(col::text) (migration 0038) -> the
+#   plain icontains filters are index scans instead of leading-wildcard scans.
+# - Elsewhere (SQLite): in-process trigram index {gram: {pk}} per column;
+#   candidates come from the posting lists and are checked against the stored
+#   text. Order ids never change, so those indexes only read rows newer than
+#   the last one seen; party names are reloaded on edit / after a TTL.
+# Ranking: exact > prefix > word prefix > substring, newest first within a rank.
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import connection
+from django.db.models import Q
+
+GRAM = 3
+MAX_CANDIDATES = 5000       # broader matches -> plain icontains (an IN list that long is no faster)
+PARTY_INDEX_TTL = 300       # seconds; party renames in other worker processes show up within this
+SUGGESTION_CANDIDATES = 200
+SUGGESTION_LIMIT = 20
+
+_WORD_SPLIT = re.compile(r"[\s\-_/.,&]+")
+
+
+def normalize(text):
+    return " ".join(str(text or "").lower().split())
+
+
+def ngrams(text):
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+def match_rank(text, query):
+    """0 exact, 1 prefix, 2 word prefix, 3 substring; None if text doesn't contain query."""
+    text, query = normalize(text), normalize(query)
+    if not query or query not in text:
+        return None
+    if text == query:
+        return 0
+    if text.startswith(query):
+        return 1
+    if any(word.startswith(query) for word in _WORD_SPLIT.split(text)):
+        return 2
+    return 3
+
+
+class NgramIndex:
+    """In-process trigram index over one text column of a model (pk -> lowercased text)."""
+
+    def __init__(self, model_label, field, append_only=False, ttl=None):
+        self.model_label = model_label
+        self.field = field
+        self.append_only = append_only   # rows only added, text never edited (order ids)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._texts = {}
+        self._grams = defaultdict(set)
+        self._max_pk = 0
+        self._loaded_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._reset()
+
+    def _add(self, pk, text):
+        self._max_pk = max(self._max_pk, pk)
+        text = normalize(text)
+        if not text:
+            return
+        self._texts[pk] = text
+        for gram in ngrams(text):
+            self._grams[gram].add(pk)
+
+    def _refresh(self):
+        model = apps.get_model(self.model_label)
+        stale = self._loaded_at is None or (self.ttl and time.monotonic() - self._loaded_at > self.ttl)
+        if stale:
+            self._reset()
+            rows = model.objects.values_list("pk", self.field)
+            self._loaded_at = time.monotonic()
+        elif self.append_only:
+            rows = model.objects.filter(pk__gt=self._max_pk).values_list("pk", self.field)
+        else:
+            return
+        for pk, text in rows.iterator():
+            self._add(pk, text)
+
+    def search(self, query):
+        """pks whose text contains query (case-insensitive); None when more than MAX_CANDIDATES match."""
+        query = normalize(query)
+        if not query:
+            return None
+        with self._lock:
+            self._refresh()
+            if len(query) < GRAM:
+                # too short for a gram: scan of the in-memory texts (no DB)
+                pks = [pk for pk, text in self._texts.items() if query in text]
+            else:
+                postings = sorted((self._grams.get(gram, set()) for gram in ngrams(query)), key=len)
+                candidates = postings[0].intersection(*postings[1:])
+                pks = [pk for pk in candidates if query in self._texts[pk]]
+        return None if len(pks) > MAX_CANDIDATES else pks
+
+
+SS_ORDER_IDS = NgramIndex("orders.SSOrder", "order_id", append_only=True)
+DS_ORDER_IDS = NgramIndex("distributer.DSOrder", "order_id", append_only=True)
+PARTY_NAMES = NgramIndex("accounts.CustomUser", "party_name", ttl=PARTY_INDEX_TTL)
+
+
+def invalidate_search_indexes():
+    for index in (SS_ORDER_IDS, DS_ORDER_IDS, PARTY_NAMES):
+        index.invalidate()
+
+
+def contains(query, text_path, index, pk_path):
+    """Q for `text_path` icontains `query`: trigram GIN on Postgres, else pks from the in-process index."""
+    if connection.vendor != "postgresql":
+        pks = index.search(query)
+        if pks is not None:
+            return Q(**{f"{pk_path}__in": pks})
+    return Q(**{f"{text_path}__icontains": query})
+
+
+def order_id_q(query, order_path=""):
+    """SS order id contains query; order_path: "" on SSOrder, "original_order__" on CRMVerifiedOrder."""
+    return contains(query, f"{order_path}order_id", SS_ORDER_IDS, f"{order_path}id")
+
+
+def ds_order_id_q(query):
+    return contains(query, "order_id", DS_ORDER_IDS, "id")
+
+
+def party_q(query, user_path):
+    """Party name of the user at user_path ("ss_user", "original_order__ss_user", ...) contains query."""
+    return contains(query, f"{user_path}__party_name", PARTY_NAMES, user_path)
+
+
+def suggest_orders(queryset, query, user_path="ss_user", limit=SUGGESTION_LIMIT):
+    """
+    Ranked matches of query on order id / party name within queryset (already
+    role-scoped) -> [(rank, order)]. Exact order id always found (unique index);
+    others from the newest SUGGESTION_CANDIDATES matches.
+    """
+    query = (query or "").strip()
+    if not query:
+        return []
+    scoped = queryset.select_related(user_path)
+    exact = list(scoped.filter(order_id=query.upper())[:1])
+    candidates = list(
+        scoped.filter(order_id_q(query) | party_q(query, user_path))
+        .order_by("-created_at", "-id")[:SUGGESTION_CANDIDATES]
+    )
+
+    ranked = {}
+    for order in exact + candidates:
+        ranks = [
+            rank for rank in (
+                match_rank(order.order_id, query),
+                match_rank(getattr(getattr(order, user_path), "party_name", None), query),
+            ) if rank is not None
+        ]
+        if ranks:
+            ranked[order.pk] = (min(ranks), order)
+    rows = sorted(ranked.values(), key=lambda row: (row[0], -row[1].created_at.timestamp(), -row[1].pk))
+    return rows[:limit]
@@ -28,7 +28,7 @@ class SSOrderSerializer(serializers.ModelSerializer):
             'ss_party_name', 'ss_user', 'ss_user_name',
             'assigned_crm', 'crm_name',
             'total_amount', 'status', 'created_at',
-            'items', 'crm_history'
+            'items', 'crm_history', 'version'
         ]
 
     def get_crm_history(self, obj):
@@ -98,6 +98,7 @@ class SS_to_CRM_Orders(serializers.ModelSerializer):
             "created_at",
             "items",
             "note",
+            "version",
         ]
 
 
@@ -118,7 +119,7 @@ class CRMVerifiedOrderSerializer(serializers.ModelSerializer):
         model = CRMVerifiedOrder
         fields = [
             'id', 'order_id', 'original_order', 'crm_user', 'crm_name',
-            'verified_at', 'status',  'items'
+            'verified_at', 'status',  'items', 'version'
         ]
 
 # ⚡️ Lightweight list serializer for history page (fast)
@@ -158,7 +159,7 @@ class VerifiedOrderDetailsSerializer(serializers.ModelSerializer):
         model = CRMVerifiedOrder
         fields = [
             'id', 'order_id', 'ss_party_name', 'ss_user_name', 'crm_name','ss_order_created_at',
-            'verified_at', 'status', 'items','punched','dispatch_location'
+            'verified_at', 'status', 'items','punched','dispatch_location', 'version'
         ]
 
     def get_items(self, obj):
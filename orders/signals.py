@@ -1,8 +1,18 @@
 # orders/signals.py
-from django.db.models.signals import post_save, pre_delete
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.dispatch import receiver
-from .models import SSOrder, SSOrderItem, PendingOrderItemSnapshot
-from products.utils import recalculate_virtual_stock
+from django.db import transaction
+from .models import SSOrder, SSOrderItem, PendingOrderItemSnapshot, NotificationRoute, OrderSplitRule
+from products.utils import mark_reserved_delta
+from .events import publish_on_commit, publish_order_status, ORDER_CREATED
+from .notifications import invalidate_route_cache
+from .splitting import invalidate_split_cache
+from .search import PARTY_NAMES
+from django.contrib.auth import get_user_model
+from products.models import Product
 
 @receiver(post_save, sender=SSOrderItem)
 def create_pending_snapshot(sender, instance, created, **kwargs):
@@ -11,24 +21,118 @@ def create_pending_snapshot(sender, instance, created, **kwargs):
         snapshot, created_snap = PendingOrderItemSnapshot.objects.get_or_create(
             order=order,
             product=instance.product,
-            defaults={'quantity': instance.quantity}
+            defaults={'quantity': instance.quantity, 'location': order.ss_user.stock_location}
         )
         if not created_snap:
             snapshot.quantity = instance.quantity
             snapshot.save(update_fields=["quantity"])
 
-        # ✅ Recalculate virtual stock
-        recalculate_virtual_stock(instance.product)
+_bulk_delete_state = threading.local()
+
+
+@contextmanager
+def snapshots_deleted_in_bulk():
+    """Caller already removed the orders' snapshots in one DELETE -> skip the per-order delete below."""
+    _bulk_delete_state.active = True
+    try:
+        yield
+    finally:
+        _bulk_delete_state.active = False
+
 
 @receiver(pre_delete, sender=SSOrder)
 def delete_pending_snapshots(sender, instance, **kwargs):
-    for snapshot in PendingOrderItemSnapshot.objects.filter(order=instance):
-        recalculate_virtual_stock(snapshot.product)
+    if getattr(_bulk_delete_state, "active", False):
+        return
     PendingOrderItemSnapshot.objects.filter(order=instance).delete()
 
 @receiver(post_save, sender=SSOrder)
 def remove_snapshot_on_status_change(sender, instance, **kwargs):
     if instance.status != 'PENDING':
-        for snapshot in PendingOrderItemSnapshot.objects.filter(order=instance):
-            recalculate_virtual_stock(snapshot.product)
         PendingOrderItemSnapshot.objects.filter(order=instance).delete()
+
+@receiver(post_save, sender=SSOrder)
+def publish_order_event(sender, instance, created, **kwargs):
+    # ✅ SSE: new order -> assigned CRM, status change -> CRM + SS
+    if created:
+        publish_on_commit(
+            ORDER_CREATED,
+            {
+                "id": instance.id,
+                "order_id": instance.order_id,
+                "status": instance.status,
+                "total_amount": str(instance.total_amount),
+                "note": instance.note,
+            },
+            crm_id=instance.assigned_crm_id,
+            ss_id=instance.ss_user_id,
+        )
+    elif getattr(instance, "_loaded_status", instance.status) != instance.status:
+        publish_order_status([instance])
+    instance._loaded_status = instance.status
+
+
+# ✅ Snapshot create / update / delete -> reserved_qty delta (no re-SUM)
+# Deltas go to the dirty product set and are applied once per transaction.
+
+@receiver(pre_save, sender=PendingOrderItemSnapshot)
+def load_snapshot_quantity(sender, instance, **kwargs):
+    if instance.pk is not None and not hasattr(instance, "_loaded_quantity"):
+        stored = sender.objects.filter(pk=instance.pk).values_list("quantity", "location").first()
+        instance._loaded_quantity, instance._loaded_location = stored or (None, None)
+
+@receiver(post_save, sender=PendingOrderItemSnapshot)
+def reserve_snapshot_quantity(sender, instance, created, **kwargs):
+    old_qty = 0 if created else (getattr(instance, "_loaded_quantity", None) or 0)
+    old_location = getattr(instance, "_loaded_location", None) or instance.location
+
+    if old_location != instance.location:
+        # warehouse changed (e.g. CRM dispatches from Mumbai) -> move the reservation
+        mark_reserved_delta(instance.product_id, -old_qty, old_location)
+        mark_reserved_delta(instance.product_id, instance.quantity, instance.location)
+    else:
+        mark_reserved_delta(instance.product_id, instance.quantity - old_qty, instance.location)
+
+    instance._loaded_quantity = instance.quantity
+    instance._loaded_location = instance.location
+
+@receiver(post_delete, sender=PendingOrderItemSnapshot)
+def release_snapshot_quantity(sender, instance, **kwargs):
+    qty = getattr(instance, "_loaded_quantity", None)
+    if qty is None:
+        qty = instance.quantity
+    location = getattr(instance, "_loaded_location", None) or instance.location
+    mark_reserved_delta(instance.product_id, -qty, location)
+
+
+# ✅ Route edits -> drop the process cache once committed (other processes: ROUTE_CACHE_TTL)
+@receiver(post_save, sender=NotificationRoute)
+@receiver(post_delete, sender=NotificationRoute)
+def reset_notification_routes(sender, **kwargs):
+    transaction.on_commit(invalidate_route_cache)
+
+
+# ✅ Split rules / product category edits -> recompile the product -> bucket map (other processes: SPLIT_CACHE_TTL)
+SPLIT_FIELDS = {"sub_category", "product_type"}
+
+
+@receiver(post_save, sender=OrderSplitRule)
+@receiver(post_delete, sender=OrderSplitRule)
+@receiver(post_delete, sender=Product)
+def reset_split_rules(sender, **kwargs):
+    transaction.on_commit(invalidate_split_cache)
+
+
+@receiver(post_save, sender=Product)
+def reset_split_rules_on_product_save(sender, created, update_fields=None, **kwargs):
+    # new product: looked up on the fly, stock-only saves: bucket can't change
+    if not created and (update_fields is None or SPLIT_FIELDS & set(update_fields)):
+        transaction.on_commit(invalidate_split_cache)
+
+
+# ✅ Party renamed / new user -> in-process party name index reloaded on next search
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def reset_party_name_index(sender, update_fields=None, **kwargs):
+    if update_fields is None or "party_name" in update_fields:
+        transaction.on_commit(PARTY_NAMES.invalidate)
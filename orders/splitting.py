@@ -0,0 +1,123 @@
+# orders/splitting.py
+# SS cart -> one order per dispatch stream ("Tempered", "Accessories", ...).
+# OrderSplitRule rows are compiled once into {(warehouse, is_scheme): {product_id: bucket}};
+# splitting a cart is then a dict lookup per line, no queries.
+import threading
+import time
+from collections import namedtuple
+
+from accounts.models import STOCK_LOCATIONS
+from orders.models import OrderSplitRule
+from products.models import Product
+
+DEFAULT_BUCKET = "Accessories"   # lines no rule matches
+SPLIT_CACHE_TTL = 300            # seconds; rule/product edits in other worker processes show up within this
+
+# rank: position of the first rule for this bucket (orders are created in this order)
+# dedicated: matched by a scheme_items=True rule -> scheme lines get their own order
+Bucket = namedtuple("Bucket", "name rank dedicated")
+DEFAULT = Bucket(DEFAULT_BUCKET, 10 ** 6, False)
+
+_split_cache = {"compiled": None, "loaded_at": 0.0}
+_split_cache_lock = threading.Lock()
+
+
+def invalidate_split_cache():
+    _split_cache["compiled"] = None
+
+
+def _compile_rules():
+    rules = []
+    ranks = {}
+    for rule in OrderSplitRule.objects.filter(is_active=True):
+        rank = ranks.setdefault(rule.bucket, len(ranks))
+        rules.append((
+            Bucket(rule.bucket, rank, rule.scheme_items is True),
+            rule.sub_category_contains.lower(),
+            rule.product_type.lower(),
+            rule.warehouse,
+            rule.scheme_items,
+        ))
+    return rules
+
+
+def _match(rules, sub_category, product_type, warehouse, is_scheme):
+    sub_category = (sub_category or "").lower()
+    product_type = (product_type or "").lower()
+    for bucket, contains, ptype, rule_warehouse, scheme_items in rules:
+        if contains and contains not in sub_category:
+            continue
+        if ptype and ptype != product_type:
+            continue
+        if rule_warehouse and rule_warehouse != warehouse:
+            continue
+        if scheme_items is not None and scheme_items != is_scheme:
+            continue
+        return bucket
+    return DEFAULT
+
+
+def _compile():
+    """Rules x catalogue -> {(warehouse, is_scheme): {product_id: Bucket}} (2 queries)."""
+    rules = _compile_rules()
+    buckets = {}
+    if rules:
+        catalogue = list(Product.objects.values_list("product_id", "sub_category", "product_type"))
+        for warehouse, _ in STOCK_LOCATIONS:
+            for is_scheme in (False, True):
+                buckets[(warehouse, is_scheme)] = {
+                    product_id: bucket
+                    for product_id, sub_category, product_type in catalogue
+                    if (bucket := _match(rules, sub_category, product_type, warehouse, is_scheme)) is not DEFAULT
+                }
+    return {"rules": rules, "buckets": buckets}
+
+
+def compiled_rules():
+    if _split_cache["compiled"] is None or time.monotonic() - _split_cache["loaded_at"] > SPLIT_CACHE_TTL:
+        with _split_cache_lock:
+            if _split_cache["compiled"] is None or time.monotonic() - _split_cache["loaded_at"] > SPLIT_CACHE_TTL:
+                _split_cache["compiled"] = _compile()
+                _split_cache["loaded_at"] = time.monotonic()
+    return _split_cache["compiled"]
+
+
+def bucket_for(product, warehouse, is_scheme=False):
+    compiled = compiled_rules()
+    if not compiled["rules"]:
+        return DEFAULT
+    bucket = compiled["buckets"].get((warehouse, is_scheme), {}).get(product.product_id)
+    if bucket is None:
+        # not in the map: default bucket, or a product added after the last compile
+        bucket = _match(compiled["rules"], product.sub_category, product.product_type, warehouse, is_scheme)
+    return bucket
+
+
+def split_cart(items, rewards, products, warehouse):
+    """
+    items / rewards (scheme lines) of a cart -> [(bucket_name, items, rewards)], in rule order.
+    - products: {product_id: Product} already fetched; unknown item -> Product.DoesNotExist,
+      unknown scheme product -> skipped
+    - a scheme line joins its bucket only if that bucket has paid items (as the old
+      Accessories-only scheme rule), unless a scheme_items=True rule gives it its own order
+    """
+    groups = {}
+    for item in items:
+        product = products.get(int(item['id']))
+        if product is None:
+            raise Product.DoesNotExist(f"Product {item['id']} not found")
+        bucket = bucket_for(product, warehouse)
+        groups.setdefault(bucket.name, [bucket, [], []])[1].append(item)
+
+    for reward, product_id in rewards:
+        product = products.get(int(product_id)) if product_id else None
+        if product is None:
+            continue
+        bucket = bucket_for(product, warehouse, is_scheme=True)
+        if bucket.name in groups:
+            groups[bucket.name][2].append((reward, product))
+        elif bucket.dedicated:
+            groups[bucket.name] = [bucket, [], [(reward, product)]]
+
+    ordered = sorted(groups.values(), key=lambda group: group[0].rank)
+    return [(bucket.name, group_items, group_rewards) for bucket, group_items, group_rewards in ordered]
@@ -1,44 +1,88 @@
+import logging
 from django.utils import timezone
 from datetime import timedelta
 from django.db import transaction
+from django.db.models import F
+import time
 
 from orders.models import SSOrder, PendingOrderItemSnapshot
-from products.utils import recalculate_virtual_stock
+from orders.events import publish_order_status
+from orders.signals import snapshots_deleted_in_bulk
+from products.utils import coalesce_stock_updates
 
+logger = logging.getLogger(__name__)
 
-def auto_hold_old_orders():
 
+def auto_hold_old_orders(days=3):
+    """
+    PENDING orders older than `days` -> HOLD, in one set-based pass:
+    - one UPDATE for the statuses (no per-order save / post_save)
+    - one DELETE for all their snapshots
+    - reserved stock of the affected products released with one UPDATE
+    Returns stats of the run.
+    """
     print("Checking old pending orders...")
+    started = time.monotonic()
 
-    old_orders = SSOrder.objects.filter(
-        status="PENDING",
-        created_at__lte=timezone.now() - timedelta(days=3)
-    )
+    with transaction.atomic():
+        # ✅ lock the candidates so a CRM verify running now can't interleave
+        orders = list(
+            SSOrder.objects.select_for_update()
+            .filter(status="PENDING", created_at__lte=timezone.now() - timedelta(days=days))
+            .values("id", "order_id", "assigned_crm_id", "ss_user_id")
+        )
+        order_ids = [order["id"] for order in orders]
 
-    for order in old_orders:
+        held = SSOrder.objects.filter(id__in=order_ids, status="PENDING").update(
+            status="HOLD", notes=f"Auto HOLD after {days} days", version=F("version") + 1
+        )
 
-        try:
-            with transaction.atomic():
+        # ✅ snapshots delete -> stock restore (signal deltas summed per product)
+        with coalesce_stock_updates():
+            snapshots = PendingOrderItemSnapshot.objects.filter(order_id__in=order_ids)
+            product_ids = set(snapshots.values_list("product_id", flat=True))
+            deleted, _ = snapshots.delete()
 
-                snapshots = PendingOrderItemSnapshot.objects.filter(order=order)
+        for order in orders:
+            order["status"] = "HOLD"
+        publish_order_status(orders)
 
-                affected_products = [
-                    snap.product for snap in snapshots
-                ]
+    stats = {
+        "orders": held,
+        "snapshots": deleted,
+        "products": len(product_ids),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    print(f"Auto HOLD: {stats['orders']} orders, {stats['snapshots']} snapshots, "
+          f"{stats['products']} products in {stats['seconds']}s")
+    return stats
 
-                # ✅ snapshots delete
-                snapshots.delete()
 
-                # ✅ stock restore
-                for product in set(affected_products):
-                    recalculate_virtual_stock(product)
+def delete_orders(order_ids):
+    """
+    Admin bulk delete, set-based:
+    - one DELETE for all snapshots -> reserved stock of the affected products
+      recalculated once (signal deltas summed per product)
+    - orders + items / verified versions removed by one cascading queryset delete
+      (per-order pre_delete snapshot query skipped)
+    Returns stats of the run ("orders" = number of SS orders deleted).
+    """
+    started = time.monotonic()
 
-                # ✅ HOLD
-                order.status = "HOLD"
-                order.notes = "Auto HOLD after 3 days"
-                order.save()
+    with transaction.atomic():
+        order_ids = list(SSOrder.objects.select_for_update().filter(id__in=order_ids).values_list("id", flat=True))
 
-                print(f"{order.order_id} moved to HOLD")
+        with coalesce_stock_updates() as deltas:
+            PendingOrderItemSnapshot.objects.filter(order_id__in=order_ids).delete()
+        product_ids = {product_id for product_id, _ in deltas}
 
-        except Exception as e:
-            print("ERROR:", e)
\ No newline at end of file
+        with snapshots_deleted_in_bulk():
+            _, per_model = SSOrder.objects.filter(id__in=order_ids).delete()
+
+    stats = {
+        "orders": per_model.get(SSOrder._meta.label, 0),
+        "products": len(product_ids),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    logger.info("Bulk delete: %(orders)s orders, %(products)s products in %(seconds)ss", stats)
+    return stats
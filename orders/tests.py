@@ -1,3 +1,1025 @@
-from django.test import TestCase
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import CustomUser
+from orders.models import IdempotencyKey, NotificationOutbox, NotificationRoute, NotificationDigestEntry, OrderSplitRule, OrderIntakeTicket
+from orders.idempotency import KeyTakenOver, _fingerprint, _store
+from orders.intake import _claim, _still_claimed, process_intake_tickets
+from orders.notifications import (
+    dispatch_outbox, flush_digests, invalidate_route_cache, notify_orders_created, queue_whatsapp_template,
+)
+from orders.models import SSOrder, SSOrderItem, CRMVerifiedOrder, CRMVerifiedOrderItem, PendingOrderItemSnapshot, DispatchOrder
+from orders.search import invalidate_search_indexes
+from orders.splitting import invalidate_split_cache, split_cart
+from orders.tasks import auto_hold_old_orders
+from orders.views import _sse_user
+from products.models import Product
+from products.utils import lock_products
+
+
+class OrderFixtures:
+    """
+    Shared setUp for order tests (TestCase or TransactionTestCase): a CRM and
+    one of its SS users, fresh split rules, and the WhatsApp dispatcher never
+    woken (patched here, not per class, so subclasses' tests are covered too).
+    """
+    ss_fields = {"party_name": "Alpha"}
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("orders.notifications.wake_dispatcher", lambda: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        invalidate_split_cache()  # rules of a rolled-back test stay compiled otherwise
+        self.crm = CustomUser.objects.create_user(mobile="9100000001", role="CRM", password="p", name="crm")
+        self.ss = self.create_ss("9200000001", "ss", **self.ss_fields)
+
+    def create_ss(self, mobile, name, **fields):
+        return CustomUser.objects.create_user(mobile=mobile, role="SS", password="p", name=name, crm=self.crm, **fields)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+
+class LockedReservationTests(OrderFixtures, TransactionTestCase):
+    """Stock reservation under row locks, hit from real threads (own DB connection each)."""
+
+    def setUp(self):
+        super().setUp()
+        self.ss_users = [self.ss, self.create_ss("9200000002", "ss2")]
+        for product_id in (1, 2):
+            Product.objects.create(
+                product_id=product_id, product_name=f"P{product_id}", sub_category="Charger",
+                live_stock=10, virtual_stock=10, price="10", ds_price="8",
+            )
+
+    def place(self, user, product_id, quantity, strict=True):
+        return self.client_for(user).post("/api/ss-orders/create/", {
+            "user_id": user.id, "crm_id": self.crm.id, "total": 0, "strict": strict,
+            "items": [{"id": product_id, "quantity": quantity, "price": 10}],
+        }, format="json")
+
+    def run_in_threads(self, *calls):
+        barrier = threading.Barrier(len(calls))
+        results = []
+
+        def worker(call):
+            try:
+                barrier.wait()
+                results.append(call())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(call,)) for call in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        return results
+
+    def test_shortage_reported(self):
+        response = self.place(self.ss_users[0], 1, 15, strict=False)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["shortages"], [{"product_id": 1, "requested": 15, "available": 10}])
+
+    def test_concurrent_orders_on_same_product_do_not_oversell(self):
+        responses = self.run_in_threads(
+            lambda: self.place(self.ss_users[0], 1, 6),
+            lambda: self.place(self.ss_users[1], 1, 6),
+        )
+        self.assertEqual(sorted(r.status_code for r in responses), [201, 409])
+        rejected = next(r for r in responses if r.status_code == 409)
+        self.assertEqual(rejected.data["shortages"], [{"product_id": 1, "requested": 6, "available": 4}])
+
+        product = Product.objects.get(product_id=1)
+        self.assertEqual((product.reserved_qty, product.virtual_stock), (6, 4))
+
+    def test_concurrent_orders_on_disjoint_products(self):
+        responses = self.run_in_threads(
+            lambda: self.place(self.ss_users[0], 1, 6),
+            lambda: self.place(self.ss_users[1], 2, 6),
+        )
+        self.assertEqual([r.status_code for r in responses], [201, 201])
+        self.assertEqual(
+            dict(Product.objects.values_list("product_id", "reserved_qty")),
+            {1: 6, 2: 6},
+        )
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_disjoint_locks_do_not_wait(self):
+        second_locked = threading.Event()
+
+        def hold_first():
+            with transaction.atomic():
+                lock_products([1])
+                # product 1 stays locked until the other product is locked too
+                return second_locked.wait(timeout=10)
+
+        def lock_second():
+            with transaction.atomic():
+                lock_products([2])
+                second_locked.set()
+            return True
+
+        self.assertEqual(self.run_in_threads(hold_first, lock_second), [True, True])
+
+
+class FakeWhatsAppServer:
+    """
+    Local stand-in for the Meta Cloud API.
+    responses: list of (status_code, delay_seconds) served in order, then 200.
+    """
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with fake.lock:
+                    fake.requests.append({"path": self.path, "auth": self.headers["Authorization"], "body": body})
+                    code, delay = fake.responses.pop(0) if fake.responses else (200, 0)
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                time.sleep(delay)
+                with fake.lock:
+                    fake.in_flight -= 1
+                try:
+                    self.send_response(code)
+                    self.send_header("Content-Type", "application/json")
+                    self.end_headers()
+                    self.wfile.write(json.dumps({"messages": [{"id": "wamid.test"}]}).encode())
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client gave up (timeout test)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.env = mock.patch.dict(os.environ, {
+            "META_WHATSAPP_API_URL": self.url,
+            "META_WHATSAPP_TOKEN": "test-token",
+            "META_PHONE_NUMBER_ID": "12345",
+        })
+        self.env.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.env.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class NotificationOutboxTests(OrderFixtures, TestCase):
+    def queue(self, count=1):
+        return [
+            queue_whatsapp_template("7678491163", "order_updation", "EN", ["Alpha", f"ORD-{i}", "100"], order_ref=f"ORD-{i}")
+            for i in range(count)
+        ]
+
+    def setUp(self):
+        super().setUp()
+        invalidate_route_cache()
+
+    def test_order_placement_only_queues(self):
+        NotificationRoute.objects.create(crm=self.crm, to_number="7678491163")
+        Product.objects.create(product_id=1, product_name="P1", sub_category="Charger", live_stock=10, price="10", ds_price="8")
+
+        with FakeWhatsAppServer() as fake:
+            response = self.client_for(self.ss).post("/api/ss-orders/create/", {
+                "user_id": self.ss.id, "crm_id": self.crm.id, "total": 0,
+                "items": [{"id": 1, "quantity": 2, "price": 10}],
+            }, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(fake.requests, [])
+        row = NotificationOutbox.objects.get()
+        self.assertEqual((row.status, row.to_number, row.order_ref),
+                         ("PENDING", "7678491163", response.data["orders"]["normal_order"]["order_id"]))
+
+    def test_dispatch_sends_and_marks_sent(self):
+        row, = self.queue()
+        with FakeWhatsAppServer() as fake:
+            stats = dispatch_outbox()
+
+        self.assertEqual(stats, {"claimed": 1, "sent": 1, "retry": 0, "failed": 0})
+        request, = fake.requests
+        self.assertEqual(request["path"], "/v20.0/12345/messages")
+        self.assertEqual(request["auth"], "Bearer test-token")
+        self.assertEqual(request["body"]["to"], "917678491163")
+        self.assertEqual(request["body"]["template"]["name"], "order_updation")
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), ("SENT", 1))
+        self.assertIsNotNone(row.sent_at)
+
+    def test_server_error_retried_with_backoff(self):
+        row, = self.queue()
+        with FakeWhatsAppServer([(503, 0)]) as fake:
+            self.assertEqual(dispatch_outbox()["retry"], 1)
+            row.refresh_from_db()
+            self.assertEqual((row.status, row.attempts), ("PENDING", 1))
+            self.assertGreater(row.next_attempt_at, timezone.now() + timedelta(seconds=20))
+
+            # not due yet
+            self.assertEqual(dispatch_outbox()["claimed"], 0)
+
+            NotificationOutbox.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(dispatch_outbox()["sent"], 1)
+        self.assertEqual(len(fake.requests), 2)
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), ("SENT", 2))
+
+    def test_client_error_fails_without_retry(self):
+        row, = self.queue()
+        with FakeWhatsAppServer([(400, 0)]):
+            self.assertEqual(dispatch_outbox()["failed"], 1)
+        row.refresh_from_db()
+        self.assertEqual(row.status, "FAILED")
+        self.assertIn("HTTP 400", row.last_error)
+
+    def test_hung_endpoint_times_out(self):
+        row, = self.queue()
+        with FakeWhatsAppServer([(200, 1)]):
+            started = time.monotonic()
+            stats = dispatch_outbox(timeout=(1, 0.2))
+            self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(stats["retry"], 1)
+        row.refresh_from_db()
+        self.assertIn("Timeout", row.last_error)
+
+    def test_concurrency_is_bounded(self):
+        self.queue(8)
+        with FakeWhatsAppServer([(200, 0.1)] * 8) as fake:
+            stats = dispatch_outbox(max_workers=3)
+        self.assertEqual(stats["sent"], 8)
+        self.assertLessEqual(fake.max_in_flight, 3)
+        self.assertGreater(fake.max_in_flight, 1)
+
+
+class NotificationRouteTests(OrderFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        invalidate_route_cache()
+        self.orders = [
+            SSOrder.objects.create(ss_user=self.ss, assigned_crm=self.crm, total_amount=amount)
+            for amount in (100, 250)
+        ]
+
+    def outbox(self):
+        return sorted(NotificationOutbox.objects.values_list("to_number", "parameters"))
+
+    def test_crm_and_role_routes(self):
+        NotificationRoute.objects.create(crm=self.crm, to_number="7000000001")
+        NotificationRoute.objects.create(role="CRM")  # blank number -> CRM's own mobile
+        NotificationRoute.objects.create(crm=self.crm, to_number="7000000002", is_active=False)
+
+        notify_orders_created(self.ss, self.crm, self.orders[:1])
+
+        order = self.orders[0]
+        self.assertEqual(self.outbox(), [
+            ("7000000001", ["Alpha", order.order_id, str(order.total_amount)]),
+            (self.crm.mobile, ["Alpha", order.order_id, str(order.total_amount)]),
+        ])
+
+    def test_routes_cached_until_changed(self):
+        route = NotificationRoute.objects.create(crm=self.crm, to_number="7000000001")
+        notify_orders_created(self.ss, self.crm, self.orders[:1])
+
+        with self.assertNumQueries(1):  # outbox insert only, routes from cache
+            notify_orders_created(self.ss, self.crm, self.orders[1:])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            route.to_number = "7000000009"
+            route.save()
+        notify_orders_created(self.ss, self.crm, self.orders[:1])
+        self.assertEqual(NotificationOutbox.objects.last().to_number, "7000000009")
+
+    def test_digest_batches_per_interval(self):
+        NotificationRoute.objects.create(crm=self.crm, to_number="7000000001", digest=True, digest_minutes=15)
+        notify_orders_created(self.ss, self.crm, self.orders)
+        self.assertEqual(NotificationDigestEntry.objects.count(), 2)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+        self.assertEqual(flush_digests(), {"messages": 0, "events": 0})  # interval not over yet
+
+        NotificationDigestEntry.objects.update(created_at=timezone.now() - timedelta(minutes=16))
+        self.assertEqual(flush_digests(), {"messages": 1, "events": 2})
+        refs = ", ".join(order.order_id for order in self.orders)
+        self.assertEqual(self.outbox(), [("7000000001", ["Alpha", f"2 orders: {refs}", "350.00"])])
+        self.assertFalse(NotificationDigestEntry.objects.exists())
+
+
+class OrderSplitRuleTests(OrderFixtures, TestCase):
+    ss_fields = {"stock_location": "MUMBAI"}
+
+    def setUp(self):
+        super().setUp()
+        OrderSplitRule.objects.all().delete()
+        OrderSplitRule.objects.create(bucket="Tempered", priority=10, sub_category_contains="tempered", scheme_items=False)
+        invalidate_split_cache()
+        for product_id, sub_category in ((1, "Tempered Glass"), (2, "Charger"), (3, "Cable")):
+            Product.objects.create(product_id=product_id, product_name=f"P{product_id}", sub_category=sub_category, live_stock=100, mumbai_stock=100, price="10")
+        self.products = Product.objects.in_bulk([1, 2, 3])
+
+    def split(self, product_ids, scheme_ids=(), warehouse="MUMBAI"):
+        groups = split_cart(
+            [{"id": pid} for pid in product_ids], [({"quantity": 1}, pid) for pid in scheme_ids], self.products, warehouse,
+        )
+        return [(bucket, [i["id"] for i in items], [p.product_id for _, p in rewards]) for bucket, items, rewards in groups]
+
+    def test_default_tempered_split(self):
+        self.assertEqual(self.split([2, 1], scheme_ids=[3]), [("Tempered", [1], []), ("Accessories", [2], [3])])
+        # no paid Accessories line -> scheme line dropped, as before
+        self.assertEqual(self.split([1], scheme_ids=[3]), [("Tempered", [1], [])])
+
+    def test_rules_by_warehouse_and_scheme(self):
+        OrderSplitRule.objects.create(bucket="Chargers", priority=20, sub_category_contains="charger", warehouse="MUMBAI")
+        OrderSplitRule.objects.create(bucket="Free Goods", priority=30, scheme_items=True)
+        invalidate_split_cache()
+
+        self.assertEqual(self.split([1, 2, 3], scheme_ids=[1]),
+                         [("Tempered", [1], []), ("Chargers", [2], []), ("Free Goods", [], [1]), ("Accessories", [3], [])])
+        self.assertEqual(self.split([2], warehouse="DELHI"), [("Accessories", [2], [])])
+
+        response = self.client_for(self.ss).post("/api/ss-orders/create/", {
+            "user_id": self.ss.id, "crm_id": self.crm.id, "total": 0,
+            "items": [{"id": 1, "quantity": 1, "price": 10}, {"id": 2, "quantity": 1, "price": 10}],
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(k for k, v in response.data["orders"].items() if v), ["chargers_order", "tempered_order"])
+        self.assertEqual(sorted(SSOrder.objects.values_list("note", flat=True)), ["Chargers Order", "Tempered Order"])
+
+    def test_bucket_names_must_keep_distinct_response_keys(self):
+        for bucket in ("Normal", "tempered", "TEMPERED!", "--"):
+            with self.assertRaises(ValidationError) as raised:
+                OrderSplitRule(bucket=bucket).full_clean()
+            self.assertIn("bucket", raised.exception.message_dict)
+        for bucket in ("Tempered", "Accessories", "Free Goods"):  # same rule bucket / default / new key
+            OrderSplitRule(bucket=bucket).full_clean()
+
+    def test_compiled_once_until_products_change(self):
+        self.split([1, 2])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.split([1, 2, 3]), [("Tempered", [1], []), ("Accessories", [2, 3], [])])
+
+        product = self.products[3]
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save(update_fields=["live_stock"])  # stock only -> map kept
+        with self.assertNumQueries(0):
+            self.split([3])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.sub_category = "Tempered Film"
+            product.save()
+        self.assertEqual(self.split([3]), [("Tempered", [3], [])])
+
+
+@mock.patch("orders.intake.wake_intake_worker", lambda: None)
+class OrderIntakeQueueTests(OrderFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = self.create_ss("9200000002", "other")
+        Product.objects.create(product_id=1, product_name="P1", sub_category="Charger", live_stock=10, price="10", ds_price="8")
+        self.client = self.client_for(self.ss)
+
+    def queue(self, quantity=2, **extra):
+        return self.client.post("/api/ss-orders/create/", {
+            "user_id": self.ss.id, "crm_id": self.crm.id, "total": 0,
+            "items": [{"id": 1, "quantity": quantity, "price": 10}], **extra,
+        }, format="json", HTTP_PREFER="respond-async")
+
+    def test_accepted_then_placed_by_worker(self):
+        response = self.queue()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response["Location"], f"/api/order-tickets/{response.data['ticket']}/")
+        self.assertFalse(SSOrder.objects.exists())
+
+        self.assertEqual(process_intake_tickets(), {"claimed": 1, "done": 1, "rejected": 0, "failed": 0})
+        order = SSOrder.objects.get()
+        self.assertEqual(order.total_amount, 20)
+
+        poll = self.client.get(response["Location"])
+        self.assertEqual(poll.data["status"], "DONE")
+        self.assertEqual(poll.data["result"]["orders"]["normal_order"]["order_id"], order.order_id)
+
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(response["Location"]).status_code, 404)
+
+    def test_invalid_payload_rejected_up_front(self):
+        response = self.client.post("/api/ss-orders/create/?mode=queue", {
+            "user_id": self.ss.id, "crm_id": self.crm.id, "items": [{"id": 99, "quantity": 1}],
+        }, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OrderIntakeTicket.objects.exists())
+
+    def test_strict_shortage_rejects_ticket(self):
+        self.queue(quantity=50, strict=True)
+        self.assertEqual(process_intake_tickets()["rejected"], 1)
+        ticket = OrderIntakeTicket.objects.get()
+        self.assertEqual((ticket.status, ticket.error), ("REJECTED", "Insufficient stock"))
+        self.assertFalse(SSOrder.objects.exists())
+
+    def test_crash_before_outcome_rolls_back_placement(self):
+        self.queue()
+        with mock.patch("orders.intake._finish", side_effect=RuntimeError("worker died")):
+            with self.assertRaises(RuntimeError):
+                process_intake_tickets()
+        self.assertFalse(SSOrder.objects.exists())
+        self.assertEqual(OrderIntakeTicket.objects.get().status, "PROCESSING")
+
+        OrderIntakeTicket.objects.update(locked_at=timezone.now() - timedelta(minutes=6))
+        self.assertEqual(process_intake_tickets()["done"], 1)
+        self.assertEqual(SSOrder.objects.count(), 1)
+
+    def test_taken_over_claim_places_nothing(self):
+        self.queue()
+        tickets, claimed_at = _claim(10)
+        self.assertEqual(_claim(10)[0], [])  # nothing claimable twice
+
+        OrderIntakeTicket.objects.update(locked_at=claimed_at - timedelta(minutes=6))
+        retaken, _ = _claim(10)  # stale -> another worker claims it
+        self.assertEqual([t.attempts for t in retaken], [2])
+        with transaction.atomic():
+            self.assertEqual(_still_claimed(tickets, claimed_at), [])  # first worker backs off
+        self.assertEqual(process_intake_tickets()["claimed"], 0)
+        self.assertFalse(SSOrder.objects.exists())
+
+
+class SSOrderBatchCreateTests(OrderFixtures, TestCase):
+    url = "/api/ss-orders/batch/"
+
+    def setUp(self):
+        super().setUp()
+        for pid in (1, 2):
+            Product.objects.create(product_id=pid, product_name=f"P{pid}", sub_category="Charger", live_stock=100, price="10")
+        self.client = self.client_for(self.ss)
+
+    def order(self, product_id=1, quantity=2, **extra):
+        return {"user_id": self.ss.id, "crm_id": self.crm.id, "total": 0,
+                "items": [{"id": product_id, "quantity": quantity, "price": 10}], **extra}
+
+    def post_json(self, orders):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, orders, format="json")
+
+    def post_ndjson(self, lines):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, "\n".join(lines), content_type="application/x-ndjson")
+
+    def assert_mixed_results(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["created"], response.data["failed"]), (2, 3))
+        results = response.data["results"]
+        self.assertEqual([r["index"] for r in results], [0, 1, 2, 3, 4])
+        self.assertEqual([r["status"] for r in results], ["created", "failed", "failed", "failed", "created"])
+        self.assertEqual(results[0]["client_ref"], "a")
+        self.assertEqual(results[3]["error"], "Order must be an object")
+
+        # failed entries don't roll back the valid ones around them
+        placed = SSOrder.objects.order_by("id")
+        self.assertEqual(
+            [o.order_id for o in placed],
+            [results[0]["orders"]["normal_order"]["order_id"], results[4]["orders"]["normal_order"]["order_id"]],
+        )
+        self.assertEqual(sorted(SSOrderItem.objects.values_list("product_id", "quantity")), [(1, 2), (2, 3)])
+        self.assertEqual(
+            list(Product.objects.order_by("product_id").values_list("reserved_qty", flat=True)), [2, 3],
+        )
+
+    def test_json_array_with_failing_entries(self):
+        response = self.post_json([
+            self.order(client_ref="a"),
+            {"user_id": self.ss.id},  # no crm_id / items
+            self.order(product_id=999),
+            ["not", "an", "order"],
+            self.order(product_id=2, quantity=3),
+        ])
+        self.assert_mixed_results(response)
+        self.assertIn("Invalid order", response.data["results"][1]["error"])
+
+    def test_ndjson_with_failing_lines(self):
+        response = self.post_ndjson([
+            json.dumps(self.order(client_ref="a")),
+            '{"user_id": 1, "items": [',
+            json.dumps(self.order(product_id=999)),
+            '"not an order"',
+            "",
+            json.dumps(self.order(product_id=2, quantity=3)),
+        ])
+        self.assert_mixed_results(response)
+        self.assertIn("Invalid JSON line", response.data["results"][1]["error"])
+
+    def test_not_a_list_rejected(self):
+        self.assertEqual(self.post_json({"orders": "nope"}).status_code, 400)
+
+    def test_lookups_shared_across_the_batch(self):
+        # user / full product rows / price counter reads (not the per-order locked stock read)
+        lookup_markers = ('FROM "accounts_customuser"', '"products_product"."product_name"', 'FROM "products_changeversion"')
+
+        def batch(size):
+            return [self.order(product_id=1 + i % 2, quantity=1) for i in range(size)]
+
+        def lookups(queries):
+            return [q["sql"] for q in queries if q["sql"].startswith("SELECT") and any(m in q["sql"] for m in lookup_markers)]
+
+        self.post_json(batch(1))  # price book / split rules / routes cached
+        counts = []
+        for size in (1, 2):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post_json(batch(size)).data["created"], size)
+            counts.append(len(queries))
+        one_lookups = lookups(queries)
+
+        # every extra order costs only its own writes; users, products and prices once per chunk
+        per_order = counts[1] - counts[0]
+        with self.assertNumQueries(counts[0] + 4 * per_order) as queries:
+            self.assertEqual(self.post_json(batch(5)).data["created"], 5)
+        self.assertEqual(len(lookups(queries)), len(one_lookups))
+
+
+class IdempotencyKeyTests(OrderFixtures, TestCase):
+    url = "/api/ss-orders/create/"
+
+    def setUp(self):
+        super().setUp()
+        Product.objects.create(product_id=1, product_name="P1", sub_category="Charger", live_stock=10, price="10")
+        self.client = self.client_for(self.ss)
+
+    def body(self, quantity=2, **extra):
+        return {"user_id": self.ss.id, "crm_id": self.crm.id, "total": 0,
+                "items": [{"id": 1, "quantity": quantity, "price": 10}], **extra}
+
+    def post(self, body, key="k-1"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, body, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def running_key(self, body):
+        return IdempotencyKey.objects.create(
+            key="k-1", scope=f"{self.url}|{self.ss.id}", fingerprint=_fingerprint(SimpleNamespace(data=body)),
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+
+    def test_retry_replays_stored_response(self):
+        first = self.post(self.body())
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(1):
+            again = self.post(self.body())
+        self.assertEqual((again.status_code, again["Idempotent-Replayed"]), (201, "true"))
+        self.assertEqual(again.data["orders"], json.loads(json.dumps(first.data["orders"], cls=DjangoJSONEncoder)))
+        self.assertEqual(SSOrder.objects.count(), 1)
+
+    def test_same_key_different_payload_is_422(self):
+        self.post(self.body())
+        self.assertEqual(self.post(self.body(quantity=3)).status_code, 422)
+        self.assertEqual(SSOrder.objects.count(), 1)
+
+    def test_running_key_is_409_until_abandoned(self):
+        self.running_key(self.body())
+        self.assertEqual(self.post(self.body()).status_code, 409)
+        self.assertFalse(SSOrder.objects.exists())
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(minutes=3))
+        self.assertEqual(self.post(self.body()).status_code, 201)  # nothing stored -> nothing committed -> rerun
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+
+    def test_non_2xx_not_stored(self):
+        response = self.post(self.body(quantity=50, strict=True))
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        Product.objects.filter(product_id=1).update(live_stock=100, virtual_stock=100)
+        self.assertEqual(self.post(self.body(quantity=50, strict=True)).status_code, 201)
+
+    def test_taken_over_request_rolls_back(self):
+        record = self.running_key(self.body())
+        IdempotencyKey.objects.filter(pk=record.pk).delete()  # a retry took the key over
+        with self.assertRaises(KeyTakenOver), transaction.atomic():
+            SSOrder.objects.create(ss_user=self.ss, assigned_crm=self.crm)
+            _store(record, Response({}, status=201))
+        self.assertFalse(SSOrder.objects.exists())
+
+
+class EventStreamTokenTests(OrderFixtures, TestCase):
+    def stream_user(self, **params):
+        return _sse_user(RequestFactory().get("/api/events/stream/", params))
+
+    def test_stream_token_opens_the_stream_only_briefly(self):
+        response = self.client_for(self.ss).post("/api/events/stream-token/")
+        self.assertEqual(response.data["expires_in"], 60)
+        token = response.data["stream_token"]
+        self.assertEqual(self.stream_user(stream_token=token), self.ss)
+
+        with mock.patch("django.core.signing.time.time", return_value=time.time() + 61):
+            self.assertIsNone(self.stream_user(stream_token=token))
+        self.assertIsNone(self.stream_user(stream_token=signing.dumps(self.ss.pk)))  # other purpose
+        self.assertEqual(APIClient().post("/api/events/stream-token/").status_code, 401)
+
+    def test_jwt_not_accepted_in_the_url(self):
+        jwt = str(AccessToken.for_user(self.ss))
+        self.assertIsNone(self.stream_user(token=jwt))
+        self.assertIsNone(self.stream_user(stream_token=jwt))
+        request = RequestFactory().get("/api/events/stream/", HTTP_AUTHORIZATION=f"Bearer {jwt}")
+        self.assertEqual(_sse_user(request), self.ss)
+
+
+class CRMOrderTestCase(OrderFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        Product.objects.bulk_create([
+            Product(product_id=pid, product_name=f"P{pid}", sub_category="Charger", live_stock=100, virtual_stock=100, price="10")
+            for pid in range(1, 81)
+        ])
+        self.client = self.client_for(self.crm)
+
+    def place(self, product_ids):
+        with self.captureOnCommitCallbacks(execute=True):  # snapshot reservations applied
+            order = SSOrder.objects.create(ss_user=self.ss, assigned_crm=self.crm)
+            for pid in product_ids:
+                SSOrderItem.objects.create(order=order, product_id=pid, quantity=5, price=10, ss_virtual_stock=7)
+        return order
+
+    def verify(self, order, items, status="APPROVED", location="DELHI"):
+        return self.client.post(f"/api/crm/orders/{order.id}/verify/", {
+            "status": status, "items": items, "dispatch_location": location,
+        }, format="json")
+
+
+class CRMOrderVerifyTests(CRMOrderTestCase):
+    def test_diff_of_ss_lines_and_payload(self):
+        order = self.place([1, 2, 3])
+        self.assertEqual(Product.objects.get(product_id=2).reserved_qty, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.verify(order, [{"product": 1, "quantity": 2}, {"product": 9, "quantity": 1}])
+        self.assertEqual(response.status_code, 201)
+        items = CRMVerifiedOrderItem.objects.filter(crm_order__original_order=order)
+        self.assertEqual(
+            sorted(items.values_list("product_id", "quantity", "ss_virtual_stock", "is_rejected")),
+            [(1, 2, 7, False), (2, 5, 7, True), (3, 5, 7, True), (9, 1, 100, False)],
+        )
+        # approved -> out of PENDING, the whole reservation released
+        self.assertEqual(SSOrder.objects.get(pk=order.pk).status, "APPROVED")
+        self.assertFalse(PendingOrderItemSnapshot.objects.exists())
+        self.assertEqual(sum(Product.objects.values_list("reserved_qty", flat=True)), 0)
+
+    def test_partial_verify_to_mumbai_leaves_nothing_reserved(self):
+        Product.objects.filter(product_id__in=[1, 2, 3]).update(mumbai_stock=40, mumbai_virtual_stock=40)
+        order = self.place([1, 2, 3])
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.verify(order, [{"product": 1, "quantity": 2}, {"product": 2, "quantity": 4}], location="MUMBAI")
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(PendingOrderItemSnapshot.objects.exists())
+        # no snapshot re-written just to be deleted by the status change
+        self.assertFalse([q for q in queries if q["sql"].startswith('INSERT INTO "orders_pendingorderitemsnapshot"')])
+        self.assertEqual(
+            list(Product.objects.filter(product_id__in=[1, 2, 3]).order_by("product_id").values_list(
+                "reserved_qty", "virtual_stock", "mumbai_reserved_qty", "mumbai_virtual_stock")),
+            [(0, 100, 0, 40)] * 3,
+        )
+
+    def test_unknown_status_rejected(self):
+        order = self.place([1])
+        self.assertEqual(self.verify(order, [{"product": 1, "quantity": 2}], status="PENDING").status_code, 400)
+        self.assertEqual(Product.objects.get(product_id=1).reserved_qty, 5)
+
+    def test_queries_do_not_grow_with_lines(self):
+        counts = []
+        for product_ids in (range(1, 11), range(11, 81)):
+            order = self.place(product_ids)
+            items = [{"product": pid, "quantity": 3} for pid in list(product_ids)[:-2]]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.verify(order, items).status_code, 201)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class CRMOrderBulkActionTests(CRMOrderTestCase):
+    def bulk(self, body):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post("/api/crm/orders/bulk-action/", body, format="json")
+
+    def test_bulk_verify_with_overrides(self):
+        orders = [self.place([1, 2]), self.place([2, 3]), self.place([4])]
+        response = self.bulk({"action": "verify", "dispatch_location": "DELHI", "orders": [
+            {"id": orders[0].id, "items": [{"product": 1, "quantity": 3}]},
+            {"id": orders[1].id, "status": "REJECTED"},
+            {"id": orders[2].id},
+            {"id": 999999},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["result"] for r in response.data["results"]], ["ok", "ok", "ok", "failed"])
+        items = CRMVerifiedOrderItem.objects.order_by("crm_order__original_order_id", "product_id")
+        self.assertEqual(list(items.values_list("crm_order__original_order_id", "product_id", "quantity", "is_rejected")), [
+            (orders[0].id, 1, 3, False), (orders[0].id, 2, 5, True),
+            (orders[1].id, 2, 5, True), (orders[1].id, 3, 5, True),
+            (orders[2].id, 4, 5, False),
+        ])
+        self.assertEqual(sorted(SSOrder.objects.values_list("status", flat=True)), ["APPROVED", "APPROVED", "REJECTED"])
+        self.assertFalse(PendingOrderItemSnapshot.objects.exists())
+        self.assertEqual(sum(Product.objects.values_list("reserved_qty", flat=True)), 0)
+
+        again = self.bulk({"action": "verify", "order_ids": [orders[2].id]})
+        self.assertEqual(again.data["results"][0]["error"], "Order already verified")
+
+    def test_bulk_hold_queries_do_not_grow_with_orders(self):
+        counts = []
+        for first in (1, 11):
+            orders = [self.place(range(pid, pid + 3)) for pid in range(first, first + (3 if first == 1 else 10))]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.bulk({"action": "hold", "notes": "stock check", "order_ids": [o.id for o in orders]})
+            self.assertEqual(response.data["ok"], len(orders))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(set(SSOrder.objects.values_list("status", "notes")), {("HOLD", "stock check")})
+        self.assertEqual(sum(Product.objects.values_list("reserved_qty", flat=True)), 0)
+
+
+class CRMOrderBulkDeleteTests(CRMOrderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.client_for(
+            CustomUser.objects.create_user(mobile="9000000001", role="ADMIN", password="p", name="admin")
+        )
+
+    def delete(self, order_ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.admin.post("/api/crm/orders/bulk-delete/", {"order_ids": order_ids}, format="json")
+
+    def test_admin_only(self):
+        order = self.place([1])
+        response = self.client.post("/api/crm/orders/bulk-delete/", {"order_ids": [order.id]}, format="json")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.delete([999999]).status_code, 404)
+
+    def test_set_based_delete_releases_stock(self):
+        counts = []
+        for first in (1, 11):
+            orders = [self.place(range(pid, pid + 3)) for pid in range(first, first + (3 if first == 1 else 10))]
+            with self.captureOnCommitCallbacks(execute=True):
+                self.verify(orders[0], [{"product": first, "quantity": 2}])  # approved: verified version, no snapshots
+            with CaptureQueriesContext(connection) as queries:
+                response = self.delete([o.id for o in orders])
+            self.assertEqual(response.data["message"], f"{len(orders)} orders permanently deleted")
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertFalse(SSOrder.objects.exists())
+        self.assertFalse(CRMVerifiedOrder.objects.exists())
+        self.assertFalse(PendingOrderItemSnapshot.objects.exists())
+        self.assertEqual(sum(Product.objects.values_list("reserved_qty", flat=True)), 0)
+
+
+class AutoHoldTests(CRMOrderTestCase):
+    def test_old_pending_orders_held_and_released(self):
+        old = [self.place([1, 2]), self.place([2, 3])]
+        new = self.place([3])
+        SSOrder.objects.filter(pk__in=[o.pk for o in old]).update(created_at=timezone.now() - timedelta(days=4))
+
+        with mock.patch("orders.tasks.publish_order_status") as publish, self.captureOnCommitCallbacks(execute=True):
+            stats = auto_hold_old_orders(days=3)
+
+        self.assertEqual({k: v for k, v in stats.items() if k != "seconds"}, {"orders": 2, "snapshots": 4, "products": 3})
+        self.assertEqual(
+            list(SSOrder.objects.order_by("id").values_list("status", "notes", "version")),
+            [("HOLD", "Auto HOLD after 3 days", 2)] * 2 + [("PENDING", None, 1)],
+        )
+        self.assertEqual(list(PendingOrderItemSnapshot.objects.values_list("order_id", flat=True)), [new.id])
+        self.assertEqual(dict(Product.objects.filter(product_id__in=[1, 2, 3]).values_list("product_id", "reserved_qty")),
+                         {1: 0, 2: 0, 3: 5})
+        (published,), _ = publish.call_args
+        self.assertEqual([(o["id"], o["status"]) for o in published], [(o.id, "HOLD") for o in old])
+
+        self.assertEqual(auto_hold_old_orders(days=3)["orders"], 0)
+
+
+class CRMVerifiedItemEditTests(CRMOrderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.order = self.place([1, 2, 3])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.verify(self.order, [{"product": 1, "quantity": 5}, {"product": 2, "quantity": 5}])
+        self.crm_order = CRMVerifiedOrder.objects.get(original_order=self.order)
+        self.items = dict(self.crm_order.items.values_list("product_id", "id"))  # 3: removed by the CRM
+
+    def lines(self):
+        return sorted(self.crm_order.items.values_list("product_id", "quantity", "is_rejected"))
+
+    def assertStockUntouched(self):
+        self.assertFalse(PendingOrderItemSnapshot.objects.exists())
+        self.assertEqual(set(Product.objects.filter(product_id__in=[1, 2, 3, 4]).values_list("reserved_qty", "virtual_stock")),
+                         {(0, 100)})
+
+    def edit(self, edits, **extra):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f"/api/crm/verified/{self.crm_order.id}/items/", {"edits": edits, **extra}, format="json")
+
+    def test_single_views_edit_lines_only(self):
+        self.assertStockUntouched()  # approved -> reservation released at verify
+        response = self.client.post(f"/api/crm/verified/item/{self.items[1]}/update/", {"quantity": 8}, format="json")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(f"/api/crm/verified/{self.crm_order.id}/add-item/", {"product_id": 4, "quantity": 2}, format="json")
+        self.assertEqual(response.status_code, 201)
+        response = self.client.delete(f"/api/crm/verified/item/{self.items[2]}/delete/")
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.lines(), [(1, 8, False), (3, 5, True), (4, 2, False)])
+        self.assertStockUntouched()
+
+        response = self.client.post(f"/api/crm/verified/{self.crm_order.id}/add-item/", {"product_id": 4, "quantity": 1}, format="json")
+        self.assertEqual(response.status_code, 400)  # already in the order
+        response = self.client.post(f"/api/crm/verified/{self.crm_order.id}/add-item/", {"product_id": 999, "quantity": 1}, format="json")
+        self.assertEqual(response.status_code, 404)
+
+    def test_batch_edit_is_one_transaction(self):
+        response = self.edit([
+            {"item": self.items[1], "quantity": 1},
+            {"item": self.items[2], "is_rejected": True},
+            {"item": self.items[3], "is_rejected": False},
+            {"product": 4, "quantity": 4},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["added"]), 1)
+        self.assertEqual(self.lines(), [(1, 1, False), (2, 5, True), (3, 5, False), (4, 4, False)])
+
+        response = self.edit([{"item": self.items[1], "quantity": 3}, {"item": 999999, "delete": True}])
+        self.assertEqual(response.status_code, 404)
+        response = self.edit([{"item": self.items[1], "quantity": 3}, {"product": 2, "quantity": 1}])
+        self.assertEqual(response.status_code, 400)  # duplicate line
+        self.assertEqual(self.lines()[0], (1, 1, False))  # nothing written
+        self.assertStockUntouched()
+
+
+class OrderVersionTests(CRMOrderTestCase):
+    def test_stale_hold_gets_409_with_current_state(self):
+        order = self.place([1, 2])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f"/api/crm/orders/{order.id}/hold/", {"notes": "wait", "version": 1}, format="json")
+        self.assertEqual((response.status_code, response.data["version"]), (200, 2))
+        self.assertEqual(Product.objects.get(product_id=1).reserved_qty, 0)
+
+        response = self.client.post(f"/api/crm/orders/{order.id}/reject/", {"notes": "stale", "version": 1}, format="json")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["current"], {"id": order.id, "status": "HOLD", "version": 2, "notes": "wait"})
+
+    def test_verify_claims_the_order_once(self):
+        order = self.place([1])
+        self.assertEqual(self.verify(order, [{"product": 1, "quantity": 5}]).status_code, 201)
+        response = self.verify(order, [{"product": 1, "quantity": 5}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["error"], "Order already verified")
+        self.assertEqual(CRMVerifiedOrder.objects.filter(original_order=order).count(), 1)
+
+    def test_status_update_checks_if_match(self):
+        order = self.place([1])
+        self.verify(order, [{"product": 1, "quantity": 5}], status="HOLD")
+        crm_order = CRMVerifiedOrder.objects.get(original_order=order)
+        url = f"/api/crm/verified/{crm_order.id}/status/"
+
+        response = self.client.patch(url, {"status": "REJECTED", "notes": "no"}, format="json", HTTP_IF_MATCH='"7"')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["current"]["status"], "HOLD")
+
+        with mock.patch("orders.views.publish_order_status") as publish:
+            response = self.client.patch(url, {"status": "APPROVED"}, format="json", HTTP_IF_MATCH='"1"')
+        self.assertEqual((response.status_code, response.data["version"]), (200, 2))
+        self.assertEqual(SSOrder.objects.values_list("status", "version").get(pk=order.pk), ("APPROVED", 3))
+        (published,), _ = publish.call_args
+        self.assertEqual([(o.pk, o.status) for o in published], [(order.pk, "APPROVED")])
+
+    def test_item_edits_check_and_bump_version(self):
+        order = self.place([1, 2])
+        self.verify(order, [{"product": 1, "quantity": 5}, {"product": 2, "quantity": 5}])
+        crm_order = CRMVerifiedOrder.objects.get(original_order=order)
+        items = dict(crm_order.items.values_list("product_id", "id"))
+
+        response = self.client.post(f"/api/crm/verified/item/{items[1]}/update/", {"quantity": 3, "version": 1}, format="json")
+        self.assertEqual((response.status_code, response.data["version"]), (200, 2))
+        response = self.client.post(f"/api/crm/verified/{crm_order.id}/add-item/", {"product_id": 3, "quantity": 1, "version": 1}, format="json")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["current"]["version"], 2)
+        response = self.client.delete(f"/api/crm/verified/item/{items[2]}/delete/", HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(f"/api/crm/verified/{crm_order.id}/items/", {"edits": [{"item": items[2], "delete": True}], "version": 2}, format="json")
+        self.assertEqual((response.status_code, response.data["version"]), (200, 3))
+        self.assertEqual(list(crm_order.items.values_list("product_id", "quantity")), [(1, 3)])
+
+        response = self.client.post(f"/api/crm/verified/{crm_order.id}/add-item/", {"product_id": 3, "quantity": 1}, format="json")
+        self.assertEqual((response.status_code, response.data["version"]), (201, 4))  # no version sent -> not checked
+
+    def test_bulk_entry_version_checked(self):
+        orders = [self.place([1]), self.place([2])]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/crm/orders/bulk-action/", {"action": "hold", "orders": [
+                {"id": orders[0].id, "version": 1}, {"id": orders[1].id, "version": 0},
+            ]}, format="json")
+        ok, stale = response.data["results"]
+        self.assertEqual(ok["result"], "ok")
+        self.assertEqual((stale["result"], stale["current"]), ("failed", {"id": orders[1].id, "status": "PENDING", "version": 1, "notes": None}))
+        self.assertEqual(list(SSOrder.objects.order_by("id").values_list("status", flat=True)), ["HOLD", "PENDING"])
+
+
+class KeysetPaginationTests(CRMOrderTestCase):
+    def ids(self, response):
+        return [row["id"] for row in response.data["results"]]
+
+    def test_walk_forward_and_back_with_ties(self):
+        orders = [SSOrder.objects.create(ss_user=self.ss, assigned_crm=self.crm) for _ in range(7)]
+        now = timezone.now()
+        for index, order in enumerate(orders):  # last 4 share one timestamp -> id breaks the tie
+            SSOrder.objects.filter(pk=order.pk).update(created_at=now - timedelta(minutes=min(index, 3)))
+        expected = [o.id for o in orders[:3]] + [o.id for o in reversed(orders[3:])]
+
+        url, pages = "/api/orders-by-role/?page_size=3", []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            sql = " ".join(q["sql"] for q in queries).upper()
+            self.assertNotIn("OFFSET", sql)
+            self.assertNotIn("COUNT(", sql)
+            pages.append(self.ids(response))
+            url = response.data["next"]
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+        back = self.client.get(response.data["previous"])
+        self.assertEqual(self.ids(back), pages[1])
+        first = self.client.get(back.data["previous"])
+        self.assertEqual(self.ids(first), pages[0])
+        self.assertIsNone(first.data["previous"])
+        self.assertEqual(self.client.get("/api/orders-by-role/?cursor=bad").status_code, 404)
+
+    def test_dispatch_null_packed_times_come_first(self):
+        now = timezone.now()
+        rows = [
+            DispatchOrder.objects.create(order_id=f"D{i}", product="P", quantity=1,
+                                         order_packed_time=None if i % 2 else now - timedelta(hours=i))
+            for i in range(5)
+        ]
+        seen, url = [], "/api/dispatch-orders/?page_size=2"
+        while url:
+            response = self.client.get(url)
+            seen += self.ids(response)
+            url = response.data["next"]
+        self.assertEqual(seen, [rows[3].id, rows[1].id, rows[0].id, rows[2].id, rows[4].id])
+
+
+class OrderSearchTests(CRMOrderTestCase):
+    def setUp(self):
+        super().setUp()
+        invalidate_search_indexes()
+        self.orders = {}
+        for mobile, party in (("9200000071", "Sharma Traders"), ("9200000072", "Ravi Sharma"), ("9200000073", "Mohan Electricals")):
+            ss = CustomUser.objects.create_user(mobile=mobile, role="SS", password="p", name=party, party_name=party, crm=self.crm)
+            self.orders[party] = SSOrder.objects.create(ss_user=ss, assigned_crm=self.crm)
+
+    def suggest(self, q):
+        response = self.client.get("/api/orders/search/", {"q": q})
+        return [(row["party_name"], row["rank"]) for row in response.data["results"]]
+
+    def test_exact_and_prefix_matches_rank_first(self):
+        self.assertEqual(self.suggest("sharma"), [("Sharma Traders", 1), ("Ravi Sharma", 2)])
+        order = self.orders["Mohan Electricals"]
+        self.assertEqual(self.suggest(order.order_id.lower()), [("Mohan Electricals", 0)])
+        self.assertEqual(self.suggest("tric"), [("Mohan Electricals", 3)])
+
+    def test_filters_follow_new_orders_and_renames(self):
+        self.assertEqual(search_party_ids(self.client, "sharma"), {self.orders["Sharma Traders"].id, self.orders["Ravi Sharma"].id})
+
+        late = SSOrder.objects.create(ss_user=self.orders["Mohan Electricals"].ss_user, assigned_crm=self.crm)
+        response = self.client.get("/api/orders-by-role/", {"order_id": late.order_id[4:]})
+        self.assertEqual([row["id"] for row in response.data["results"]], [late.id])
+
+        user = self.orders["Ravi Sharma"].ss_user
+        with self.captureOnCommitCallbacks(execute=True):
+            user.party_name = "Ravi Verma"
+            user.save(update_fields=["party_name"])
+        self.assertEqual(search_party_ids(self.client, "sharma"), {self.orders["Sharma Traders"].id})
+
+
+def search_party_ids(client, party):
+    return {row["id"] for row in client.get("/api/orders-by-role/", {"party_name": party}).data["results"]}
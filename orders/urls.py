@@ -1,12 +1,15 @@
 
 from django.urls import path
-from .views import SSOrderCreateView, CRMOrderListView, CRMOrderVerifyView,FinalOrderHistoryView, UpdateOrderStatusView, punch_order_to_sheet, CRMOrderBulkDeleteView, AddItemToCRMVerifiedOrderView, CRMVerifiedItemUpdateView, CRMVerifiedItemDeleteView, hold_order, reject_order, CombinedOrderTrackView, list_orders_by_role, submit_meet_form, submit_dealer_list,DeleteAllDispatchOrders, SimpleSSOrderCreateView,DispatchOrderListView, UploadDispatchExcel, DownloadDispatchExcel, DeleteSelectedDispatchOrders, FinalOrderDetailsView, download_orders_report
+from .views import SSOrderCreateView, SSOrderBatchCreateView, OrderTicketView, CRMOrderListView, CRMOrderVerifyView,FinalOrderHistoryView, UpdateOrderStatusView, punch_order_to_sheet, CRMOrderBulkDeleteView, CRMOrderBulkActionView, AddItemToCRMVerifiedOrderView, CRMVerifiedItemBatchEditView, CRMVerifiedItemUpdateView, CRMVerifiedItemDeleteView, hold_order, reject_order, CombinedOrderTrackView, list_orders_by_role, search_orders, submit_meet_form, submit_dealer_list,DeleteAllDispatchOrders, SimpleSSOrderCreateView,DispatchOrderListView, UploadDispatchExcel, DownloadDispatchExcel, DeleteSelectedDispatchOrders, FinalOrderDetailsView, download_orders_report, event_stream_token, order_event_stream
 
 
 urlpatterns = [
     path("ss-orders/create/", SSOrderCreateView.as_view(), name="ss-order-create"),
+    path("ss-orders/batch/", SSOrderBatchCreateView.as_view(), name="ss-order-batch-create"),
+    path("order-tickets/<uuid:ticket_id>/", OrderTicketView.as_view(), name="order-ticket"),
     path('crm/orders/<int:order_id>/hold/', hold_order),
     path('crm/orders/<int:order_id>/reject/', reject_order),
+    path("crm/orders/bulk-action/", CRMOrderBulkActionView.as_view(), name="crm-order-bulk-action"),
     path("crm/orders/bulk-delete/", CRMOrderBulkDeleteView.as_view(), name="crm-order-bulk-delete"),
     path("crm/orders/", CRMOrderListView.as_view(), name="crm-orders-list"),
     path("crm/orders/<int:order_id>/verify/", CRMOrderVerifyView.as_view(), name="crm-order-verify"),
@@ -16,11 +19,13 @@ urlpatterns = [
 
     path("crm/verified/<int:pk>/status/", UpdateOrderStatusView.as_view(), name="crm-verified-status"),
     path("crm/verified/<int:pk>/add-item/", AddItemToCRMVerifiedOrderView.as_view(), name="add-item-crm-verified"),
+    path("crm/verified/<int:pk>/items/", CRMVerifiedItemBatchEditView.as_view(), name="crm-verified-items-edit"),
     path("crm/verified/item/<int:pk>/update/", CRMVerifiedItemUpdateView.as_view(), name="crm-verified-item-update"),
     path("crm/verified/item/<int:pk>/delete/", CRMVerifiedItemDeleteView.as_view(), name="crm-verified-item-delete"),
     path('punch-to-sheet/', punch_order_to_sheet, name='punch-to-sheet'),
     path("track-order/<str:order_id>/", CombinedOrderTrackView.as_view()),
     path('orders-by-role/',list_orders_by_role, name='orders-by-role'),
+    path('orders/search/', search_orders, name='orders-search'),
 
     # Dispatch URLS========================================================
     
@@ -32,6 +37,10 @@ urlpatterns = [
 
     path("download-orders-report/",download_orders_report,  name="download-orders-report"),
 
+    # Live events (SSE, ASGI only) ==========================================
+    path("events/stream/", order_event_stream, name="order-event-stream"),
+    path("events/stream-token/", event_stream_token, name="order-event-stream-token"),
+
 
     path("ss-orders/simple-create/", SimpleSSOrderCreateView.as_view()),
     path("submit-meet-form/", submit_meet_form, name="submit_meet_form"),
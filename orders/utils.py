@@ -1,25 +1,27 @@
 import os
 import requests
 
-def send_whatsapp_template(to_number, template_name, template_language, parameters=[]):
+WHATSAPP_TIMEOUT = (3.05, 10)  # (connect, read) seconds -> a hung Meta API can't block forever
+
+
+class WhatsAppConfigError(Exception):
+    pass
+
+
+def post_whatsapp_template(to_number, template_name, template_language, parameters=(), session=None, timeout=WHATSAPP_TIMEOUT):
     """
-    WhatsApp template message भेजने के लिए
-    :param to_number: receiver number (without +91)
-    :param template_name: Meta console में बनाया गया template का नाम
-    :param template_language: template language code, जैसे 'en_US'
-    :param parameters: template में dynamic variables की list
-                       example: ["Party Name", "Order ID", "₹1000"]
+    Meta Cloud API call for one template message, returns the requests Response.
+    session -> pooled keep-alive connections (outbox dispatcher)
     """
     token = os.getenv("META_WHATSAPP_TOKEN")
     phone_number_id = os.getenv("META_PHONE_NUMBER_ID")
     version = os.getenv("META_WHATSAPP_VERSION", "v20.0")
-    
+    base_url = os.getenv("META_WHATSAPP_API_URL", "https://graph.facebook.com")
 
     if not (token and phone_number_id):
-        print("❌ Meta WhatsApp credentials missing in environment variables")
-        return False
+        raise WhatsAppConfigError("Meta WhatsApp credentials missing in environment variables")
 
-    url = f"https://graph.facebook.com/{version}/{phone_number_id}/messages"
+    url = f"{base_url.rstrip('/')}/{version}/{phone_number_id}/messages"
 
     # template parameters
     components = []
@@ -45,14 +47,29 @@ def send_whatsapp_template(to_number, template_name, template_language, paramete
         "Content-Type": "application/json"
     }
 
+    return (session or requests).post(url, headers=headers, json=payload, timeout=timeout)
+
+
+def send_whatsapp_template(to_number, template_name, template_language, parameters=[]):
+    """
+    WhatsApp template message भेजने के लिए (blocking; orders use the outbox -> orders.notifications)
+    :param to_number: receiver number (without +91)
+    :param template_name: Meta console में बनाया गया template का नाम
+    :param template_language: template language code, जैसे 'en_US'
+    :param parameters: template में dynamic variables की list
+                       example: ["Party Name", "Order ID", "₹1000"]
+    """
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = post_whatsapp_template(to_number, template_name, template_language, parameters)
         if response.status_code in [200, 201]:
             print(f"✅ WhatsApp template sent to {to_number}")
             return True
         else:
             print(f"❌ Failed to send WhatsApp template: {response.status_code}, {response.text}")
             return False
+    except WhatsAppConfigError as e:
+        print(f"❌ {e}")
+        return False
     except Exception as e:
         print(f"❌ Exception while sending WhatsApp template: {e}")
         return False
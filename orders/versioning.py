@@ -0,0 +1,70 @@
+# orders/versioning.py
+# Optimistic concurrency for SSOrder / CRMVerifiedOrder: a status write is one
+# conditional UPDATE ... WHERE version = <version the client saw>; losing the
+# race -> 409 with the row as it is now. No row lock is held while a CRM
+# spends minutes reviewing an order.
+from django.db.models import F
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class VersionConflict(Exception):
+    """Row changed (or condition no longer true) since `expected` was read; current: fresh row or None."""
+
+    def __init__(self, current):
+        super().__init__("Order was changed by someone else, reload and retry.")
+        self.current = current
+
+
+def parse_version(raw):
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return -1  # can't match -> conflict with the current state
+
+
+def expected_version(request, instance=None):
+    """
+    Version the client last saw: body "version" or If-Match header, else the
+    one just read (instance; None without one -> versioned_update uses the loaded row's).
+    """
+    raw = request.data.get("version") if hasattr(request.data, "get") else None
+    if raw is None:
+        raw = request.headers.get("If-Match", "").replace("W/", "").strip('" ') or None
+    if raw is None:
+        return instance.version if instance is not None else None
+    return parse_version(raw)
+
+
+def versioned_update(instance, fields, expected=None, *conditions):
+    """
+    UPDATE `fields` (as set on instance) + version = version + 1
+    WHERE pk AND version = expected (default: as loaded) [AND conditions].
+    Miss -> VersionConflict. Hit -> instance.version bumped.
+    A queryset UPDATE sends no post_save: callers release snapshots and publish
+    status events themselves (as the bulk actions do).
+    """
+    model = type(instance)
+    expected = instance.version if expected is None else expected
+    updated = model.objects.filter(*conditions, pk=instance.pk, version=expected).update(
+        version=F("version") + 1, **{field: getattr(instance, field) for field in fields}
+    )
+    if not updated:
+        raise VersionConflict(model.objects.filter(pk=instance.pk).first())
+    instance.version = expected + 1
+
+
+def current_state(instance):
+    if instance is None:
+        return None
+    state = {"id": instance.pk, "status": instance.status, "version": instance.version}
+    if hasattr(instance, "notes"):
+        state["notes"] = instance.notes
+    return state
+
+
+def conflict_response(conflict, error=None):
+    return Response(
+        {"error": error or str(conflict), "current": current_state(conflict.current)},
+        status=status.HTTP_409_CONFLICT,
+    )
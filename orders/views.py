@@ -1,32 +1,50 @@
 from rest_framework.views import APIView
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.generics import RetrieveAPIView
 from rest_framework import status
 from rest_framework import status as drf_status
 from django.db import transaction
-from django.db.models import Q
-from .models import SSOrder, SSOrderItem,CRMVerifiedOrderItem, CRMVerifiedOrder, Product, DispatchOrder
+from django.db.models import Exists, OuterRef, Q
+from .models import SSOrder, SSOrderItem,CRMVerifiedOrderItem, CRMVerifiedOrder, Product, DispatchOrder, OrderIntakeTicket
 from django.contrib.auth import get_user_model
-from .serializers import SSOrderSerializer,SS_to_CRM_Orders, CRMVerifiedOrderSerializer, VerifiedOrderHistorysSerializer , VerifiedOrderDetailsSerializer, CombinedOrderTrackSerializer, SSOrderSerializerTrack, DispatchOrderSerializer
+from .serializers import SSOrderSerializer,SS_to_CRM_Orders, CRMVerifiedOrderSerializer, CRMVerifiedOrderItemSerializer, VerifiedOrderHistorysSerializer , VerifiedOrderDetailsSerializer, CombinedOrderTrackSerializer, SSOrderSerializerTrack, DispatchOrderSerializer
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.generics import ListAPIView
 from django.shortcuts import get_object_or_404
-from .utils import send_whatsapp_template
+from .idempotency import idempotent
+from .intake import enqueue_order, ticket_data, wants_queue
+from .crm_actions import VERIFY_STATUSES, BulkActionError, ItemEditError, apply_bulk_action, edit_verified_items
+from .tasks import delete_orders
+from .pagination import DispatchKeysetPagination, KeysetPagination, VerifiedKeysetPagination
+from .search import SUGGESTION_LIMIT, order_id_q, party_q, suggest_orders
+from .versioning import VersionConflict, conflict_response, expected_version, versioned_update
+from .placement import StockShortage, cart_product_ids, is_strict, keyed_orders, place_ss_order, place_ss_batch
 from django.db import transaction
 from orders.models import PendingOrderItemSnapshot
-from products.utils import recalculate_virtual_stock
 from django.conf import settings
-from products.utils import write_to_sheet
+from products.utils import write_to_sheet, locked_reservation, normalize_location
 import openpyxl
 from django.utils import timezone
-from rest_framework.parsers import MultiPartParser
+from rest_framework.parsers import MultiPartParser, JSONParser, BaseParser
 from rest_framework import status
 from .models import DispatchOrder
 from django.http import HttpResponse
 from rest_framework.views import APIView
 from datetime import datetime
+from collections import defaultdict
+import asyncio
+import json
 import logging
+from asgiref.sync import sync_to_async
+from django.core import signing
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from .events import broker, audience_for, publish_order_status
 
 
 
@@ -36,115 +54,42 @@ User = get_user_model()
 # Order Create----------
 
 class SSOrderCreateView(APIView):
+    @idempotent
     def post(self, request):
         data = request.data
 
+        # ✅ peak load: validate + queue, 202 with a ticket (orders.intake)
+        if wants_queue(request):
+            return enqueue_order(request, "SS", data)
+
         try:
             ss_user = User.objects.get(id=data['user_id'])
             crm_user = User.objects.get(id=data['crm_id'])
             total = data['total']
-            items = data['items']
-            scheme_items = data.get('eligibleSchemes', [])
-
-            # ✅ Items को Tempered और Non-Tempered में बाँटें
-            tempered_items = []
-            non_tempered_items = []
-
-            for item in items:
-                product = Product.objects.get(product_id=item['id'])
-                sub_category = getattr(product, "sub_category", "") or ""
-                if "tempered" in sub_category.lower():
-                    tempered_items.append(item)
-                else:
-                    non_tempered_items.append(item)
 
-            # ✅ Helper function: order create + items insert
-            def create_order(order_items, label="Normal"):
-                if not order_items:
-                    return None
-
-                total_amt = sum(
-                    (i['price'] or 0) * i['quantity'] for i in order_items
-                )
+            # ✅ पूरा cart (items + scheme items) एक ही query में
+            products = Product.objects.in_bulk(cart_product_ids([data]))
 
-                order = SSOrder.objects.create(
-                    ss_user=ss_user,
-                    assigned_crm=crm_user,
-                    total_amount=total_amt,
-                    note=f"{label} Order"  # optional tag for clarity
+            try:
+                orders, shortages = place_ss_order(data, ss_user, crm_user, products)
+            except StockShortage as e:
+                return Response(
+                    {"error": str(e), "shortages": e.shortages},
+                    status=status.HTTP_409_CONFLICT,
                 )
 
-                for item in order_items:
-                    product = Product.objects.get(product_id=item['id'])
-                    SSOrderItem.objects.create(
-                        order=order,
-                        product=product,
-                        quantity=item['quantity'],
-                        price=item['price'] or 0,
-                        is_scheme_item=False,
-                        ss_virtual_stock=item.get('ss_virtual_stock', getattr(product, 'stock_quantity', 0))
-                    )
-
-                return order
-
-            # ✅ Create two orders
-            tempered_order = create_order(tempered_items, label="Tempered")
-            normal_order = create_order(non_tempered_items, label="Accessories")
-
-            # ✅ Scheme items — सिर्फ Non-Tempered order में add करो
-            if normal_order and scheme_items:
-                for reward in scheme_items:
-                    product_id = (
-                        reward.get('product_id') or
-                        (reward.get('product', {}).get('id') if isinstance(reward.get('product'), dict) else reward.get('product'))
-                    )
-                    if not product_id:
-                        continue
-
-                    try:
-                        product = Product.objects.get(product_id=product_id)
-                        SSOrderItem.objects.create(
-                            order=normal_order,
-                            product=product,
-                            quantity=reward.get('quantity', 0),
-                            price=0,
-                            is_scheme_item=True,
-                            ss_virtual_stock=getattr(product, 'virtual_stock', getattr(product, 'stock_quantity', 0))
-                        )
-                    except Product.DoesNotExist:
-                        continue
-
-            # ✅ WhatsApp send (अब दोनों orders के लिए)
-            crm_numbers = {
-                2: "7678491163",
-                4: "9312093178",
-                7: "8595957195",
-                8: "9266877089",
-                9: "9266767418",
-                133: "9306443566",
-            }
-            crm_number = crm_numbers.get(crm_user.id)
-            if crm_number:
-                template_name = "order_updation"
-                template_language = "EN"
-
-                for each_order in [tempered_order, normal_order]:
-                    if each_order:
-                        parameters = [
-                            ss_user.party_name or ss_user.name,
-                            str(each_order.order_id),
-                            str(each_order.total_amount)
-                        ]
-                        send_whatsapp_template(crm_number, template_name, template_language, parameters)
-
+            # ✅ Response data: items / products / history prefetched for all orders at once
+            placed = (
+                SSOrder.objects.select_related("ss_user", "assigned_crm")
+                .prefetch_related("items__product", "crm_verified_versions")
+                .in_bulk([o.id for o in orders.values()])
+            )
 
             # ✅ Response
             return Response({
                 "message": "Orders placed successfully.",
-                "orders": {
-                    "tempered_order": SSOrderSerializer(tempered_order).data if tempered_order else None,
-                    "normal_order": SSOrderSerializer(normal_order).data if normal_order else None,
-                }
+                "orders": keyed_orders(orders, lambda order: SSOrderSerializer(placed[order.id]).data),
+                "shortages": shortages,
             }, status=status.HTTP_201_CREATED)
 
         except Exception as e:
@@ -153,6 +98,79 @@ class SSOrderCreateView(APIView):
             traceback.print_exc()
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+class NDJSONParser(BaseParser):
+    """application/x-ndjson: one order per line, read lazily from the request stream."""
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        def rows():
+            for line in stream or ():
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield ValueError(f"Invalid JSON line: {e}")
+        return rows()
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for entry in iterable:
+        chunk.append(entry)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class SSOrderBatchCreateView(APIView):
+    """
+    Offline carts uploaded together: JSON array (or {"orders": [...]}) or NDJSON,
+    every entry in the SSOrderCreateView payload shape.
+    - CHUNK_SIZE orders per transaction; users + products fetched once per chunk
+    - savepoint per order: a failing order is reported, the rest of the batch goes on
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser]
+    CHUNK_SIZE = 25
+
+    def post(self, request):
+        payloads = request.data
+        if isinstance(payloads, dict):
+            payloads = payloads.get("orders", [])
+        if isinstance(payloads, (str, bytes)) or not hasattr(payloads, "__iter__"):
+            return Response({"error": "Expected a list of orders"}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = []
+        for chunk in _chunks(enumerate(payloads), self.CHUNK_SIZE):
+            results.extend(place_ss_batch(chunk))
+
+        counts = defaultdict(int)
+        for result in results:
+            counts[result["status"]] += 1
+        return Response({
+            "created": counts["created"],
+            "rejected": counts["rejected"],
+            "failed": counts["failed"],
+            "results": results,
+        }, status=status.HTTP_200_OK)
+
+
+class OrderTicketView(APIView):
+    """Queued order (202 ticket) -> status + result; only the sender (or staff) can read it."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, ticket_id):
+        tickets = OrderIntakeTicket.objects.all()
+        if not (request.user.is_staff or request.user.role == "ADMIN"):
+            tickets = tickets.filter(requested_by=request.user)
+        ticket = get_object_or_404(tickets, id=ticket_id)
+        return Response(ticket_data(ticket))
+
+
 class SimpleSSOrderCreateView(APIView):
     """
     Only creates empty order
@@ -205,6 +223,7 @@ class SimpleSSOrderCreateView(APIView):
 class CRMOrderListView(ListAPIView):
     serializer_class = SS_to_CRM_Orders
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination  # ?cursor= / ?page_size= instead of a fixed 20 / 25
 
     def get_queryset(self):
         user = self.request.user
@@ -221,19 +240,19 @@ class CRMOrderListView(ListAPIView):
             .prefetch_related(
                 "items__product"
             )
-            .order_by("-created_at")
         )
 
         # 🔹 Admin → all orders
         if user.is_staff or user.is_superuser:
-            return base_queryset[:20]
+            return base_queryset
 
         # 🔹 CRM → only assigned orders
-        return base_queryset.filter(assigned_crm=user)[:25]
+        return base_queryset.filter(assigned_crm=user)
 
 class CRMOrderVerifyView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request, order_id):
         try:
             crm_user = request.user
@@ -242,14 +261,54 @@ class CRMOrderVerifyView(APIView):
             original_order = get_object_or_404(
                 SSOrder, id=order_id, assigned_crm=crm_user
             )
-
-            # Prevent duplicate verification
-            if CRMVerifiedOrder.objects.filter(original_order=original_order).exists():
+            expected = expected_version(request, original_order)
+            if data.get("status") not in VERIFY_STATUSES:
                 return Response(
-                    {"error": "Order already verified"}, status=status.HTTP_400_BAD_REQUEST
+                    {"error": f"status must be one of {', '.join(sorted(VERIFY_STATUSES))}"},
+                    status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            with transaction.atomic():
+            # ✅ Approved qty per product -> locked reservation at dispatch warehouse
+            lines = defaultdict(int)
+            if data["status"] != "REJECTED":
+                for item in data.get("items", []):
+                    try:
+                        lines[int(item["product"])] += int(item.get("quantity", 0))
+                    except (TypeError, ValueError):
+                        continue
+            location = normalize_location(data.get("dispatch_location"))
+
+            with locked_reservation(lines, location, order=original_order) as shortages:
+                if shortages and is_strict(data):
+                    return Response(
+                        {"error": "Insufficient stock", "shortages": shortages},
+                        status=status.HTTP_409_CONFLICT,
+                    )
+
+                # ✅ claim: one conditional UPDATE (version seen + not verified yet) instead of
+                # an exists() pre-check -> a parallel / repeated verify gets 409
+                versioned_update(
+                    original_order, [], expected,
+                    ~Exists(CRMVerifiedOrder.objects.filter(original_order=OuterRef("pk"))),
+                )
+
+                # ✅ SS lines + payload products in 2 queries, diffed in memory
+                ss_lines = list(
+                    SSOrderItem.objects.filter(order=original_order).order_by("id")
+                    .values("product_id", "quantity", "ss_virtual_stock")
+                )
+                ss_map = {line["product_id"]: line for line in ss_lines}
+                first_line = {}
+                for line in ss_lines:
+                    first_line.setdefault(line["product_id"], line)
+
+                rejected_all = data["status"] == "REJECTED"
+                payload_items = [] if rejected_all else data.get("items", [])
+                payload_pids = [int(item["product"]) for item in payload_items]
+                products = Product.objects.only("product_id", "virtual_stock").in_bulk(set(payload_pids))
+                if len(products) != len(set(payload_pids)):
+                    raise Product.DoesNotExist
+
                 # Create CRM verification record
                 crm_order = CRMVerifiedOrder.objects.create(
                     original_order=original_order,
@@ -258,118 +317,67 @@ class CRMOrderVerifyView(APIView):
                     dispatch_location=data.get("dispatch_location"),
                 )
 
-                # Original SS items map
-                ss_items = SSOrderItem.objects.filter(order=original_order).select_related("product")
-                ss_map = {
-                    i.product.product_id: {
-                        "product_obj": i.product,
-                        "quantity": i.quantity,
-                        "ss_virtual_stock": i.ss_virtual_stock,
-                    }
-                    for i in ss_items
-                }
-
-                # If whole order rejected -> mark items rejected
-                if data["status"] == "REJECTED":
-                    for pid, info in ss_map.items():
-                        CRMVerifiedOrderItem.objects.create(
-                            crm_order=crm_order,
-                            product=info["product_obj"],
-                            quantity=info["quantity"],
-                            ss_virtual_stock=info.get("ss_virtual_stock", 0),
-                            is_rejected=True,
-                        )
-
-                    # delete snapshots (no reservation anymore)
-                    pending_snapshots = PendingOrderItemSnapshot.objects.filter(order=original_order)
-                    affected_products = [snap.product for snap in pending_snapshots]
-                    pending_snapshots.delete()
-
-                    for p in set(affected_products):
-                        recalculate_virtual_stock(p)
-
+                verified_items = []
+                if rejected_all:
+                    # If whole order rejected -> mark items rejected
+                    removed = list(ss_map)
                 else:
                     # Partial / Full approval
-                    payload_items = data.get("items", [])
-                    kept_products = set()
                     approved_map = {}
-                    affected_products = set()
-
-                    for item in payload_items:
-                        product = Product.objects.get(product_id=item["product"])
+                    for item, pid in zip(payload_items, payload_pids):
                         try:
                             qty = int(item.get("quantity", 0))
                         except (TypeError, ValueError):
                             qty = 0
-
-                        kept_products.add(product.product_id)
-                        approved_map[product.product_id] = qty
-
-                        ss_item = SSOrderItem.objects.filter(order=original_order, product=product).first()
-
-                       
+                        approved_map[pid] = qty
 
                         # ✅ अगर SSOrderItem नहीं मिला, तो product.virtual_stock का इस्तेमाल करो
-                        if ss_item:
-                            ss_virtual_stock_value = ss_item.ss_virtual_stock
-                        else:
-                            ss_virtual_stock_value = product.virtual_stock or 0
-
-                        CRMVerifiedOrderItem.objects.create(
+                        line = first_line.get(pid)
+                        verified_items.append(CRMVerifiedOrderItem(
                             crm_order=crm_order,
-                            product=product,
+                            product_id=pid,
                             quantity=qty,
-                           
-                            ss_virtual_stock=ss_virtual_stock_value,
+                            ss_virtual_stock=line["ss_virtual_stock"] if line else (products[pid].virtual_stock or 0),
                             is_rejected=False,
-                        )
-
+                        ))
 
                     # Products removed by CRM are considered rejected
-                    deleted_products = set(ss_map.keys()) - kept_products
-                    for pid in deleted_products:
-                        info = ss_map[pid]
-                        CRMVerifiedOrderItem.objects.create(
-                            crm_order=crm_order,
-                            product=info["product_obj"],
-                            quantity=info["quantity"],
-                            ss_virtual_stock=info.get("ss_virtual_stock", 0),
-                            is_rejected=True,
-                        )
-
-                    # Update PendingOrderItemSnapshot
-                    for pid, approved_qty in approved_map.items():
-                        prod_obj = ss_map.get(pid, {}).get("product_obj")
-                        if not prod_obj:
-                            prod_obj = Product.objects.get(product_id=pid)
-                        PendingOrderItemSnapshot.objects.update_or_create(
-                            order=original_order,
-                            product=prod_obj,
-                            defaults={"quantity": approved_qty},
-                        )
-                        affected_products.add(prod_obj)
-
-                    for pid in deleted_products:
-                        info = ss_map[pid]
-                        PendingOrderItemSnapshot.objects.filter(order=original_order, product=info["product_obj"]).delete()
-                        affected_products.add(info["product_obj"])
-
-                    # Recalculate virtual stock for all affected products
-                    for p in set(affected_products):
-                        recalculate_virtual_stock(p)
-
-                # Update order status
+                    removed = [pid for pid in ss_map if pid not in approved_map]
+
+                verified_items.extend(
+                    CRMVerifiedOrderItem(
+                        crm_order=crm_order,
+                        product_id=pid,
+                        quantity=ss_map[pid]["quantity"],
+                        ss_virtual_stock=ss_map[pid]["ss_virtual_stock"],
+                        is_rejected=True,
+                    )
+                    for pid in removed
+                )
+                CRMVerifiedOrderItem.objects.bulk_create(verified_items)
+
+                # Update order status -> out of PENDING: its whole reservation released by
+                # signals.remove_snapshot_on_status_change (no snapshot writes here)
                 original_order.status = data["status"]
                 original_order.save(update_fields=["status"])
 
+            # ✅ Response: items + products in one prefetch (no query per line)
+            crm_order = (
+                CRMVerifiedOrder.objects.select_related("crm_user", "original_order")
+                .prefetch_related("items__product").get(pk=crm_order.pk)
+            )
             return Response(
                 {
                     "message": "Order verified successfully",
                     "crm_order": CRMVerifiedOrderSerializer(crm_order).data,
+                    "shortages": shortages,
                 },
                 status=status.HTTP_201_CREATED,
             )
 
+        except VersionConflict as e:
+            verified = e.current is not None and e.current.crm_verified_versions.exists()
+            return conflict_response(e, "Order already verified" if verified else None)
         except Product.DoesNotExist:
             return Response({"error": "Product not found"}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
@@ -383,6 +391,7 @@ class CRMOrderVerifyView(APIView):
 class FinalOrderHistoryView(ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = VerifiedOrderHistorysSerializer
+    pagination_class = VerifiedKeysetPagination
 
     def get_queryset(self):
         user = self.request.user
@@ -404,18 +413,16 @@ class FinalOrderHistoryView(ListAPIView):
         from_date = self.request.query_params.get("from_date")
         to_date = self.request.query_params.get("to_date")
 
-        # ✅ Search (order id / order code)
+        # ✅ Search (order id / order code) — trigram index (orders.search), exact CRM id
         if q:
-            qs = qs.filter(
-                Q(id__icontains=q) |
-                Q(original_order__order_id__icontains=q)
-            )
+            match = order_id_q(q, "original_order__")
+            if q.isdigit():
+                match |= Q(id=int(q))
+            qs = qs.filter(match)
 
         # ✅ Party filter
         if party:
-            qs = qs.filter(
-                original_order__ss_user__party_name__icontains=party
-            )
+            qs = qs.filter(party_q(party, "original_order__ss_user"))
 
         # ✅ Date filter
         if from_date and to_date:
@@ -427,8 +434,8 @@ class FinalOrderHistoryView(ListAPIView):
         if punched is not None:
             qs = qs.filter(punched=(punched.lower() == "true"))
 
-        # ✅ Always latest first
-        return qs.order_by("-verified_at")[:50]  # max 50 records
+        # ✅ Always latest first — keyset pages of (verified_at, id), no 50-row cap
+        return qs
 
 class FinalOrderDetailsView(RetrieveAPIView):
     permission_classes = [IsAuthenticated]
@@ -453,8 +460,6 @@ class AddItemToCRMVerifiedOrderView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, pk):
-        crm_order = get_object_or_404(CRMVerifiedOrder, pk=pk)
-
         product_id = request.data.get("product_id")
         raw_qty = request.data.get("quantity")
 
@@ -464,45 +469,53 @@ class AddItemToCRMVerifiedOrderView(APIView):
                 status=400
             )
 
-        # ✅ SAFE quantity
         try:
-            quantity = int(raw_qty)
-        except (TypeError, ValueError):
-            return Response({"error": "Invalid quantity."}, status=400)
-
-
-        product = get_object_or_404(Product, product_id=product_id)
-
-        # ✅ Prevent duplicate product
-        if CRMVerifiedOrderItem.objects.filter(
-            crm_order=crm_order, product=product
-        ).exists():
-            return Response(
-                {"error": "This product is already added in this order."},
-                status=400
+            added, version = edit_verified_items(
+                pk, [{"product": product_id, "quantity": raw_qty}], expected_version(request)
             )
+        except ItemEditError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        except VersionConflict as e:
+            return conflict_response(e)
 
-        # ✅ Stock logic
-        ss_stock = getattr(product, "ss_virtual_stock", 0)
-        virtual_stock = getattr(product, "virtual_stock", 0)
-
-        new_item = CRMVerifiedOrderItem.objects.create(
-            crm_order=crm_order,
-            product=product,
-            quantity=quantity,
-            ss_virtual_stock=ss_stock if ss_stock > 0 else virtual_stock
-        )
-
+        new_item = added[0]
         return Response(
             {
                 "message": "Product added successfully!",
                 "item_id": new_item.id,
-                "product_name": product.product_name,
-                "quantity": quantity,
+                "product_name": new_item.product.product_name,
+                "quantity": new_item.quantity,
+                "version": version,
             },
             status=201
         )
 
+
+class CRMVerifiedItemBatchEditView(APIView):
+    """
+    Many line edits of one verified order in one request / transaction:
+    {"edits": [{"product", "quantity"} | {"item", "quantity"?, "is_rejected"?} | {"item", "delete": true}],
+    "version"?} (or If-Match) -> 409 if the order changed since
+    """
+    permission_classes = [IsAuthenticated]
+
+    @idempotent
+    def post(self, request, pk):
+        try:
+            added, version = edit_verified_items(pk, request.data.get("edits"), expected_version(request))
+        except ItemEditError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        except VersionConflict as e:
+            return conflict_response(e)
+
+        items = CRMVerifiedOrderItem.objects.filter(crm_order_id=pk).select_related("product").order_by("id")
+        return Response({
+            "message": "Items updated successfully",
+            "added": [item.id for item in added],
+            "items": CRMVerifiedOrderItemSerializer(items, many=True).data,
+            "version": version,
+        }, status=status.HTTP_200_OK)
+
 @api_view(['POST'])
 def punch_order_to_sheet(request):
     try:
@@ -578,6 +591,31 @@ def punch_order_to_sheet(request):
 
 
 
+class CRMOrderBulkActionView(APIView):
+    """
+    Verify / hold / reject many orders of the CRM's queue at once
+    (orders.crm_actions): {"action", "orders": [{"id", "items"?, ...}] | "order_ids"}.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @idempotent
+    def post(self, request):
+        try:
+            results = apply_bulk_action(request.user, request.data)
+        except BulkActionError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        counts = defaultdict(int)
+        for result in results:
+            counts[result["result"]] += 1
+        return Response({
+            "ok": counts["ok"],
+            "rejected": counts["rejected"],
+            "failed": counts["failed"],
+            "results": results,
+        }, status=status.HTTP_200_OK)
+
+
 # Others Views ---------------------
 
 class CRMOrderBulkDeleteView(APIView):
@@ -600,30 +638,17 @@ class CRMOrderBulkDeleteView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # ✅ ADMIN can delete ANY order
-        orders = SSOrder.objects.filter(id__in=order_ids)
+        # ✅ ADMIN can delete ANY order — one set-based pass, stock recalculated once
+        stats = delete_orders(order_ids)
 
-        if not orders.exists():
+        if not stats["orders"]:
             return Response(
                 {"error": "No valid orders found"},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        affected_products = []
-
-        with transaction.atomic():
-            for order in orders:
-                snapshots = PendingOrderItemSnapshot.objects.filter(order=order)
-                affected_products.extend([s.product for s in snapshots])
-                snapshots.delete()
-                order.delete()
-
-            # ✅ Recalculate stock once per product
-            for product in set(affected_products):
-                recalculate_virtual_stock(product)
-
         return Response(
-            {"message": f"{orders.count()} orders permanently deleted"},
+            {"message": f"{stats['orders']} orders permanently deleted"},
             status=status.HTTP_200_OK
         )
 
@@ -632,30 +657,29 @@ def hold_order(request, order_id):
     try:
         crm_user = request.user
         order = get_object_or_404(SSOrder, id=order_id, assigned_crm=crm_user)
+        expected = expected_version(request, order)
 
         # वो snapshots लो जो पहले order verify/forward होने पर बने थे
         pending_snapshots = PendingOrderItemSnapshot.objects.filter(order=order)
-        affected_products = [snap.product for snap in pending_snapshots]
 
         with transaction.atomic():
 
-            # ✅ पहले snapshots delete — ये stock restore का trigger है
+            # ✅ पहले snapshots delete — ये stock restore का trigger है (reserved_qty signal से घटेगा)
             pending_snapshots.delete()
 
-            # ✅ हर product का virtual stock दोबारा calculate
-            for p in set(affected_products):
-                recalculate_virtual_stock(p)
-
-            # ✅ Order status update
+            # ✅ Order status update — conditional on the version the CRM saw
             order.status = "HOLD"
             order.notes = request.data.get("notes", order.notes)
-            order.save()
+            versioned_update(order, ["status", "notes"], expected)
+            publish_order_status([order])
 
         return Response(
-            {"message": "Order put on HOLD and stock restored."},
+            {"message": "Order put on HOLD and stock restored.", "version": order.version},
             status=200
         )
 
+    except VersionConflict as e:
+        return conflict_response(e)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -667,30 +691,29 @@ def reject_order(request, order_id):
     try:
         crm_user = request.user
         order = get_object_or_404(SSOrder, id=order_id, assigned_crm=crm_user)
+        expected = expected_version(request, order)
 
         # वो snapshots लो जो पहले order verify/forward होने पर बने थे
         pending_snapshots = PendingOrderItemSnapshot.objects.filter(order=order)
-        affected_products = [snap.product for snap in pending_snapshots]
 
         with transaction.atomic():
 
-            # ✅ पहले snapshots delete — ये stock restore का trigger है
+            # ✅ पहले snapshots delete — ये stock restore का trigger है (reserved_qty signal से घटेगा)
             pending_snapshots.delete()
 
-            # ✅ हर product का virtual stock दोबारा calculate
-            for p in set(affected_products):
-                recalculate_virtual_stock(p)
-
-            # ✅ Order status update
+            # ✅ Order status update — conditional on the version the CRM saw
             order.status = "REJECTED"
             order.notes = request.data.get("notes", order.notes)
-            order.save()
+            versioned_update(order, ["status", "notes"], expected)
+            publish_order_status([order])
 
         return Response(
-            {"message": "Order  Reject and stock restored."},
+            {"message": "Order  Reject and stock restored.", "version": order.version},
             status=200
         )
 
+    except VersionConflict as e:
+        return conflict_response(e)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -716,12 +739,12 @@ def list_orders_by_role(request):
     else:
         orders = SSOrder.objects.none()
 
-    # 🟦 Filters
+    # 🟦 Filters (trigram index, orders.search)
     if order_id:
-        orders = orders.filter(order_id__icontains=order_id)
+        orders = orders.filter(order_id_q(order_id))
 
     if party_name:
-        orders = orders.filter(ss_user__party_name__icontains=party_name)
+        orders = orders.filter(party_q(party_name, "ss_user"))
 
     if from_date:
         orders = orders.filter(created_at__date__gte=from_date)
@@ -729,14 +752,44 @@ def list_orders_by_role(request):
     if to_date:
         orders = orders.filter(created_at__date__lte=to_date)
 
-    # 🟦 Default limit (latest 50)
-    if not (from_date or to_date or order_id or party_name):
-        orders = orders.order_by("-created_at")[:30]
+    # 🟦 Latest first, one keyset page at a time (filters or not)
+    orders = orders.select_related("ss_user", "assigned_crm")
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(orders, request)
+    serializer = SSOrderSerializerTrack(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def search_orders(request):
+    """Search-as-you-type on order id / party name: ?q=&limit=, exact and prefix matches first."""
+    user = request.user
+    if user.role == "ADMIN":
+        orders = SSOrder.objects.all()
+    elif user.role == "CRM":
+        orders = SSOrder.objects.filter(assigned_crm=user)
+    elif user.role == "SS":
+        orders = SSOrder.objects.filter(ss_user=user)
     else:
-        orders = orders.order_by("-created_at")
+        orders = SSOrder.objects.none()
 
-    serializer = SSOrderSerializerTrack(orders, many=True)
-    return Response(serializer.data)
+    try:
+        limit = min(max(int(request.GET.get("limit", SUGGESTION_LIMIT)), 1), SUGGESTION_LIMIT)
+    except ValueError:
+        limit = SUGGESTION_LIMIT
+    results = [
+        {
+            "id": order.id,
+            "order_id": order.order_id,
+            "party_name": order.ss_user.party_name,
+            "status": order.status,
+            "created_at": order.created_at,
+            "rank": rank,
+        }
+        for rank, order in suggest_orders(orders, request.GET.get("q", ""), limit=limit)
+    ]
+    return Response({"results": results})
 
 
 class CombinedOrderTrackView(APIView):
@@ -763,26 +816,35 @@ class UpdateOrderStatusView(APIView):
     permission_classes = [IsAuthenticated]
 
     def patch(self, request, pk):
-        crm_order = get_object_or_404(CRMVerifiedOrder, pk=pk)
+        crm_order = get_object_or_404(CRMVerifiedOrder.objects.select_related("original_order"), pk=pk)
         new_status = request.data.get("status")
         notes = request.data.get("notes")
 
         if new_status not in ["HOLD", "APPROVED", "REJECTED"]:
             return Response({"detail": "Invalid status"}, status=drf_status.HTTP_400_BAD_REQUEST)
 
-        crm_order.status = new_status
-        crm_order.notes = notes if new_status in ["HOLD", "REJECTED"] else None
-        crm_order.save(update_fields=["status", "notes"])
+        # ✅ conditional UPDATEs (version the CRM saw) -> 409 instead of overwriting a parallel edit
+        try:
+            with transaction.atomic():
+                crm_order.status = new_status
+                versioned_update(crm_order, ["status"], expected_version(request, crm_order))
 
-        ss_order = crm_order.original_order
-        ss_order.status = new_status
-        ss_order.notes = notes if new_status in ["HOLD", "REJECTED"] else None
-        ss_order.save(update_fields=["status", "notes"])
+                ss_order = crm_order.original_order
+                ss_order.status = new_status
+                ss_order.notes = notes if new_status in ["HOLD", "REJECTED"] else None
+                versioned_update(ss_order, ["status", "notes"])
+
+                # none of these statuses reserves stock; SSE status event (no post_save from the UPDATE)
+                PendingOrderItemSnapshot.objects.filter(order=ss_order).delete()
+                publish_order_status([ss_order])
+        except VersionConflict as e:
+            return conflict_response(e)
 
         return Response({
             "detail": "Status updated successfully",
             "status": new_status,
-            "notes": crm_order.notes
+            "notes": ss_order.notes,
+            "version": crm_order.version,
         })
 
 
@@ -791,35 +853,40 @@ class CRMVerifiedItemUpdateView(APIView):
 
     def post(self, request, pk):
         """
-        Update quantity or price of a verified order item
+        Update quantity / rejection of a verified order item
         """
-        try:
-            item = CRMVerifiedOrderItem.objects.get(pk=pk)
-        except CRMVerifiedOrderItem.DoesNotExist:
+        item = CRMVerifiedOrderItem.objects.filter(pk=pk).values("crm_order_id").first()
+        if item is None:
             return Response({"error": "Item not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        quantity = request.data.get("quantity")
-        price = request.data.get("price")
+        edit = {"item": pk}
+        for field in ("quantity", "is_rejected"):
+            if request.data.get(field) is not None:
+                edit[field] = request.data[field]
 
-        if quantity is not None:
-            item.quantity = quantity
-        if price is not None:
-            item.price = price
-
-        item.save()
-        return Response({"message": "Item updated successfully"})
+        try:
+            _, version = edit_verified_items(item["crm_order_id"], [edit], expected_version(request))
+        except ItemEditError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        except VersionConflict as e:
+            return conflict_response(e)
+        return Response({"message": "Item updated successfully", "version": version})
 
 
 class CRMVerifiedItemDeleteView(APIView):
     permission_classes = [IsAuthenticated]
 
     def delete(self, request, pk):
-        try:
-            item = CRMVerifiedOrderItem.objects.get(pk=pk)
-            item.delete()
-            return Response({"message": "Item deleted successfully"}, status=status.HTTP_200_OK)
-        except CRMVerifiedOrderItem.DoesNotExist:
+        item = CRMVerifiedOrderItem.objects.filter(pk=pk).values("crm_order_id").first()
+        if item is None:
             return Response({"error": "Item not found"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            _, version = edit_verified_items(item["crm_order_id"], [{"item": pk, "delete": True}], expected_version(request))
+        except ItemEditError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        except VersionConflict as e:
+            return conflict_response(e)
+        return Response({"message": "Item deleted successfully", "version": version}, status=status.HTTP_200_OK)
 
 
 @api_view(["POST"])
@@ -910,6 +977,7 @@ def submit_dealer_list(request):
 class DispatchOrderListView(ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = DispatchOrderSerializer
+    pagination_class = DispatchKeysetPagination
 
     def get_queryset(self):
         qs = DispatchOrder.objects.all()
@@ -923,12 +991,7 @@ class DispatchOrderListView(ListAPIView):
         if to_date:
             qs = qs.filter(order_packed_time__date__lte=to_date)
 
-        qs = qs.order_by("-order_packed_time")
-
-        # ✅ ONLY limit when NO filters
-        if not from_date and not to_date:
-            return qs[:10]
-
+        # ✅ latest packed first, keyset pages with or without date filters
         return qs
 
 
@@ -1238,3 +1301,77 @@ def download_orders_report(request):
     wb.save(response)
 
     return response
+
+
+# Live events (SSE) ---------------------
+
+SSE_HEARTBEAT_SECONDS = 20
+SSE_TOKEN_SALT = "orders.event-stream"
+SSE_TOKEN_MAX_AGE = 60  # seconds to open (or re-open) the stream with it
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def event_stream_token(request):
+    """
+    Short-lived token for ?stream_token= on the event stream (EventSource can't
+    send headers). Signed for this purpose only, so a leaked stream URL is no
+    login: it opens the stream for SSE_TOKEN_MAX_AGE seconds and nothing else.
+    """
+    token = signing.dumps(request.user.pk, salt=SSE_TOKEN_SALT)
+    return Response({"stream_token": token, "expires_in": SSE_TOKEN_MAX_AGE})
+
+
+def _sse_user(request):
+    """JWT from the Authorization header, or a stream token (event_stream_token) as ?stream_token=."""
+    authenticator = JWTAuthentication()
+    header = authenticator.get_header(request)
+    raw_token = authenticator.get_raw_token(header) if header else None
+    if raw_token:
+        try:
+            return authenticator.get_user(authenticator.get_validated_token(raw_token))
+        except (InvalidToken, AuthenticationFailed):
+            return None
+
+    stream_token = request.GET.get("stream_token")
+    if not stream_token:
+        return None
+    try:
+        user_id = signing.loads(stream_token, salt=SSE_TOKEN_SALT, max_age=SSE_TOKEN_MAX_AGE)
+    except signing.BadSignature:  # expired tokens too
+        return None
+    return User.objects.filter(pk=user_id).first()
+
+
+async def order_event_stream(request):
+    """
+    Server-sent events: stock changes for everyone, new orders for the
+    assigned CRM, status changes for the CRM and the SS. Needs the ASGI
+    application (one long-lived connection per client).
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Event stream needs the ASGI server"}, status=501)
+
+    user = await sync_to_async(_sse_user)(request)
+    if user is None or not user.is_active:
+        return JsonResponse({"error": "Authentication required"}, status=401)
+
+    subscription = broker.subscribe(audience_for(user))
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'], cls=DjangoJSONEncoder)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
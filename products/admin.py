@@ -5,7 +5,7 @@ from .models import  Product, SaleName, Scheme, SchemeCondition, SchemeReward
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('product_id', 'product_name', 'rack_no', 'live_stock', 'virtual_stock', 'mumbai_stock')
+    list_display = ('product_id', 'product_name', 'rack_no', 'live_stock', 'reserved_qty', 'virtual_stock', 'mumbai_stock', 'mumbai_reserved_qty', 'mumbai_virtual_stock')
 
 admin.site.register(SaleName)
 admin.site.register(Scheme)
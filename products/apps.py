@@ -7,5 +7,7 @@ class ApiConfig(AppConfig):
     name = 'products'
 
     def ready(self):
+        import products.signals
+
         from .scheduler import start
         start()
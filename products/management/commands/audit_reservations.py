@@ -0,0 +1,37 @@
+# products/management/commands/audit_reservations.py
+from django.core.management.base import BaseCommand
+from products.utils import audit_reservations
+
+class Command(BaseCommand):
+    help = "Check reserved/virtual stock against PendingOrderItemSnapshot (stale, orphaned, drifted). --fix repairs in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Delete bad snapshots and rebuild drifted products")
+
+    def handle(self, *args, **options):
+        report = audit_reservations(fix=options["fix"])
+
+        for row in report["stale"]:
+            self.stdout.write(
+                f"Stale snapshot {row['id']}: order {row['order_id']} ({row['order__status']}) "
+                f"product {row['product_id']} [{row['location']}] x{row['quantity']}"
+            )
+        for row in report["orphaned"]:
+            self.stdout.write(
+                f"Orphaned snapshot {row['id']}: order {row['order_id']} has no line for "
+                f"product {row['product_id']} [{row['location']}] x{row['quantity']}"
+            )
+        for product_id, fields in sorted(report["drift"].items()):
+            diff = ", ".join(f"{field} {current} -> {expected}" for field, (current, expected) in fields.items())
+            self.stdout.write(f"Drift {product_id}: {diff}")
+
+        summary = (
+            f"{len(report['stale'])} stale, {len(report['orphaned'])} orphaned snapshots, "
+            f"{len(report['drift'])} drifted products."
+        )
+        if not any(report.values()):
+            self.stdout.write(self.style.SUCCESS("Reservations in sync."))
+        elif options["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"Fixed: {summary}"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{summary} Run with --fix to repair."))
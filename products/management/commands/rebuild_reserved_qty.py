@@ -0,0 +1,18 @@
+# products/management/commands/rebuild_reserved_qty.py
+from django.core.management.base import BaseCommand
+from products.models import Product
+from products.utils import rebuild_reserved_qty
+
+class Command(BaseCommand):
+    help = "Rebuild Product reserved/virtual stock (Delhi + Mumbai) from PendingOrderItemSnapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument("product_ids", nargs="*", type=int, help="Only these products (default: all)")
+
+    def handle(self, *args, **options):
+        product_ids = options["product_ids"] or None
+        changes = rebuild_reserved_qty(product_ids)
+        for (product_id, location), (old, new) in sorted(changes.items()):
+            self.stdout.write(f"Reserved {product_id} [{location}]: {old} -> {new}")
+        total = len(product_ids) if product_ids else Product.objects.count()
+        self.stdout.write(self.style.SUCCESS(f"{total} products checked, {len(changes)} reservations rebuilt."))
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:05
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_reserved_qty(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    PendingOrderItemSnapshot = apps.get_model('orders', 'PendingOrderItemSnapshot')
+
+    pending = dict(
+        PendingOrderItemSnapshot.objects.values_list('product_id')
+        .annotate(total=Sum('quantity')).order_by()
+    )
+    products = list(Product.objects.only('product_id', 'live_stock', 'reserved_qty', 'virtual_stock'))
+    for product in products:
+        product.reserved_qty = pending.get(product.product_id, 0)
+        if product.live_stock is None:
+            product.virtual_stock = None
+        else:
+            product.virtual_stock = max(product.live_stock - product.reserved_qty, 0)
+    Product.objects.bulk_update(products, ['reserved_qty', 'virtual_stock'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_product_product_type'),
+        ('orders', '0025_remove_crmverifiedorderitem_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved_qty',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_reserved_qty, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:09
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_mumbai_reserved_qty(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    PendingOrderItemSnapshot = apps.get_model('orders', 'PendingOrderItemSnapshot')
+
+    pending = {
+        (product_id, location): total
+        for product_id, location, total in PendingOrderItemSnapshot.objects
+        .values_list('product_id', 'location').annotate(total=Sum('quantity')).order_by()
+    }
+    fields = ['live_stock', 'reserved_qty', 'virtual_stock', 'mumbai_stock', 'mumbai_reserved_qty', 'mumbai_virtual_stock']
+    products = list(Product.objects.only('product_id', *fields))
+    for product in products:
+        product.reserved_qty = pending.get((product.product_id, 'DELHI'), 0)
+        product.mumbai_reserved_qty = pending.get((product.product_id, 'MUMBAI'), 0)
+        product.virtual_stock = (
+            None if product.live_stock is None else max(product.live_stock - product.reserved_qty, 0)
+        )
+        product.mumbai_virtual_stock = (
+            None if product.mumbai_stock is None else max(product.mumbai_stock - product.mumbai_reserved_qty, 0)
+        )
+    Product.objects.bulk_update(
+        products, ['reserved_qty', 'virtual_stock', 'mumbai_reserved_qty', 'mumbai_virtual_stock'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0021_product_reserved_qty'),
+        ('orders', '0026_pendingorderitemsnapshot_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='mumbai_reserved_qty',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='mumbai_virtual_stock',
+            field=models.IntegerField(blank=True, default=0, null=True),
+        ),
+        migrations.RunPython(backfill_mumbai_reserved_qty, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:33
+
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations, models
+
+
+def parse_price(value):
+    # frozen copy of products.models.parse_price as of this migration
+    if value is None:
+        return None
+    text = str(value).replace(",", "").replace("₹", "").strip()
+    try:
+        price = Decimal(text).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+def backfill_unit_prices(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    products = list(Product.objects.only('product_id', 'price', 'ds_price'))
+    for product in products:
+        product.unit_price = parse_price(product.price)
+        product.ds_unit_price = parse_price(product.ds_price)
+    Product.objects.bulk_update(products, ['unit_price', 'ds_unit_price'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0023_changeversion_product_stock_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='ds_unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.RunPython(backfill_unit_prices, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,28 @@
+from decimal import Decimal, InvalidOperation
+
 from django.db import models
 from cloudinary.models import CloudinaryField
 
+
+def parse_price(value):
+    """Sheet / form price text ("1,250", "₹ 99.5") -> Decimal(2 places); blank or junk -> None."""
+    if value is None:
+        return None
+    text = str(value).replace(",", "").replace("₹", "").strip()
+    try:
+        price = Decimal(text).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+def virtual_stock_value(stock, reserved):
+    """Sellable stock of one warehouse: stock - reserved, never below 0; unknown stock stays None."""
+    if stock is None:
+        return None
+    return max(stock - reserved, 0)
+
+
 # ✅ 2. Product Model
 class Product(models.Model):
     product_id = models.IntegerField(unique=True, primary_key=True)
@@ -12,21 +34,50 @@ class Product(models.Model):
     guarantee = models.CharField(max_length=50, null=True, blank=True)
     price = models.CharField(max_length=10, null=True, blank=True)
     ds_price = models.CharField(max_length=10, null=True, blank=True)
+    # ✅ typed copies of price / ds_price (set in save) -> price book, SQL sums
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    ds_unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
     moq = models.IntegerField(null=True, blank=True)
     live_stock = models.IntegerField(null=True, blank=True)
     virtual_stock = models.IntegerField(null=True, blank=True, default=0) 
+    reserved_qty = models.IntegerField(default=0)  # SUM of PendingOrderItemSnapshot.quantity, kept by delta
     mumbai_stock = models.IntegerField(null=True, blank=True)
+    mumbai_reserved_qty = models.IntegerField(default=0)
+    mumbai_virtual_stock = models.IntegerField(null=True, blank=True, default=0)
+    stock_version = models.BigIntegerField(default=0, db_index=True)  # ChangeVersion("stock") at last recalculation
     quantity_type = models.CharField(max_length=50, default="MOQ")
     rack_no = models.CharField(max_length=50, null=True, blank=True)
     image = CloudinaryField('image', blank=True, null=True)
     image2 = CloudinaryField('image2', blank=True, null=True)
     is_active = models.BooleanField(default=True)
 
+    def save(self, *args, **kwargs):
+        self.unit_price = parse_price(self.price)
+        self.ds_unit_price = parse_price(self.ds_price)
+        if self._state.adding:
+            # ✅ new product: virtual columns from its stock (not the column default 0)
+            self.virtual_stock = virtual_stock_value(self.live_stock, self.reserved_qty)
+            self.mumbai_virtual_stock = virtual_stock_value(self.mumbai_stock, self.mumbai_reserved_qty)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"price", "ds_price"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"unit_price", "ds_unit_price"}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.product_id} - {self.product_name}"
 
 
 
+# ✅ Monotonic change counters (stock cursor, ...)
+class ChangeVersion(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
 # ✅ 3. SaleName Model (1 product → many sale names)
 class SaleName(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, to_field='product_id', db_column='product_id', related_name="sale_names")
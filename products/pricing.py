@@ -0,0 +1,71 @@
+# products/pricing.py
+# Server-side price book: {role: {product_id: Decimal}} from Product.unit_price /
+# ds_unit_price, cached per process. Order lines and totals are priced from it,
+# the client's "price" is ignored.
+import threading
+from decimal import Decimal
+
+from products.models import Product, ChangeVersion
+
+PRICES_VERSION = "prices"   # ChangeVersion bumped when a price changes (any process)
+
+# role -> typed price column
+PRICE_COLUMNS = {
+    "SS": "unit_price",
+    "DS": "ds_unit_price",
+}
+
+_price_cache = {"book": None, "version": None}
+_price_cache_lock = threading.Lock()
+
+
+class UnpricedProducts(ValueError):
+    """Cart has products without a valid price for the buyer's role."""
+
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"No price set for products {self.product_ids}")
+
+
+def _load_book():
+    columns = list(PRICE_COLUMNS.values())
+    book = {role: {} for role in PRICE_COLUMNS}
+    for row in Product.objects.values_list("product_id", *columns):
+        for role, price in zip(PRICE_COLUMNS, row[1:]):
+            if price is not None:
+                book[role][row[0]] = price
+    return book
+
+
+def price_book(role):
+    """
+    {product_id: Decimal} for role ("SS" / "DS"). One PK lookup of the "prices"
+    counter per call; the catalogue is read again only after a price changed.
+    Callers fetch the book once per request (once per chunk for batches), so that
+    lookup is the whole cost of seeing a price edit made by any other process.
+    """
+    # (value, updated_at): a recreated / reset counter can't match an old book
+    version = ChangeVersion.objects.filter(name=PRICES_VERSION).values_list("value", "updated_at").first()
+    # no counter yet (fresh or rolled-back DB) -> nothing to compare against, don't trust the cache
+    if _price_cache["book"] is None or version is None or _price_cache["version"] != version:
+        with _price_cache_lock:
+            if _price_cache["book"] is None or version is None or _price_cache["version"] != version:
+                _price_cache["book"] = _load_book()
+                _price_cache["version"] = version
+    return _price_cache["book"][role]
+
+
+def price_lines(items, prices):
+    """
+    Cart items [{"id", "quantity"}] -> ({product_id: unit price}, total), priced
+    from `prices`. UnpricedProducts if any product has no price.
+    """
+    missing = {int(item["id"]) for item in items} - prices.keys()
+    if missing:
+        raise UnpricedProducts(missing)
+    unit_prices = {int(item["id"]): prices[int(item["id"])] for item in items}
+    total = sum(
+        (unit_prices[int(item["id"])] * int(item.get("quantity") or 0) for item in items),
+        Decimal("0.00"),
+    )
+    return unit_prices, total
@@ -8,6 +8,7 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = "__all__"
+        read_only_fields = ["reserved_qty", "mumbai_reserved_qty", "stock_version"]
 
     def get_sale_names(self, obj):
         return [s.sale_name for s in obj.sale_names.all()]
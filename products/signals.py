@@ -0,0 +1,37 @@
+# products/signals.py
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Product, SaleName
+from .utils import stamp_stock_version, touch_change_version, CATALOGUE_VERSION
+from .pricing import PRICES_VERSION
+
+# stock engine bookkeeping, not part of the catalogue payloads
+RESERVATION_FIELDS = {"reserved_qty", "virtual_stock", "mumbai_reserved_qty", "mumbai_virtual_stock", "stock_version"}
+
+@receiver(post_save, sender=Product)
+def stamp_new_product_stock(sender, instance, created, **kwargs):
+    # ✅ new product -> visible in the virtual stock delta feed
+    if created:
+        stamp_stock_version([instance.product_id])
+
+@receiver(post_save, sender=Product)
+def touch_catalogue_on_product_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= RESERVATION_FIELDS:
+        return
+    touch_change_version(CATALOGUE_VERSION)
+
+@receiver(post_save, sender=Product)
+def touch_prices_on_product_save(sender, instance, update_fields=None, **kwargs):
+    # ✅ price book of every process reloads after commit (form edit, bulk upload, admin)
+    if update_fields is None or {"price", "ds_price"} & set(update_fields):
+        touch_change_version(PRICES_VERSION)
+
+@receiver(post_delete, sender=Product)
+def touch_prices_on_product_delete(sender, **kwargs):
+    touch_change_version(PRICES_VERSION)
+
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=SaleName)
+@receiver(post_delete, sender=SaleName)
+def touch_catalogue(sender, **kwargs):
+    touch_change_version(CATALOGUE_VERSION)
@@ -1,7 +1,11 @@
 from django.conf import settings
 from django.db import transaction
+from django.db.models import F
 from .models import Product
-from .utils import get_sheet, recalculate_virtual_stock
+from .utils import (
+    CATALOGUE_VERSION, STOCK_COLUMNS, _virtual_stock_expression, get_sheet, stamp_stock_version,
+    touch_change_version,
+)
 
 
 def clean_stock_value(value):
@@ -30,6 +34,7 @@ def sheet_to_db():
             return
 
         updated = 0
+        stocked_ids = []
 
         with transaction.atomic():
             for row in rows:
@@ -51,11 +56,11 @@ def sheet_to_db():
                 # Clean the value
                 live_stock_clean = clean_stock_value(live_stock_from_sheet)
 
+                changed_fields = []
+
                 if live_stock_clean is not None and product.live_stock != live_stock_clean:
                     product.live_stock = live_stock_clean
-                    product.save(update_fields=["live_stock"])
-                    recalculate_virtual_stock(product)
-                    updated += 1
+                    changed_fields.append("live_stock")
 
                 # ---------------------------
                 # 🔥 2) MUMBAI STOCK SYNC
@@ -67,9 +72,29 @@ def sheet_to_db():
 
                 if mumbai_stock_clean is not None and product.mumbai_stock != mumbai_stock_clean:
                     product.mumbai_stock = mumbai_stock_clean
-                    product.save(update_fields=["mumbai_stock"])
+                    changed_fields.append("mumbai_stock")
+
+                # ---------------------------
+                # 🔥 3) VIRTUAL STOCK (Delhi + Mumbai) in the same UPDATE
+                # reserved read by the UPDATE itself -> a reservation committed meanwhile isn't lost
+                # ---------------------------
+                if changed_fields:
+                    updates = {}
+                    for stock_field, reserved_field, virtual_field in STOCK_COLUMNS.values():
+                        if stock_field in changed_fields:
+                            stock = getattr(product, stock_field)
+                            updates[stock_field] = stock
+                            updates[virtual_field] = _virtual_stock_expression(stock_field, F(reserved_field), stock)
+                    Product.objects.filter(pk=product.pk).update(**updates)
+                    stocked_ids.append(product.product_id)
                     updated += 1
 
+            # ✅ one stock_version bump for the whole sync (after commit)
+            stamp_stock_version(stocked_ids)
+            # queryset update -> no post_save, catalogue payloads (live stock) refreshed once here
+            if stocked_ids:
+                touch_change_version(CATALOGUE_VERSION)
+
         print(f"✅ Synced: {updated} products updated (live + mumbai stock).")
 
     except Exception as e:
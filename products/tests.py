@@ -1,3 +1,425 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from distributer.models import DSOrder
+from orders.models import PendingOrderItemSnapshot, SSOrder, SSOrderItem
+from orders.tests import OrderFixtures
+from products.models import ChangeVersion, Product, SaleName, parse_price
+from products.pricing import PRICES_VERSION, UnpricedProducts, price_book, price_lines
+from products.sync import sheet_to_db
+from products.utils import (
+    CATALOGUE_VERSION, STOCK_VERSION, apply_reserved_deltas, audit_reservations, coalesce_stock_updates,
+    get_change_version, mark_reserved_delta, rebuild_reserved_qty, recalculate_virtual_stock_bulk,
+)
+
+
+class PriceBookTests(OrderFixtures, TransactionTestCase):  # real commits -> "prices" version bumps
+    def setUp(self):
+        super().setUp()
+        self.ds = CustomUser.objects.create_user(mobile="9300000010", role="DS", password="p", name="ds")
+        Product.objects.create(product_id=1, product_name="P1", sub_category="Charger", live_stock=100, price="1,250", ds_price="1100.5")
+        Product.objects.create(product_id=2, product_name="P2", sub_category="Cable", live_stock=100, price="19.99", ds_price="N/A")
+
+    def test_parse_price(self):
+        self.assertEqual(parse_price("₹ 1,250"), Decimal("1250.00"))
+        self.assertEqual(parse_price(99.5), Decimal("99.50"))
+        for value in (None, "", "N/A", "-5", "nan"):
+            self.assertIsNone(parse_price(value))
+
+    def test_typed_prices_follow_text_prices(self):
+        product = Product.objects.get(product_id=2)
+        self.assertEqual((product.unit_price, product.ds_unit_price), (Decimal("19.99"), None))
+        product.ds_price = "17"
+        product.save(update_fields=["ds_price"])
+        self.assertEqual(Product.objects.get(product_id=2).ds_unit_price, Decimal("17.00"))
+
+    def test_book_cached_until_a_price_changes(self):
+        self.assertEqual(price_book("SS"), {1: Decimal("1250.00"), 2: Decimal("19.99")})
+        with self.assertNumQueries(1):  # version check only
+            self.assertEqual(price_book("DS"), {1: Decimal("1100.50")})
+
+        Product.objects.filter(product_id=1).first().save(update_fields=["live_stock"])  # not a price
+        with self.assertNumQueries(1):
+            price_book("SS")
+
+        product = Product.objects.get(product_id=1)
+        product.price = "1300"
+        product.save()
+        self.assertEqual(price_book("SS")[1], Decimal("1300.00"))
+
+    def test_price_lines(self):
+        prices = price_book("SS")
+        unit_prices, total = price_lines([{"id": 1, "quantity": 2}, {"id": "2", "quantity": 3}], prices)
+        self.assertEqual(unit_prices, {1: Decimal("1250.00"), 2: Decimal("19.99")})
+        self.assertEqual(total, Decimal("2559.97"))
+        with self.assertRaises(UnpricedProducts):
+            price_lines([{"id": 2, "quantity": 1}], price_book("DS"))
+
+    def test_orders_priced_on_the_server(self):
+        client = self.client_for(self.ss)
+        response = client.post("/api/ss-orders/create/", {
+            "user_id": self.ss.id, "crm_id": self.crm.id, "total": 1,
+            "items": [{"id": 1, "quantity": 2, "price": 1}, {"id": 2, "quantity": 1, "price": 0.1}],
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        order = SSOrder.objects.get()
+        self.assertEqual(order.total_amount, Decimal("2519.99"))
+        self.assertEqual(sorted(order.items.values_list("price", flat=True)), [Decimal("19.99"), Decimal("1250.00")])
+
+        client.force_authenticate(self.ds)
+        response = client.post("/api/ds-orders/create/", {
+            "user_id": self.ds.id, "items": [{"id": 1, "quantity": 3, "price": 1}],
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(DSOrder.objects.get().total_amount, Decimal("3301.50"))
+
+        response = client.post("/api/ds-orders/create/", {
+            "user_id": self.ds.id, "items": [{"id": 2, "quantity": 1, "price": 1}],
+        }, format="json")
+        self.assertEqual(response.status_code, 400)  # no DS price -> not orderable
+
+
+class ProductBulkUploadTests(TransactionTestCase):  # real commits -> counter bumps counted
+    def test_one_bump_per_counter(self):
+        Product.objects.create(product_id=1, product_name="P1", price="10")
+        before = {name: get_change_version(name) for name in (CATALOGUE_VERSION, PRICES_VERSION, STOCK_VERSION)}
+
+        sheet = BytesIO()
+        pd.DataFrame([
+            {"product_id": 1, "product_name": "P1 new", "price": 12},
+            {"product_id": 2, "product_name": "P2", "price": 20},
+            {"product_id": 3, "product_name": "P3", "price": 30},
+        ]).to_excel(sheet, index=False)
+        upload = SimpleUploadedFile("products.xlsx", sheet.getvalue())
+        response = self.client.post("/api/products/bulk-upload/", {"file": upload})
+
+        self.assertEqual((response.data["created"], response.data["updated"]), (2, 1))
+        self.assertEqual(price_book("SS")[3], Decimal("30.00"))
+        self.assertEqual(
+            {name: get_change_version(name) - value for name, value in before.items()},
+            {CATALOGUE_VERSION: 1, PRICES_VERSION: 1, STOCK_VERSION: 1},
+        )
+        self.assertEqual(set(Product.objects.filter(product_id__in=[2, 3]).values_list("stock_version", flat=True)),
+                         {get_change_version(STOCK_VERSION)})
+
+
+class VirtualStockFeedTests(TestCase):
+    url = "/api/virtual-stock/"
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):  # new products stamped
+            for product_id in (1, 2, 3):
+                Product.objects.create(product_id=product_id, product_name=f"P{product_id}", live_stock=100,
+                                       virtual_stock=100, mumbai_stock=10, mumbai_virtual_stock=10)
+
+    def reserve(self, deltas):
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            for product_id, qty in deltas.items():
+                mark_reserved_delta(product_id, qty)
+
+    def since(self, cursor):
+        response = self.client.get(self.url, {"since": cursor})
+        self.assertEqual(response.status_code, 200)
+        return response.data["cursor"], [row["product_id"] for row in response.data["results"]]
+
+    def test_cursor_moves_forward_with_changed_rows_only(self):
+        full = self.client.get(self.url)
+        self.assertEqual(len(full.data), 3)
+        start = int(full["X-Stock-Cursor"])
+        self.assertEqual(self.since(start), (start, []))
+
+        self.reserve({2: 4})
+        cursor, changed = self.since(start)
+        self.assertGreater(cursor, start)
+        self.assertEqual(changed, [2])
+        self.assertEqual(self.client.get(self.url, {"since": start}).data["results"],
+                         [{"product_id": 2, "virtual_stock": 96, "mumbai_virtual_stock": 10}])
+
+        self.reserve({1: 1, 3: 1})
+        later, changed = self.since(cursor)
+        self.assertGreater(later, cursor)
+        self.assertEqual(sorted(changed), [1, 3])  # only stock_version > since
+        self.assertEqual(sorted(self.since(start)[1]), [1, 2, 3])
+        self.assertEqual(self.since(later), (later, []))
+
+    def test_bad_cursor_is_400(self):
+        for since in ("abc", "1.5", ""):
+            response = self.client.get(self.url, {"since": since})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data, {"error": "since must be an integer cursor"})
+
+
+class ConditionalGetTests(TransactionTestCase):  # real commits -> every write bumps its counter
+    def setUp(self):
+        Product.objects.create(product_id=1, product_name="P1", live_stock=10, price="10")
+        self.client = APIClient()
+
+    def get(self, url="/api/all-products/", **headers):
+        return self.client.get(url, **headers)
+
+    def test_matching_etag_is_304_until_a_write(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        etag = first["ETag"]
+        with self.assertNumQueries(1):  # counters only, the view doesn't run
+            self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=f'"other", {etag}').status_code, 304)
+
+        seen = {etag}
+        product = Product.objects.get(pk=1)
+        for write in (
+            lambda: product.save(update_fields=["price"]),  # price edit
+            lambda: Product.objects.create(product_id=2, product_name="P2"),
+            lambda: SaleName.objects.create(product=product, sale_name="p one"),
+        ):
+            write()
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(response["ETag"], seen)
+            etag = response["ETag"]
+            seen.add(etag)
+
+    def test_reservation_writes_keep_the_catalogue_etag(self):
+        etag = self.get()["ETag"]
+        mark_reserved_delta(1, 2)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # ... but the stock feed moves
+        stock_etag = self.get("/api/virtual-stock/")["ETag"]
+        mark_reserved_delta(1, 1)
+        self.assertEqual(self.get("/api/virtual-stock/", HTTP_IF_NONE_MATCH=stock_etag).status_code, 200)
+
+    def test_etag_varies_on_role(self):
+        anon = self.get()
+        self.client.force_authenticate(CustomUser.objects.create_user(mobile="9300000011", role="CRM", password="p", name="crm"))
+        crm = self.get(HTTP_IF_NONE_MATCH=anon["ETag"])
+        self.assertEqual(crm.status_code, 200)
+        self.assertNotEqual(crm["ETag"], anon["ETag"])
+        self.assertIn("Authorization", crm["Vary"])
+
+    def test_if_modified_since(self):
+        last_modified = self.get()["Last-Modified"]
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        updated_at = ChangeVersion.objects.get(name=CATALOGUE_VERSION).updated_at
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=http_date(updated_at.timestamp() - 60)).status_code, 200)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE="not a date").status_code, 200)
+
+        Product.objects.create(product_id=2, product_name="P2")
+        ChangeVersion.objects.filter(name=CATALOGUE_VERSION).update(updated_at=updated_at + timedelta(minutes=1))
+        response = self.get(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["Last-Modified"], last_modified)
+        # If-None-Match wins over If-Modified-Since
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"stale"', HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 200)
+
+
+class NewProductStockTests(TestCase):
+    def test_virtual_columns_follow_stock_on_insert(self):
+        Product.objects.create(product_id=1, product_name="P1", mumbai_stock=50)
+        Product.objects.create(product_id=2, product_name="P2", live_stock=10, reserved_qty=4, mumbai_stock=3, mumbai_reserved_qty=5)
+        columns = ("live_stock", "virtual_stock", "mumbai_stock", "mumbai_virtual_stock")
+        self.assertEqual(list(Product.objects.order_by("product_id").values_list(*columns)),
+                         [(None, None, 50, 50), (10, 6, 3, 0)])
+        self.assertNotIn(1, audit_reservations()["drift"])  # nothing for the audit to fix on a fresh product
+
+
+class SheetStockSyncTests(TestCase):
+    def test_stock_and_virtual_written_by_one_update(self):
+        Product.objects.create(product_id=1, product_name="P1", live_stock=10, reserved_qty=3, virtual_stock=7,
+                               mumbai_stock=5, mumbai_reserved_qty=1, mumbai_virtual_stock=4)
+        Product.objects.create(product_id=2, product_name="P2", live_stock=2, reserved_qty=4, virtual_stock=0)
+        sheet = mock.Mock()
+        sheet.get_all_records.return_value = [
+            {"product_id": 1, "live_stock": "20", "mumbai_stock": "5"},
+            {"product_id": 2, "live_stock": "", "mumbai_stock": "x"},
+            {"product_id": 99, "live_stock": "1"},
+        ]
+        with mock.patch("products.sync.get_sheet", return_value=sheet), self.captureOnCommitCallbacks(execute=True):
+            sheet_to_db()
+
+        columns = ("live_stock", "reserved_qty", "virtual_stock", "mumbai_stock", "mumbai_virtual_stock")
+        self.assertEqual(Product.objects.values_list(*columns).get(pk=1), (20, 3, 17, 5, 4))
+        self.assertEqual(Product.objects.values_list(*columns).get(pk=2), (0, 4, 0, None, None))
+
+
+class ReservationDeltaTests(TransactionTestCase):  # real commits / rollbacks
+    def setUp(self):
+        for product_id in (1, 2):
+            Product.objects.create(product_id=product_id, product_name=f"P{product_id}", live_stock=100, virtual_stock=100)
+
+    def stock(self, product_id=1):
+        return Product.objects.values_list("reserved_qty", "virtual_stock").get(pk=product_id)
+
+    def test_autocommit_applies_right_away(self):
+        mark_reserved_delta(1, 3)
+        self.assertEqual(self.stock(), (3, 97))
+
+    def test_rolled_back_savepoint_never_applied(self):
+        with transaction.atomic():
+            mark_reserved_delta(1, 5)
+            try:
+                with transaction.atomic():
+                    mark_reserved_delta(1, 7)
+                    mark_reserved_delta(2, 4)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            mark_reserved_delta(1, 1)
+            self.assertEqual(self.stock(), (0, 100))  # nothing before commit
+        self.assertEqual((self.stock(1), self.stock(2)), ((6, 94), (0, 100)))
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            mark_reserved_delta(1, 9)
+            raise RuntimeError
+        self.assertEqual(self.stock(), (6, 94))
+
+    def test_nested_coalesce_flushes_once(self):
+        with mock.patch("products.utils.apply_reserved_deltas", wraps=apply_reserved_deltas) as apply:
+            with coalesce_stock_updates() as deltas:
+                mark_reserved_delta(1, 2)
+                with coalesce_stock_updates() as inner:
+                    self.assertIs(inner, deltas)
+                    mark_reserved_delta(1, 3)
+                    mark_reserved_delta(2, 1)
+                self.assertEqual(apply.call_count, 0)
+            self.assertEqual(apply.call_count, 1)
+        self.assertEqual((self.stock(1), self.stock(2)), ((5, 95), (1, 99)))
+
+
+class SnapshotStockTestCase(OrderFixtures, TestCase):
+    """Products 1-4 (Delhi 100 / Mumbai 20) reserved through real order snapshots."""
+    columns = ("reserved_qty", "virtual_stock", "mumbai_reserved_qty", "mumbai_virtual_stock")
+
+    def setUp(self):
+        super().setUp()
+        for product_id in (1, 2, 3, 4):
+            Product.objects.create(product_id=product_id, product_name=f"P{product_id}", live_stock=100,
+                                   virtual_stock=100, mumbai_stock=20, mumbai_virtual_stock=20)
+
+    def place(self, quantities, ss_user=None):
+        with self.captureOnCommitCallbacks(execute=True):  # snapshot reservations applied
+            order = SSOrder.objects.create(ss_user=ss_user or self.ss, assigned_crm=self.crm)
+            for product_id, quantity in quantities.items():
+                SSOrderItem.objects.create(order=order, product_id=product_id, quantity=quantity, price=10)
+        return order
+
+    def stock(self):
+        return list(Product.objects.order_by("product_id").values_list(*self.columns))
+
+    def command(self, name, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(name, *args, stdout=out)
+        return out.getvalue()
+
+
+class ReservationAuditTests(SnapshotStockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pending = self.place({1: 5})
+
+    def audit(self, *args):
+        return self.command("audit_reservations", *args)
+
+    def test_clean_db_reports_nothing(self):
+        self.assertEqual(audit_reservations(), {"stale": [], "orphaned": [], "drift": {}})
+        self.assertIn("Reservations in sync.", self.audit())
+        self.assertIn("Reservations in sync.", self.audit("--fix"))
+        self.assertEqual(PendingOrderItemSnapshot.objects.count(), 1)
+
+    def test_report_then_fix(self):
+        # stale: order left PENDING by a plain UPDATE (no signal) -> its snapshot and reservation stay
+        dispatched = self.place({2: 3})
+        SSOrder.objects.filter(pk=dispatched.pk).update(status="DISPATCHED")
+        stale = PendingOrderItemSnapshot.objects.get(order=dispatched)
+        # orphaned: snapshot without an order line (bulk_create -> nothing reserved)
+        orphaned, = PendingOrderItemSnapshot.objects.bulk_create([
+            PendingOrderItemSnapshot(order=self.pending, product_id=3, quantity=4, location="MUMBAI"),
+        ])
+        # drift: columns edited behind the snapshots' back
+        Product.objects.filter(product_id=4).update(reserved_qty=7, mumbai_virtual_stock=3)
+
+        report = audit_reservations()
+        self.assertEqual([row["id"] for row in report["stale"]], [stale.id])
+        self.assertEqual(report["stale"][0]["order__status"], "DISPATCHED")
+        self.assertEqual([row["id"] for row in report["orphaned"]], [orphaned.id])
+        self.assertEqual(report["drift"], {
+            2: {"reserved_qty": (3, 0), "virtual_stock": (97, 100)},
+            4: {"reserved_qty": (7, 0), "mumbai_virtual_stock": (3, 20)},
+        })
+
+        output = self.audit()  # report only
+        self.assertIn(f"Stale snapshot {stale.id}", output)
+        self.assertIn(f"Orphaned snapshot {orphaned.id}", output)
+        self.assertIn("1 stale, 1 orphaned snapshots, 2 drifted products. Run with --fix", output)
+        self.assertEqual(PendingOrderItemSnapshot.objects.count(), 3)
+
+        self.assertIn("Fixed: 1 stale, 1 orphaned snapshots, 2 drifted products.", self.audit("--fix"))
+        self.assertEqual(list(PendingOrderItemSnapshot.objects.values_list("order_id", "product_id")), [(self.pending.id, 1)])
+        self.assertEqual(self.stock(), [(5, 95, 0, 20), (0, 100, 0, 20), (0, 100, 0, 20), (0, 100, 0, 20)])
+        self.assertEqual(audit_reservations(), {"stale": [], "orphaned": [], "drift": {}})
+
+
+class StockRecoveryTestCase(SnapshotStockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.place({1: 5, 2: 2})
+        self.place({1: 3}, ss_user=self.create_ss("9200000002", "mumbai ss", stock_location="MUMBAI"))
+        self.expected = [(5, 95, 3, 17), (2, 98, 0, 20), (0, 100, 0, 20), (0, 100, 0, 20)]
+        self.assertEqual(self.stock(), self.expected)
+
+
+class VirtualStockRecalcTests(StockRecoveryTestCase):
+    def test_bulk_recalculation_of_both_warehouses(self):
+        Product.objects.filter(product_id__in=[1, 3]).update(virtual_stock=0, mumbai_virtual_stock=99)
+        with self.captureOnCommitCallbacks(execute=True):
+            changes = recalculate_virtual_stock_bulk([1, 2, 3])
+        self.assertEqual(changes, {1: (0, 95), 3: (0, 100)})  # 2 already right
+        self.assertEqual(self.stock(), self.expected)
+        self.assertEqual(recalculate_virtual_stock_bulk([]), {})
+
+    def test_recalc_all_virtual_stock_command(self):
+        Product.objects.update(virtual_stock=7, mumbai_virtual_stock=None)
+        output = self.command("recalc_all_virtual_stock")
+        self.assertIn("Updated 1: 7 -> 95", output)
+        self.assertIn("4/4 products updated.", output)
+        self.assertEqual(self.stock(), self.expected)
+        self.assertIn("0/4 products updated.", self.command("recalc_all_virtual_stock"))
+
+
+class ReservedQtyRebuildTests(StockRecoveryTestCase):
+    def corrupt(self):
+        Product.objects.filter(product_id=1).update(reserved_qty=50, virtual_stock=50, mumbai_reserved_qty=0, mumbai_virtual_stock=20)
+        Product.objects.filter(product_id=4).update(reserved_qty=-2, mumbai_reserved_qty=9, mumbai_virtual_stock=11)
+
+    def test_rebuild_from_pending_snapshots(self):
+        self.corrupt()
+        with self.captureOnCommitCallbacks(execute=True):
+            changes = rebuild_reserved_qty([1, 2])
+        self.assertEqual(changes, {(1, "DELHI"): (50, 5), (1, "MUMBAI"): (0, 3)})
+        self.assertEqual(self.stock()[:2], self.expected[:2])
+        self.assertEqual(self.stock()[3], (-2, 100, 9, 11))  # not asked for
+        self.assertEqual(rebuild_reserved_qty([]), {})
+
+    def test_rebuild_reserved_qty_command(self):
+        self.corrupt()
+        output = self.command("rebuild_reserved_qty")
+        self.assertIn("Reserved 1 [DELHI]: 50 -> 5", output)
+        self.assertIn("Reserved 4 [MUMBAI]: 9 -> 0", output)
+        self.assertIn("4 products checked, 4 reservations rebuilt.", output)
+        self.assertEqual(self.stock(), self.expected)
+
+        Product.objects.update(reserved_qty=1, mumbai_reserved_qty=1)
+        output = self.command("rebuild_reserved_qty", "2", "3")  # only these
+        self.assertIn("2 products checked, 4 reservations rebuilt.", output)
+        self.assertEqual([row[0::2] for row in self.stock()], [(1, 1), (2, 0), (0, 0), (1, 1)])
@@ -2,11 +2,23 @@
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from django.conf import settings
-from orders.models import PendingOrderItemSnapshot
-from django.db.models import Sum
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+from orders.models import PendingOrderItemSnapshot, SSOrderItem, CRMVerifiedOrderItem
+from orders.events import broker, STOCK_CHANGED
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Q, Sum, Value, When
+from django.db.models.functions import Greatest
 from google.oauth2.service_account import Credentials
+from products.models import Product, ChangeVersion, virtual_stock_value as _virtual_stock_value
+import threading
 import time
 import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
 logger = logging.getLogger(__name__)
 
 
@@ -69,25 +81,562 @@ def write_to_sheet(sheet_id, sheet_name, rows: list, retries=3, delay=3):
 
 
 
-def recalculate_virtual_stock(product, save=True):
+# ---------------------------
+# 🔥 Change versions (monotonic counters in ChangeVersion)
+# ---------------------------
+
+STOCK_VERSION = "stock"
+CATALOGUE_VERSION = "products"   # Product / SaleName rows
+USERS_VERSION = "users"          # CustomUser rows
+
+
+def bump_change_version(name):
+    """Increment counter `name` and return the new value (row lock until commit)."""
+    with transaction.atomic():
+        if not ChangeVersion.objects.filter(name=name).update(value=F("value") + 1, updated_at=timezone.now()):
+            ChangeVersion.objects.get_or_create(name=name)
+            ChangeVersion.objects.filter(name=name).update(value=F("value") + 1, updated_at=timezone.now())
+        return ChangeVersion.objects.values_list("value", flat=True).get(name=name)
+
+
+def get_change_version(name):
+    return ChangeVersion.objects.filter(name=name).values_list("value", flat=True).first() or 0
+
+
+def on_commit_once(key, func):
+    """transaction.on_commit(func) unless a callback with the same key is already queued."""
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        for _, registered, _ in connection.run_on_commit:
+            if getattr(registered, "_once_key", None) == key:
+                return
+    func._once_key = key
+    transaction.on_commit(func, robust=True)
+
+
+def touch_change_version(name):
+    """Bump counter `name` once per transaction, after commit."""
+    on_commit_once(("version", name), lambda: bump_change_version(name))
+
+
+def conditional_on_versions(*names, vary_on_role=False):
     """
-    Recalculate virtual_stock for a single Product instance.
-    - If live_stock is None -> virtual_stock will be set to None.
-    - Else -> virtual_stock = max(live_stock - pending_qty, 0)
-    Returns the computed value (None or int).
+    Conditional GET for DRF views (function views or view methods).
+    ETag / Last-Modified come from ChangeVersion counters, so a matching
+    If-None-Match / If-Modified-Since returns 304 before the view runs.
     """
-    pending_qty = PendingOrderItemSnapshot.objects.filter(product=product).aggregate(
-        total=Sum('quantity')
-    )['total'] or 0
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            request = next(arg for arg in args if hasattr(arg, "META"))
+
+            rows = ChangeVersion.objects.filter(name__in=names).values_list("name", "value", "updated_at")
+            versions = {name: (value, updated_at) for name, value, updated_at in rows}
+            parts = [f"{name}-{versions.get(name, (0, None))[0]}" for name in names]
+            if vary_on_role:
+                parts.append(getattr(request.user, "role", None) or "anon")
+            etag = quote_etag(".".join(parts))
+            stamps = [updated_at for _, updated_at in versions.values() if updated_at]
+            last_modified = int(max(stamps).timestamp()) if stamps else None
+
+            if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+            if_modified_since = request.META.get("HTTP_IF_MODIFIED_SINCE")
+            if if_none_match:
+                not_modified = etag in parse_etags(if_none_match) or if_none_match.strip() == "*"
+            elif if_modified_since and last_modified:
+                since = parse_http_date_safe(if_modified_since)
+                not_modified = since is not None and last_modified <= since
+            else:
+                not_modified = False
+
+            response = Response(status=304) if not_modified else view(*args, **kwargs)
+            if response.status_code in (200, 304):
+                response["ETag"] = etag
+                if last_modified:
+                    response["Last-Modified"] = http_date(last_modified)
+                if vary_on_role:
+                    patch_vary_headers(response, ["Authorization"])
+            return response
+        return wrapper
+    return decorator
+
+
+_stamp_state = threading.local()
+
+
+@contextmanager
+def merged_stock_stamps():
+    """
+    One stamp_stock_version() for a whole bulk operation (e.g. a batch of orders).
+    Stamps inside the block are merged and registered once on exit; ids from
+    savepoints rolled back meanwhile only cost clients a re-read of an unchanged row.
+    """
+    if getattr(_stamp_state, "product_ids", None) is not None:
+        yield
+        return
+
+    _stamp_state.product_ids = set()
+    try:
+        yield
+    finally:
+        product_ids, _stamp_state.product_ids = _stamp_state.product_ids, None
+    stamp_stock_version(product_ids)
+
+
+def stamp_stock_version(product_ids):
+    """
+    Give product_ids a fresh stock_version once the current transaction commits.
+    Stamping after commit, one counter bump per batch, keeps the cursor safe:
+    a row is only visible at version <= cursor once its stock is committed.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    pending = getattr(_stamp_state, "product_ids", None)
+    if pending is not None:
+        pending.update(product_ids)
+        return
+
+    def stamp():
+        with transaction.atomic():
+            version = bump_change_version(STOCK_VERSION)
+            Product.objects.filter(product_id__in=product_ids).update(stock_version=version)
+
+        # ✅ push to connected SSE clients (only if anyone is listening)
+        if broker.has_subscribers():
+            rows = list(Product.objects.filter(product_id__in=product_ids).values(
+                "product_id", "virtual_stock", "mumbai_virtual_stock", "stock_version"
+            ))
+            broker.publish({"type": STOCK_CHANGED, "data": rows, "crm_id": None, "ss_id": None})
+
+    transaction.on_commit(stamp, robust=True)
 
-    if product.live_stock is None:
-        vs = None
+
+# ---------------------------
+# 🔥 Virtual stock per warehouse
+# location -> (stock field, reserved field, virtual field) on Product
+# ---------------------------
+
+STOCK_COLUMNS = {
+    "DELHI": ("live_stock", "reserved_qty", "virtual_stock"),
+    "MUMBAI": ("mumbai_stock", "mumbai_reserved_qty", "mumbai_virtual_stock"),
+}
+DEFAULT_LOCATION = "DELHI"
+STOCK_FIELDS = [field for columns in STOCK_COLUMNS.values() for field in columns]
+
+
+def normalize_location(value):
+    """'Mumbai' / 'MUMBAI' / None -> key of STOCK_COLUMNS (Delhi by default)."""
+    location = (value or "").strip().upper()
+    return location if location in STOCK_COLUMNS else DEFAULT_LOCATION
+
+
+def _virtual_stock_expression(stock_field, reserved, stock=None):
+    """
+    SQL side of _virtual_stock_value(), for use inside UPDATE statements.
+    stock: new stock value set by the same UPDATE (the right-hand side still reads the old column).
+    """
+    if stock is not None:
+        return Greatest(Value(stock) - reserved, Value(0), output_field=IntegerField())
+    return Case(
+        When(**{f"{stock_field}__isnull": True}, then=Value(None)),
+        default=Greatest(F(stock_field) - reserved, Value(0)),
+        output_field=IntegerField(),
+    )
+
+
+def _set_virtual_stock(product):
+    """Recompute every virtual column on the instance. Returns changed field names."""
+    changed = []
+    for stock_field, reserved_field, virtual_field in STOCK_COLUMNS.values():
+        vs = _virtual_stock_value(getattr(product, stock_field), getattr(product, reserved_field))
+        if getattr(product, virtual_field) != vs:
+            setattr(product, virtual_field, vs)
+            changed.append(virtual_field)
+    return changed
+
+
+def adjust_reserved_qty(product_id, delta, location=DEFAULT_LOCATION):
+    """
+    Apply a reservation delta to one product in a single atomic UPDATE.
+    reserved and virtual columns of that location move together, no snapshot scan.
+    """
+    apply_reserved_deltas({(product_id, normalize_location(location)): delta})
+
+
+def apply_reserved_deltas(deltas, batch_size=500):
+    """
+    Apply {(product_id, location): delta} with one UPDATE per batch
+    (a CASE on product_id per location). Products are handled in product_id order.
+    """
+    by_location = defaultdict(dict)
+    for (product_id, location), delta in deltas.items():
+        if delta:
+            by_location[location][product_id] = delta
+    product_ids = sorted({pid for per_product in by_location.values() for pid in per_product})
+
+    for start in range(0, len(product_ids), batch_size):
+        chunk = product_ids[start:start + batch_size]
+        chunk_ids = set(chunk)
+        updates = {}
+        for location, per_product in by_location.items():
+            whens = [When(product_id=pid, then=Value(d)) for pid, d in per_product.items() if pid in chunk_ids]
+            if not whens:
+                continue
+            stock_field, reserved_field, virtual_field = STOCK_COLUMNS[location]
+            reserved = F(reserved_field) + Case(*whens, default=Value(0), output_field=IntegerField())
+            updates[reserved_field] = reserved
+            updates[virtual_field] = _virtual_stock_expression(stock_field, reserved)
+        Product.objects.filter(product_id__in=chunk).update(**updates)
+    stamp_stock_version(product_ids)
+
+
+# ---------------------------
+# 🔥 Dirty product set: coalesce reservation deltas per transaction
+# ---------------------------
+
+_coalesce_state = threading.local()
+
+
+def _transaction_bucket(connection):
+    """
+    Delta bucket for the current transaction / savepoint, flushed once
+    through on_commit. A bucket whose callback Django has dropped (rollback)
+    is discarded, so rolled back deltas never reach Product.
+    """
+    key = tuple(connection.savepoint_ids)
+    buckets = connection.__dict__.setdefault("_reserved_delta_buckets", {})
+    bucket = buckets.get(key)
+    registered = {entry[1] for entry in connection.run_on_commit}
+    if bucket is None or bucket[0] not in registered:
+        deltas = defaultdict(int)
+
+        def flush():
+            if buckets.get(key) is bucket_entry:
+                del buckets[key]
+            apply_reserved_deltas(deltas)
+
+        bucket_entry = (flush, deltas)
+        buckets[key] = bucket_entry
+        transaction.on_commit(flush, robust=True)
+        bucket = bucket_entry
+    return bucket[1]
+
+
+def mark_reserved_delta(product_id, delta, location=DEFAULT_LOCATION):
+    """
+    Record a reservation change for product_id at a warehouse.
+    - inside coalesce_stock_updates() -> collected, applied when the block exits
+    - inside a transaction -> collected, applied once on commit
+    - autocommit -> applied right away
+    """
+    if not delta:
+        return
+    key = (product_id, normalize_location(location))
+    pending = getattr(_coalesce_state, "deltas", None)
+    if pending is not None:
+        pending[key] += delta
+        return
+
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        apply_reserved_deltas({key: delta})
+        return
+    _transaction_bucket(connection)[key] += delta
+
+
+def upsert_pending_snapshots(order, quantities, location=DEFAULT_LOCATION):
+    """
+    Write the snapshots of `order` ({product_id: qty}) in one upsert on (order, product).
+    bulk writes fire no signals, so the reservation deltas (new - stored) are marked here.
+    """
+    if not quantities:
+        return
+    location = normalize_location(location)
+    stored = {
+        product_id: (quantity, stored_location)
+        for product_id, quantity, stored_location in PendingOrderItemSnapshot.objects
+        .filter(order=order, product_id__in=list(quantities))
+        .values_list("product_id", "quantity", "location")
+    }
+    PendingOrderItemSnapshot.objects.bulk_create(
+        [
+            PendingOrderItemSnapshot(order=order, product_id=product_id, quantity=quantity, location=location)
+            for product_id, quantity in quantities.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["order", "product"],
+        update_fields=["quantity", "location"],
+    )
+    for product_id, quantity in quantities.items():
+        old_qty, old_location = stored.get(product_id, (0, location))
+        mark_reserved_delta(product_id, -old_qty, old_location)
+        mark_reserved_delta(product_id, quantity, location)
+
+
+@contextmanager
+def coalesce_stock_updates():
+    """
+    Suspend per-row stock updates for a bulk operation.
+    All snapshot changes inside the block are summed per product and
+    applied once on exit (deferred to on_commit if a transaction is open).
+    Yields the {(product_id, location): delta} being collected.
+    """
+    if getattr(_coalesce_state, "deltas", None) is not None:
+        # nested -> outer block flushes
+        yield _coalesce_state.deltas
+        return
+
+    _coalesce_state.deltas = defaultdict(int)
+    try:
+        yield _coalesce_state.deltas
+    finally:
+        deltas = _coalesce_state.deltas
+        _coalesce_state.deltas = None
+        connection = transaction.get_connection()
+        if connection.in_atomic_block:
+            bucket = _transaction_bucket(connection)
+            for key, delta in deltas.items():
+                bucket[key] += delta
+        else:
+            apply_reserved_deltas(deltas)
+
+
+def lock_products(product_ids):
+    """
+    Lock the Product rows of product_ids until the transaction ends.
+    - Always in product_id order -> two lockers can never deadlock
+    - Only these rows: orders on other products keep running in parallel
+    - DBs without SELECT ... FOR UPDATE (SQLite) take the write lock up front
+      with a no-op UPDATE instead
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return []
+    connection = transaction.get_connection()
+    products = Product.objects.filter(product_id__in=product_ids).order_by("product_id").only("product_id", *STOCK_FIELDS)
+    if connection.features.has_select_for_update:
+        # NO KEY UPDATE: FK inserts (order items / snapshots) on these products don't wait on us
+        products = products.select_for_update(no_key=connection.features.has_select_for_no_key_update)
     else:
-        vs = product.live_stock - pending_qty
-        if vs < 0:
-            vs = 0
-
-    product.virtual_stock = vs
-    if save:
-        product.save(update_fields=["virtual_stock"])
-    return vs
+        Product.objects.filter(product_id__in=product_ids).update(reserved_qty=F("reserved_qty"))
+    return list(products)
+
+
+def reservation_shortages(products, lines, location=DEFAULT_LOCATION, held=None):
+    """
+    Locked products (lock_products) + lines ({product_id: qty}) -> shortages
+    [{"product_id", "requested", "available"}] at `location`.
+    held: {product_id: qty} the order already reserves there (counts as available).
+    """
+    stock_field, reserved_field, _ = STOCK_COLUMNS[normalize_location(location)]
+    held = held or {}
+    shortages = []
+    for product in products:
+        if product.product_id not in lines:
+            continue
+        stock = getattr(product, stock_field)
+        if stock is None:
+            continue  # stock not tracked for this warehouse
+        requested = lines[product.product_id]
+        available = max(stock - getattr(product, reserved_field), 0) + held.get(product.product_id, 0)
+        if requested > available:
+            shortages.append({"product_id": product.product_id, "requested": requested, "available": available})
+    return shortages
+
+
+@contextmanager
+def locked_reservation(lines, location=DEFAULT_LOCATION, order=None):
+    """
+    Reserve stock for lines ({product_id: qty}) at a warehouse under row locks.
+    - Opens a transaction and locks only those Product rows (lock_products)
+    - Yields shortages: [{"product_id", "requested", "available"}] against the
+      virtual stock of `location` (qty `order` already reserves there counts as available)
+    - Snapshot deltas made inside the block are written before commit,
+      so the next order on the same product sees them once the lock is free
+    """
+    location = normalize_location(location)
+
+    with transaction.atomic():
+        products = lock_products(lines)
+        held = {}
+        if order is not None and products:
+            held = dict(
+                PendingOrderItemSnapshot.objects.filter(order=order, location=location)
+                .values_list("product_id", "quantity")
+            )
+
+        shortages = reservation_shortages(products, lines, location, held)
+
+        outer = getattr(_coalesce_state, "deltas", None)
+        _coalesce_state.deltas = defaultdict(int)
+        try:
+            yield shortages
+        finally:
+            deltas, _coalesce_state.deltas = _coalesce_state.deltas, outer
+        apply_reserved_deltas(deltas)
+
+
+def recalculate_virtual_stock(product, save=True):
+    """
+    Recalculate virtual stock (Delhi + Mumbai) for a single Product instance.
+    - If the warehouse stock is None -> its virtual stock will be set to None.
+    - Else -> virtual = max(stock - reserved, 0)
+    Returns the computed Delhi virtual_stock (None or int).
+    """
+    changed = _set_virtual_stock(product)
+    if save and changed:
+        product.save(update_fields=changed)
+        stamp_stock_version([product.product_id])
+    return product.virtual_stock
+
+
+def recalculate_virtual_stock_bulk(product_ids=None, batch_size=500):
+    """
+    Recalculate virtual stock of every warehouse for many products in one pass.
+    - product_ids=None -> whole catalogue
+    - One read of stock/reserved columns + one bulk_update
+    Returns {product_id: (old_virtual_stock, new_virtual_stock)} (Delhi) for the
+    products where any virtual column actually changed.
+    """
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return {}
+
+    products = Product.objects.only("product_id", *STOCK_FIELDS)
+    if product_ids is not None:
+        products = products.filter(product_id__in=product_ids)
+
+    changes = {}
+    to_update = []
+    for product in products:
+        old = product.virtual_stock
+        if _set_virtual_stock(product):
+            changes[product.product_id] = (old, product.virtual_stock)
+            to_update.append(product)
+
+    if to_update:
+        virtual_fields = [columns[2] for columns in STOCK_COLUMNS.values()]
+        Product.objects.bulk_update(to_update, virtual_fields, batch_size=batch_size)
+        stamp_stock_version(changes)
+    return changes
+
+
+def rebuild_reserved_qty(product_ids=None, batch_size=500):
+    """
+    Recovery path: re-derive reserved columns from PendingOrderItemSnapshot.
+    - One grouped SUM by (product, location) + one bulk_update of reserved/virtual columns
+    Returns {(product_id, location): (old_reserved, new_reserved)} for drifted products.
+    """
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return {}
+
+    products = Product.objects.only(
+        "product_id", *STOCK_FIELDS
+    ).select_for_update().order_by("product_id")
+    snapshots = PendingOrderItemSnapshot.objects.all()
+    if product_ids is not None:
+        products = products.filter(product_id__in=product_ids)
+        snapshots = snapshots.filter(product_id__in=product_ids)
+
+    with transaction.atomic():
+        # lock first so concurrent delta updates wait for the rebuilt value
+        products = list(products)
+        pending = {
+            (product_id, location): total
+            for product_id, location, total in snapshots.values_list("product_id", "location")
+            .annotate(total=Sum("quantity")).order_by()
+        }
+
+        changes = {}
+        to_update = []
+        for product in products:
+            dirty = False
+            for location, (_, reserved_field, _) in STOCK_COLUMNS.items():
+                reserved = pending.get((product.product_id, location), 0)
+                if getattr(product, reserved_field) != reserved:
+                    changes[(product.product_id, location)] = (getattr(product, reserved_field), reserved)
+                    setattr(product, reserved_field, reserved)
+                    dirty = True
+            if _set_virtual_stock(product) or dirty:
+                to_update.append(product)
+
+        if to_update:
+            fields = [field for columns in STOCK_COLUMNS.values() for field in columns[1:]]
+            Product.objects.bulk_update(to_update, fields, batch_size=batch_size)
+            stamp_stock_version(p.product_id for p in to_update)
+    return changes
+
+
+# ---------------------------
+# 🔥 Reservation audit: stale / orphaned snapshots + drifted stock columns
+# ---------------------------
+
+RESERVING_STATUSES = ("PENDING", "APPROVED")
+
+
+def _bad_snapshot_filter():
+    """Snapshots that should not reserve stock (order closed, or line no longer in the order)."""
+    in_order = Exists(SSOrderItem.objects.filter(
+        order_id=OuterRef("order_id"), product_id=OuterRef("product_id"),
+    ))
+    in_verified = Exists(CRMVerifiedOrderItem.objects.filter(
+        crm_order__original_order_id=OuterRef("order_id"),
+        product_id=OuterRef("product_id"),
+        is_rejected=False,
+    ))
+    return ~Q(order__status__in=RESERVING_STATUSES) | (~in_order & ~in_verified)
+
+
+def audit_reservations(fix=False):
+    """
+    Compare Product reserved/virtual columns with the snapshots that should exist.
+    - 1 query: stale (order not PENDING/APPROVED) + orphaned (no order line) snapshots
+    - 1 query: grouped SUM of the valid snapshots by (product, location)
+    - 1 query: stock/reserved/virtual columns of the catalogue
+    fix=True -> bad snapshots deleted in one statement, drifted products rebuilt
+    via rebuild_reserved_qty().
+    Returns {"stale": [...], "orphaned": [...], "drift": {product_id: {field: (current, expected)}}}
+    """
+    bad = list(
+        PendingOrderItemSnapshot.objects.filter(_bad_snapshot_filter())
+        .values("id", "order_id", "order__status", "product_id", "location", "quantity")
+        .order_by("id")
+    )
+    stale = [row for row in bad if row["order__status"] not in RESERVING_STATUSES]
+    orphaned = [row for row in bad if row["order__status"] in RESERVING_STATUSES]
+
+    expected_reserved = {
+        (product_id, location): total
+        for product_id, location, total in PendingOrderItemSnapshot.objects
+        .exclude(id__in=[row["id"] for row in bad])
+        .values_list("product_id", "location").annotate(total=Sum("quantity")).order_by()
+    }
+
+    drift = {}
+    for row in Product.objects.values("product_id", *STOCK_FIELDS).iterator(chunk_size=2000):
+        product_id = row["product_id"]
+        for location, (stock_field, reserved_field, virtual_field) in STOCK_COLUMNS.items():
+            reserved = expected_reserved.get((product_id, location), 0)
+            expected = {
+                reserved_field: reserved,
+                virtual_field: _virtual_stock_value(row[stock_field], reserved),
+            }
+            for field, value in expected.items():
+                if row[field] != value:
+                    drift.setdefault(product_id, {})[field] = (row[field], value)
+
+    if fix and (bad or drift):
+        if bad:
+            with coalesce_stock_updates() as deltas:
+                PendingOrderItemSnapshot.objects.filter(id__in=[row["id"] for row in bad]).delete()
+                # released now, not on commit: after the rebuild they would be subtracted twice
+                apply_reserved_deltas(deltas)
+                deltas.clear()
+        # delete signals already released most of it, rebuild settles the rest
+        rebuild_reserved_qty({row["product_id"] for row in bad} | set(drift))
+
+    return {"stale": stale, "orphaned": orphaned, "drift": drift}
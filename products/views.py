@@ -14,6 +14,7 @@ from rest_framework.decorators import action
 from rest_framework.parsers import MultiPartParser
 from orders.models import  PendingOrderItemSnapshot, CRMVerifiedOrderItem, DispatchOrder
 from .models import  Product, SaleName, Scheme
+from .utils import get_change_version, conditional_on_versions, merged_stock_stamps, STOCK_VERSION, CATALOGUE_VERSION
 from .serializers import (  ProductSerializer, SaleNameSerializer,SchemeSerializer, ProductWithSaleNameSerializer)
 
 
@@ -88,57 +89,59 @@ class ProductBulkUpload(APIView):
             created_count = 0
             updated_count = 0
 
-            for _, row in df.iterrows():
-                pid = row["product_id"]
-
-                # check product
-                try:
-                    product = Product.objects.get(product_id=pid)
-                    created = False
-                except Product.DoesNotExist:
-                    product = Product(product_id=pid)
-                    created = True
-
-                # LOOP ONLY COLUMNS PRESENT IN EXCEL
-                for col in df.columns:
-                    if col == "product_id":
-                        continue
-
-                    if col not in updatable_fields:
-                        continue
-
-                    value = row[col]
-
-                    # cartoon_size special cleaning
-                    if col == "cartoon_size":
-                        if pd.notnull(value):
-                            if isinstance(value, float) and value.is_integer():
-                                value = str(int(value))
+            # ✅ one transaction -> catalogue / prices counters bumped once, new products stamped once
+            with transaction.atomic(), merged_stock_stamps():
+                for _, row in df.iterrows():
+                    pid = row["product_id"]
+
+                    # check product
+                    try:
+                        product = Product.objects.get(product_id=pid)
+                        created = False
+                    except Product.DoesNotExist:
+                        product = Product(product_id=pid)
+                        created = True
+
+                    # LOOP ONLY COLUMNS PRESENT IN EXCEL
+                    for col in df.columns:
+                        if col == "product_id":
+                            continue
+
+                        if col not in updatable_fields:
+                            continue
+
+                        value = row[col]
+
+                        # cartoon_size special cleaning
+                        if col == "cartoon_size":
+                            if pd.notnull(value):
+                                if isinstance(value, float) and value.is_integer():
+                                    value = str(int(value))
+                                else:
+                                    value = str(value)
                             else:
-                                value = str(value)
-                        else:
-                            value = None
+                                value = None
 
-                    # price → convert to string always
-                    elif col == "price":
-                        value = str(value) if pd.notnull(value) else None
+                        # price → convert to string always
+                        elif col == "price":
+                            value = str(value) if pd.notnull(value) else None
 
-                    # moq → int if number
-                    elif col == "moq":
-                        value = int(value) if pd.notnull(value) else None
+                        # moq → int if number
+                        elif col == "moq":
+                            value = int(value) if pd.notnull(value) else None
 
-                    # normal fields → ignore NaN
-                    elif pd.isna(value):
-                        value = None
+                        # normal fields → ignore NaN
+                        elif pd.isna(value):
+                            value = None
 
-                    setattr(product, col, value)
+                        setattr(product, col, value)
 
-                product.save()
+                    product.save()
 
-                if created:
-                    created_count += 1
-                else:
-                    updated_count += 1
+                    if created:
+                        created_count += 1
+                    else:
+                        updated_count += 1
 
             return Response({
                 "message": "Bulk upload completed",
@@ -226,6 +229,7 @@ class SchemeViewSet(viewsets.ModelViewSet):
 
 
 @api_view(['GET'])
+@conditional_on_versions(CATALOGUE_VERSION, vary_on_role=True)
 def get_all_products_with_salenames(request):
     products = Product.objects.prefetch_related('sale_names').order_by('product_id')
     
@@ -234,17 +238,48 @@ def get_all_products_with_salenames(request):
     return Response(serializer.data)
 
 
+def stock_feed(request, fields):
+    """
+    Full list (cursor in X-Stock-Cursor header) or, with ?since=<cursor>,
+    only products whose stock_version moved past the cursor.
+    """
+    since = request.query_params.get("since")
+    cursor = get_change_version(STOCK_VERSION)
+
+    if since is None:
+        products = Product.objects.values(*fields)
+        response = Response(products)
+        response["X-Stock-Cursor"] = str(cursor)
+        return response
+
+    try:
+        since = int(since)
+    except ValueError:
+        return Response({"error": "since must be an integer cursor"}, status=400)
+
+    # ✅ Up to date client -> empty response, no product query
+    if since >= cursor:
+        return Response({"cursor": cursor, "results": []})
+
+    products = Product.objects.filter(
+        stock_version__gt=since, stock_version__lte=cursor
+    ).values(*fields)
+    return Response({"cursor": cursor, "results": list(products)})
+
+
 @api_view(['GET'])
+@conditional_on_versions(STOCK_VERSION, CATALOGUE_VERSION)
 def get_virtual_stock(request):
-    products = Product.objects.values("product_id", "virtual_stock")
-    return Response(products)
+    # Delhi + Mumbai reservation-aware stock in one pass
+    return stock_feed(request, ["product_id", "virtual_stock", "mumbai_virtual_stock"])
 
 @api_view(['GET'])
+@conditional_on_versions(STOCK_VERSION, CATALOGUE_VERSION)
 def get_mumbai_stock(request):
-    products = Product.objects.values("product_id", "mumbai_stock")
-    return Response(products)
+    return stock_feed(request, ["product_id", "mumbai_stock", "mumbai_virtual_stock"])
 
 @api_view(['GET'])
+@conditional_on_versions(CATALOGUE_VERSION)
 def get_inactive_products(request):
     products = Product.objects.filter(is_active=False).prefetch_related('sale_names').order_by('product_id')
     serializer = ProductWithSaleNameSerializer(products, many=True)